@@ -0,0 +1,674 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Asyncio-native serving of the catalog's JSON API. GET requests to the  #
+# categories and items API, and the stock streams of category pages,     #
+# run on the event loop against SQLite via aiosqlite, so thousands of    #
+# clients can hold connections open without a thread each; every other  #
+# route is handed to the Flask app on a thread pool. Models, request     #
+# parsing and validation, paging and the response cache are shared with  #
+# views.py. Serve with any ASGI server, e.g.                             #
+#                                                                        #
+#   uvicorn asgi:app --host 127.0.0.1 --port 5050                        #
+##########################################################################
+
+import asyncio
+import collections
+import json
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlencode
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import http_date, parse_etags, quote_etag
+
+from models import CatalogVersion
+import cache
+import changes
+import config
+import stockstream
+import versions
+import views
+
+
+#############
+# CONSTANTS #
+#############
+
+JSON_HEADERS = [(b"content-type", b"application/json")]
+
+# Largest request body accepted for routes handed to the Flask app
+MAX_BODY_BYTES = config.MAX_IMAGE_BYTES + 1024 * 1024
+
+# Request bodies handed to the Flask app are kept in memory up to this
+# size (bytes), and spooled to a temporary file beyond it
+BODY_MEMORY_BYTES = 1024 * 1024
+
+# Chunks of a Flask response body read ahead of a slow client
+BODY_CHUNKS_AHEAD = 8
+
+STOCK_STREAM_PATH = "/api/stock/stream"
+
+STOCK_STREAM_HEADERS = [(b"content-type", b"text/event-stream; charset=utf-8"),
+                        (b"cache-control", b"no-cache"),
+                        (b"x-accel-buffering", b"no")]
+
+
+##################
+# INITIALIZATION #
+##################
+
+def createAsyncEngine(url=config.DATABASE_URL):
+    """ Create an aiosqlite engine for the catalog database, pooled like
+    models.createEngine(). """
+    if not url.startswith("sqlite:"):
+        raise RuntimeError("The async API supports SQLite databases only.")
+    return create_async_engine(
+               url.replace("sqlite:", "sqlite+aiosqlite:", 1),
+               poolclass=AsyncAdaptedQueuePool,
+               pool_size=config.DB_POOL_SIZE,
+               max_overflow=config.DB_MAX_OVERFLOW,
+               pool_timeout=config.DB_POOL_TIMEOUT,
+               pool_recycle=config.DB_POOL_RECYCLE,
+               connect_args={"timeout": config.DB_BUSY_TIMEOUT}
+           )
+
+
+engine = createAsyncEngine()
+Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+
+# Threads running the Flask app for the routes not served natively
+wsgi_pool = ThreadPoolExecutor(max_workers=config.ASGI_WSGI_THREADS,
+                               thread_name_prefix="wsgi")
+
+# Fanout of each category with open stock streams, by category ID
+stock_fanouts = {}
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+def jsonBody(data):
+    """ Encode data exactly as Flask's jsonify() does, so cached bodies are
+    interchangeable between both serving modes. """
+    return (json.dumps(data, separators=(",", ":"), sort_keys=True)
+            + "\n").encode()
+
+
+def jsonResponse(data, status=200):
+    """ Return the (status, headers, body) triple of a JSON response. """
+    return status, list(JSON_HEADERS), jsonBody(data)
+
+
+def jsonRespObj(status, message):
+    """ Return the error response views.jsonRespObj() would. """
+    return jsonResponse({"status": status, "message": message}, status)
+
+
+def badRequestError(scope):
+    """ Return the response of views.badRequestError(). """
+    host = dict(scope["headers"]).get(b"host", b"").decode("latin-1")
+    return jsonRespObj(400, "Bad route on '{}://{}{}' API endpoint."
+                            .format(scope["scheme"], host, scope["path"]))
+
+
+def cacheKey(path, args):
+    """ Return the key views.cacheKey() gives the same request. """
+    return path + "?" + urlencode(sorted(args.items(multi=True)))
+
+
+async def fetchAll(session, statement):
+    """ Return every ORM object selected by a statement. """
+    return (await session.execute(statement)).scalars().all()
+
+
+async def exportRows(session, read):
+    """ Yield every row of a views.ExportRead in batches read in short
+    transactions of their own, like views.exportRows(). The session
+    returns its connection to the pool before each batch is sent. """
+    while True:
+        rows, more = read.batchResult(await fetchAll(session, read.batch()))
+        await session.close()
+        for row in rows:
+            yield row
+        if not more:
+            return
+
+
+async def streamJSONList(key, rows):
+    """ Yield {key: [...]} built from the rows of exportRows() in chunks,
+    like views.streamJSONList(). """
+    chunk = ['{{"{}":['.format(key)]
+    size = 0
+    separator = ""
+    async for row in rows:
+        text = separator + json.dumps(row.serialize, sort_keys=True,
+                                      separators=(",", ":"))
+        separator = ","
+        chunk.append(text)
+        size += len(text)
+        if size >= views.EXPORT_CHUNK_BYTES:
+            yield "".join(chunk).encode()
+            chunk = []
+            size = 0
+    chunk.append("]}")
+    yield "".join(chunk).encode()
+
+
+def categoriesScope(args):
+    """ Return the version scope of a categories API request. """
+    return versions.CATEGORIES_SCOPE
+
+
+def itemsScope(args):
+    """ Return the version scope of an items API request. """
+    if "category_id" in args and args.get("mode") in (None, "export"):
+        return views.categoryScope(args["category_id"])
+    return versions.CATALOG_SCOPE
+
+
+##############
+# API ROUTES #
+##############
+
+async def runRead(scope, session, read):
+    """ Run the views.APIRead (or error) parsed from a request and return
+    its response, like views.readResponse(). """
+    if read is None:
+        return badRequestError(scope)
+    if isinstance(read, tuple):
+        return jsonRespObj(*read)
+    if isinstance(read, views.ExportRead):
+        return 200, list(JSON_HEADERS), streamJSONList(
+                   read.key, exportRows(session, read)
+               )
+    rows = [] if read.statement is None \
+        else await fetchAll(session, read.statement)
+    status, data = read.result(rows)
+    return jsonResponse(data, status)
+
+
+# Routes served on the event loop: path -> (parser of the request's
+# views.APIRead, version scope). Only their GET requests are served here.
+ROUTES = {
+    "/api/categories/json": (views.categoriesRead, categoriesScope),
+    "/api/items/json": (views.itemsRead, itemsScope)
+}
+
+
+async def syncCatalogCache(session):
+    """ Follow the change log like views.syncCatalogCache(). """
+    follower = views.catalog_changes
+    latest = (await session.execute(changes.LATEST_SEQ)).scalar() or 0
+    if not follower.behind(latest):
+        return
+    entries = [] if follower.seq is None else (await session.execute(
+                  changes.ENTRIES_AFTER,
+                  {"since": follower.seq, "limit": follower.batch}
+              )).fetchall()
+    follower.follow(latest, entries)
+
+
+async def cachedView(scope, session, args, parse):
+    """ Serve a read from the response cache shared with views.py, and
+    cache its successful, unstreamed responses under the tags of the
+    read. """
+    await syncCatalogCache(session)
+    key = cacheKey(scope["path"], args)
+    body = views.catalog_cache.get(key)
+    if body is not cache.MISSING:
+        return 200, list(JSON_HEADERS), body
+    generation = views.catalog_cache.generation
+    read = parse(args)
+    status, headers, body = await runRead(scope, session, read)
+    if status == 200 and isinstance(body, bytes):
+        views.catalog_cache.set(key, body, read.cache_tags,
+                                generation=generation)
+    return status, headers, body
+
+
+async def conditionalView(scope, session, args, route):
+    """ Serve a route like views.conditionalRoute() and cachedRoute() do:
+    with an ETag of its catalog scope's version, answering a matching
+    If-None-Match with an empty 304. """
+    parse, scope_of = route
+    scope_id = scope_of(args)
+    if scope_id is None:
+        return await cachedView(scope, session, args, parse)
+    row = (await session.execute(
+              select(CatalogVersion.version, CatalogVersion.modified)
+              .filter_by(scope=scope_id)
+          )).first()
+    version, modified = (0, None) if row is None else row
+    etag = "{}.{}".format(scope_id, version)
+    if_none_match = dict(scope["headers"]).get(b"if-none-match")
+    if if_none_match is not None and \
+            parse_etags(if_none_match.decode("latin-1")) \
+            .contains_weak(etag):
+        status, headers, body = 304, [], b""
+    else:
+        status, headers, body = await cachedView(scope, session, args,
+                                                 parse)
+        if status != 200:
+            return status, headers, body
+    headers.append((b"etag", quote_etag(etag, weak=True).encode()))
+    if modified is not None:
+        headers.append((b"last-modified", http_date(
+                           datetime.fromtimestamp(modified, timezone.utc)
+                       ).encode()))
+    headers.append((b"cache-control", b"no-cache"))
+    return status, headers, body
+
+
+async def sendResponse(send, status, headers, body):
+    """ Send a response whose body is bytes or an async iterator of
+    bytes. """
+    if isinstance(body, bytes):
+        headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": status,
+                    "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+        return
+    await send({"type": "http.response.start", "status": status,
+                "headers": headers})
+    async for chunk in body:
+        await send({"type": "http.response.body", "body": chunk,
+                    "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def serveAPI(scope, send, route):
+    """ Serve a GET request to one of ROUTES on the event loop. """
+    args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1"),
+                               keep_blank_values=True))
+    # Streamed exports read through the session while they are sent, so
+    # it is only closed afterwards; it holds no connection in between
+    async with Session() as session:
+        status, headers, body = await conditionalView(scope, session, args,
+                                                      route)
+        await sendResponse(send, status, headers, body)
+
+
+################
+# STOCK STREAM #
+################
+
+class StockStream(object):
+    """
+    The events waiting to be sent on one stock stream.
+
+    At most STOCK_STREAM_QUEUE_DEPTH events wait; a stream that falls
+    further behind is ended, and its browser catches up from the change
+    log when it reconnects.
+    """
+
+    def __init__(self, loop, seq):
+        self.loop = loop
+        self.seq = seq
+        self.pending = collections.deque()
+        self.ended = False
+        self.waiter = None
+
+    def push(self, seq, event):
+        """ Queue an event; return False once the stream has ended. """
+        if self.ended:
+            return False
+        if len(self.pending) >= config.STOCK_STREAM_QUEUE_DEPTH:
+            self.end()
+            return False
+        self.pending.append((seq, event))
+        self.wake(False)
+        return True
+
+    def end(self):
+        """ End the stream after the chunk being sent, if any. """
+        self.ended = True
+        self.pending.clear()
+        self.wake(False)
+
+    def wake(self, idle):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(idle)
+
+    async def next(self, timeout):
+        """
+        Return the next chunk to send: every waiting event after the
+        stream's sequence number, or HEARTBEAT if none arrives within
+        timeout seconds. Returns None once the stream has ended.
+        """
+        while not self.ended:
+            if self.pending:
+                events = [event for seq, event in self.pending
+                          if seq > self.seq]
+                self.pending.clear()
+                if events:
+                    return b"".join(events)
+                continue
+            self.waiter = self.loop.create_future()
+            timer = self.loop.call_later(timeout, self.wake, True)
+            try:
+                idle = await self.waiter
+            finally:
+                timer.cancel()
+                self.waiter = None
+            if idle:
+                return stockstream.HEARTBEAT
+        return None
+
+
+class StockFanout(object):
+    """
+    Delivers one category's stock events to every stream of it on the
+    event loop.
+
+    The fanout is a single sink of the broadcaster, so each event crosses
+    from the broadcaster's thread to the loop once however many streams
+    are open, and every stream queues the same bytes.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.streams = set()
+        self.subscribed = None
+        self.closed = False
+
+    def publish(self, seq, event):
+        """ Hand an event to the loop; called by the broadcaster. """
+        if self.closed:
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self.deliver, seq, event)
+        except RuntimeError:
+            # The loop was closed at shutdown
+            return False
+        return True
+
+    def deliver(self, seq, event):
+        """ Queue an event on every stream, forgetting the ended ones. """
+        for stream in list(self.streams):
+            if not stream.push(seq, event):
+                self.streams.discard(stream)
+
+
+async def subscribeStock(category_id, stream):
+    """ Add a stream to its category's fanout, subscribing a new fanout
+    to the broadcaster off the loop. """
+    fanout = stock_fanouts.get(category_id)
+    if fanout is None:
+        loop = asyncio.get_running_loop()
+        fanout = stock_fanouts[category_id] = StockFanout(loop)
+        fanout.subscribed = loop.run_in_executor(
+                                None, views.stock_broadcaster.subscribe,
+                                category_id, fanout
+                            )
+    fanout.streams.add(stream)
+    await asyncio.shield(fanout.subscribed)
+
+
+def unsubscribeStock(category_id, stream):
+    """ Remove a stream from its category's fanout, and the fanout once
+    no stream is left. """
+    stream.end()
+    fanout = stock_fanouts.get(category_id)
+    if fanout is None:
+        return
+    fanout.streams.discard(stream)
+    if not fanout.streams:
+        fanout.closed = True
+        del stock_fanouts[category_id]
+        views.stock_broadcaster.unsubscribe(category_id, fanout)
+
+
+async def waitForDisconnect(receive):
+    """ Return once the client has disconnected. """
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def relayStock(receive, send, stream):
+    """
+    Send a stream's events as they arrive, and a heartbeat after
+    STOCK_STREAM_HEARTBEAT idle seconds, until the client disconnects or
+    the stream is ended. A client that takes longer than that to accept
+    a chunk is disconnected.
+    """
+    disconnected = asyncio.ensure_future(waitForDisconnect(receive))
+    disconnected.add_done_callback(lambda future: stream.end())
+    try:
+        while True:
+            chunk = await stream.next(config.STOCK_STREAM_HEARTBEAT)
+            if chunk is None:
+                break
+            await asyncio.wait_for(send({"type": "http.response.body",
+                                         "body": chunk, "more_body": True}),
+                                   config.STOCK_STREAM_HEARTBEAT)
+        await send({"type": "http.response.body", "body": b""})
+    except asyncio.TimeoutError:
+        # Returning without ending the response closes the connection
+        pass
+    finally:
+        disconnected.cancel()
+
+
+async def streamStock(scope, receive, send):
+    """ Serve a stock stream like views.streamStock(); an open stream
+    costs a few objects on the loop rather than a thread. """
+    args = MultiDict(parse_qsl(scope["query_string"].decode("latin-1"),
+                               keep_blank_values=True))
+    last_event_id = dict(scope["headers"]).get(b"last-event-id")
+    try:
+        category_id, since = stockstream.streamParams(
+                                 args,
+                                 last_event_id and
+                                 last_event_id.decode("latin-1")
+                             )
+    except ValueError:
+        return await sendResponse(send, *jsonRespObj(
+                   422, stockstream.STREAM_PARAMS_MESSAGE
+               ))
+    # Subscribe before reading the stock, so no change falls in between
+    stream = StockStream(asyncio.get_running_loop(), since)
+    try:
+        await subscribeStock(category_id, stream)
+        async with Session() as session:
+            opening = stockstream.openingEvent(
+                          (await session.execute(stockstream.CATCH_UP, {
+                              "category_id": category_id, "since": since
+                          })).fetchall()
+                      )
+        if opening is None:
+            return await sendResponse(send, *jsonRespObj(
+                       404, "No category corresponding to this ID."
+                   ))
+        stream.seq, first = opening
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": list(STOCK_STREAM_HEADERS)})
+        await send({"type": "http.response.body", "body": first,
+                    "more_body": True})
+        await relayStock(receive, send, stream)
+    finally:
+        unsubscribeStock(category_id, stream)
+
+
+##################
+# FLASK FALLBACK #
+##################
+
+def wsgiEnviron(scope, body):
+    """ Return the WSGI environ of an ASGI HTTP request. """
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0],
+        "REMOTE_PORT": str(client[1]),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE" or name == "CONTENT_LENGTH":
+            environ[name] = value
+            continue
+        key = "HTTP_" + name
+        environ[key] = environ[key] + "," + value if key in environ \
+            else value
+    return environ
+
+
+def runWSGI(environ, loop, chunks, stopped):
+    """
+    Run the Flask app for a request, on a wsgi_pool thread, and hand its
+    response to the event loop through the chunks queue: a (status,
+    headers) pair, then each chunk of the body as it is produced, then
+    None (or the exception that ended the response).
+
+    The body is iterated on this one thread, as Flask's streamed
+    responses require. Once stopped is set the rest of the body is
+    dropped; the request body is closed when done.
+    """
+    started = {}
+
+    def startResponse(status, headers, exc_info=None):
+        started["status"] = int(status.split(" ", 1)[0])
+        started["headers"] = headers
+
+    async def offer(item):
+        if not stopped.is_set():
+            await chunks.put(item)
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(offer(item), loop).result()
+
+    def start():
+        if "sent" not in started:
+            started["sent"] = True
+            put((started["status"],
+                 [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                  for name, value in started["headers"]]))
+
+    try:
+        iterable = views.app(environ, startResponse)
+        try:
+            for chunk in iterable:
+                if stopped.is_set():
+                    return
+                if chunk:
+                    start()
+                    put(chunk)
+        finally:
+            if hasattr(iterable, "close"):
+                iterable.close()
+        start()
+        put(None)
+    except Exception as error:
+        put(error)
+    finally:
+        environ["wsgi.input"].close()
+
+
+async def serveFlask(scope, receive, send):
+    """
+    Hand a request to the Flask app on a pool thread.
+
+    The response body is sent chunk by chunk as the app produces it, so
+    exports, large pages and the Flask stock streams are not buffered
+    whole; the app reads at most BODY_CHUNKS_AHEAD chunks ahead of the
+    client.
+    """
+    body = tempfile.SpooledTemporaryFile(max_size=BODY_MEMORY_BYTES)
+    try:
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > MAX_BODY_BYTES:
+                status, headers, data = jsonRespObj(
+                                            413, "Request body too large."
+                                        )
+                await sendResponse(send, status, headers, data)
+                body.close()
+                return
+            body.write(chunk)
+            more_body = message.get("more_body", False)
+        body.seek(0)
+    except BaseException:
+        body.close()
+        raise
+
+    # From here on the pool thread owns the request body
+    chunks = asyncio.Queue(maxsize=BODY_CHUNKS_AHEAD)
+    stopped = threading.Event()
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(wsgi_pool, runWSGI, wsgiEnviron(scope, body),
+                         loop, chunks, stopped)
+    try:
+        item = await chunks.get()
+        if isinstance(item, Exception):
+            raise item
+        status, headers = item
+        await send({"type": "http.response.start", "status": status,
+                    "headers": headers})
+        while True:
+            item = await chunks.get()
+            if isinstance(item, Exception):
+                raise item
+            if item is None:
+                break
+            await send({"type": "http.response.body", "body": item,
+                        "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        # Release a pool thread waiting to hand over another chunk
+        stopped.set()
+        while not chunks.empty():
+            chunks.get_nowait()
+
+
+async def lifespan(receive, send):
+    """ Release the connection pools when the server shuts down. """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await engine.dispose()
+            wsgi_pool.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ ASGI entry point. """
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    route = ROUTES.get(scope["path"])
+    if route is not None and scope["method"] == "GET":
+        return await serveAPI(scope, send, route)
+    if scope["path"] == STOCK_STREAM_PATH and scope["method"] == "GET":
+        return await streamStock(scope, receive, send)
+    return await serveFlask(scope, receive, send)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+############################################################################
+# Compares the threaded Flask server with the ASGI app (asgi.py, served   #
+# by uvicorn) under many concurrent API clients. Each client keeps a      #
+# keep-alive connection open (reconnecting if the server closes it) and   #
+# issues a series of catalog GET requests; latency percentiles,           #
+# throughput, errors and the server's peak RSS are reported per mode.     #
+# Usage: python benchmarks/bench_async_api.py [--clients N ...]           #
+############################################################################
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.load_test import freePort, percentile, RSSSampler  # noqa
+
+FLASK_CODE = """
+import sys
+import views
+views.app.run("127.0.0.1", port=int(sys.argv[1]), threaded=True)
+"""
+
+
+def startServer(mode, port, env):
+    """ Start the app in the given mode and return its process once it
+    answers. """
+    if mode == "asgi":
+        command = [sys.executable, "-m", "uvicorn", "asgi:app",
+                   "--host", "127.0.0.1", "--port", str(port),
+                   "--log-level", "warning", "--backlog", "4096"]
+    else:
+        command = [sys.executable, "-c", FLASK_CODE, str(port)]
+    process = subprocess.Popen(command, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    url = "http://127.0.0.1:{}/api/cache/stats".format(port)
+    for _ in range(300):
+        try:
+            urllib.request.urlopen(url, timeout=1).read()
+            return process
+        except urllib.error.HTTPError:
+            # Answered without a token: the server is up
+            return process
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Server did not start.")
+
+
+async def readResponse(reader):
+    """ Read one HTTP response; return (status, whether the server keeps
+    the connection open). """
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("Connection closed.")
+    version, status = status_line.split()[:2]
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip().lower()
+    if "content-length" in headers:
+        await reader.readexactly(int(headers["content-length"]))
+    elif headers.get("transfer-encoding") == "chunked":
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            await reader.readexactly(size + 2)
+            if size == 0:
+                break
+    else:
+        await reader.read()
+        return int(status), False
+    keep_alive = version == b"HTTP/1.1" and \
+        headers.get("connection") != "close"
+    return int(status), keep_alive
+
+
+async def runClient(port, paths, latencies, errors, timeout):
+    """ Issue requests for paths over one kept-alive connection. """
+    connection = None
+    for path in paths:
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.wait_for(
+                                 asyncio.open_connection("127.0.0.1", port),
+                                 timeout
+                             )
+            reader, writer = connection
+            writer.write("GET {} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n"
+                         .format(path).encode())
+            status, keep_alive = await asyncio.wait_for(
+                                     readResponse(reader), timeout
+                                 )
+            if status != 200:
+                errors.append(status)
+            latencies.append(time.perf_counter() - start)
+            if not keep_alive:
+                writer.close()
+                connection = None
+        except (OSError, ConnectionError, asyncio.TimeoutError,
+                asyncio.IncompleteReadError, ValueError) as error:
+            errors.append(type(error).__name__)
+            if connection is not None:
+                connection[1].close()
+                connection = None
+    if connection is not None:
+        connection[1].close()
+
+
+def clientPaths(rng, count, categories, items):
+    """ Return a client's mix of item, category page and list requests. """
+    paths = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.5:
+            paths.append("/api/items/json?id={}".format(rng.randint(1, items)))
+        elif kind < 0.9:
+            paths.append("/api/items/json?category_id={}&limit=20&sort={}"
+                         .format(rng.randint(1, categories),
+                                 rng.choice(["price", "-price", "stock"])))
+        else:
+            paths.append("/api/categories/json?mode=list&limit=50")
+    return paths
+
+
+async def swarm(port, clients, requests_per_client, categories, items,
+                timeout, seed):
+    """ Run all clients concurrently and return their results. """
+    rng = random.Random(seed)
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        runClient(port, clientPaths(rng, requests_per_client, categories,
+                                    items), latencies, errors, timeout)
+        for _ in range(clients)
+    ])
+    return latencies, errors, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Benchmark the Flask and ASGI serving modes."
+             )
+    parser.add_argument("--clients", type=int, nargs="+", default=[1000])
+    parser.add_argument("--requests-per-client", type=int, default=20)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--items-per-category", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=60,
+                        help="seconds before a request counts as failed")
+    parser.add_argument("--modes", nargs="+", default=["flask", "asgi"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = dict(os.environ)
+        env["CATALOG_DATABASE_URL"] = "sqlite:///" + \
+            os.path.join(tmp_dir, "async.db")
+        env.setdefault("CATALOG_SECRET_KEYS", "async-bench-key")
+        env["CATALOG_METRICS_ENABLED"] = "0"
+        subprocess.run([sys.executable, "populate_db.py",
+                        "--categories", str(args.categories),
+                        "--items-per-category", str(args.items_per_category),
+                        "--seed", "1"],
+                       cwd=ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        items = args.categories * args.items_per_category
+
+        results = []
+        for mode in args.modes:
+            for clients in args.clients:
+                port = freePort()
+                process = startServer(mode, port, env)
+                sampler = RSSSampler(process.pid)
+                sampler.start()
+                try:
+                    latencies, errors, seconds = asyncio.run(swarm(
+                        port, clients, args.requests_per_client,
+                        args.categories, items, args.timeout, seed=clients
+                    ))
+                finally:
+                    peak_kb = sampler.stop()
+                    process.terminate()
+                    process.wait()
+                latencies.sort()
+                results.append({
+                    "mode": mode,
+                    "clients": clients,
+                    "requests": clients * args.requests_per_client,
+                    "completed": len(latencies),
+                    "errors": len(errors),
+                    "error_kinds": sorted(set(map(str, errors))),
+                    "requests_per_second": round(len(latencies) / seconds),
+                    "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+                    "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+                    "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+                    "peak_rss_mb": round(peak_kb / 1024, 1)
+                })
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Compares item insertion throughput of the single-row /api/add/item     #
+# route with the /api/add/items batch route, in-process via the Flask   #
+# test client. Usage: python benchmarks/bench_batch_insert.py           #
+##########################################################################
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USERNAME = "bench@example.com"
+PASSWORD = "BenchPassword1"
+
+
+def itemRow(index):
+    """ Return the fields of a generated item. """
+    return {
+        "name": "Bench item {}".format(index),
+        "category_id": 1,
+        "price": str(index % 500 + 1),
+        "stock": index % 100,
+        "description": "Generated for the batch insert benchmark."
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Benchmark single-row against batch inserts."
+             )
+    parser.add_argument("--single-rows", type=int, default=2000)
+    parser.add_argument("--batch-rows", type=int, default=50000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["CATALOG_DATABASE_URL"] = \
+            "sqlite:///" + os.path.join(tmp_dir, "catalog.db")
+        os.environ["CATALOG_SECRET_KEYS"] = os.urandom(32).hex()
+        os.environ["CATALOG_BCRYPT_LOG_ROUNDS"] = "4"
+        os.chdir(ROOT)
+        import views
+
+        client = views.app.test_client()
+        client.post("/api/registration",
+                    query_string={"username": USERNAME,
+                                  "password": PASSWORD})
+        token = client.post("/api/tokens",
+                            query_string={"username": USERNAME,
+                                          "password": PASSWORD}
+                            ).get_json()["token"]
+        client.post("/api/add/categories", query_string={"token": token},
+                    json={"Categories": [{"name": "Bench"}]})
+
+        start = time.perf_counter()
+        for index in range(args.single_rows):
+            query = itemRow(index)
+            query["token"] = token
+            client.post("/api/add/item", query_string=query)
+        single_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for offset in range(0, args.batch_rows, args.batch_size):
+            rows = [itemRow(index) for index in
+                    range(offset, min(offset + args.batch_size,
+                                      args.batch_rows))]
+            client.post("/api/add/items", query_string={"token": token},
+                        json={"Items": rows})
+        batch_seconds = time.perf_counter() - start
+
+        stored = views.db_session.query(views.Item).count()
+
+    print(json.dumps({
+        "single_row": {
+            "rows": args.single_rows,
+            "rows_per_s": round(args.single_rows / single_seconds)
+        },
+        "batch": {
+            "rows": args.batch_rows,
+            "batch_size": args.batch_size,
+            "rows_per_s": round(args.batch_rows / batch_seconds)
+        },
+        "rows_stored": stored
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+############################################################################
+# Times deleting a large category the way the routes used to (loading      #
+# and deleting each item through the ORM) against the set-based delete,    #
+# with the search index and version triggers in place. Checks that the     #
+# set-based delete logs the category's delete once, not once per item.     #
+# Usage: python benchmarks/bench_delete_category.py [--items N]            #
+############################################################################
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import text
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def deleteRowByRow(db_session, category):
+    """ Delete a category as the routes did before set-based deletes. """
+    from models import Item
+
+    items = db_session.query(Item).filter_by(category_id=category.id).all()
+    for item in items:
+        db_session.delete(item)
+    db_session.delete(category)
+    return len(items)
+
+
+def countLogged(db_session, since):
+    """ Return the number of change log entries after since. """
+    return db_session.execute(text("SELECT COUNT(*) FROM catalog_change "
+                                   "WHERE seq > :since"),
+                              {"since": since}).scalar()
+
+
+def timeDelete(db_session, category_id, delete):
+    """ Return the seconds taken to delete and commit a category, and the
+    number of items deleted with it. """
+    from models import Category
+
+    start = time.perf_counter()
+    category = db_session.query(Category).filter_by(id=category_id).one()
+    deleted = delete(db_session, category)
+    db_session.commit()
+    return round(time.perf_counter() - start, 2), deleted
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Benchmark deleting a large category."
+             )
+    parser.add_argument("--items", type=int, default=100000,
+                        help="items in the deleted category")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "delete.db")
+        os.environ["CATALOG_DATABASE_URL"] = "sqlite:///" + db_path
+        os.environ.setdefault("CATALOG_SECRET_KEYS", "delete-bench-key")
+
+        from models import createEngine, engine
+        import populate_db
+
+        # A second, equally large category must survive the delete
+        conn = engine.raw_connection()
+        try:
+            populate_db.loadGeneratedData(conn, 2, args.items, 1, 100000)
+        finally:
+            conn.close()
+
+        # Importing the app creates the search index and version triggers
+        # that fire for every deleted row. It reads its client secret
+        # relative to the working directory.
+        os.chdir(ROOT)
+        import views
+        engine.dispose()
+
+        results = {}
+        failures = []
+        for name, delete in [
+            ("row_by_row", deleteRowByRow),
+            ("set_based",
+             lambda db_session, category:
+                 views.deleteCategoryWithItems(category))
+        ]:
+            copy_path = os.path.join(tmp_dir, name + ".db")
+            shutil.copyfile(db_path, copy_path)
+            copy_engine = createEngine("sqlite:///" + copy_path)
+            views.db_session.remove()
+            views.db_session.configure(bind=copy_engine)
+            try:
+                since = views.db_session.execute(
+                            text("SELECT COALESCE(MAX(seq), 0) "
+                                 "FROM catalog_change")
+                        ).scalar()
+                seconds, deleted = timeDelete(views.db_session, 1, delete)
+                logged = countLogged(views.db_session, since)
+            finally:
+                views.db_session.remove()
+                copy_engine.dispose()
+            results[name] = {"seconds": seconds, "items_deleted": deleted,
+                             "entries_logged": logged}
+            if name == "set_based" and logged != 1:
+                failures.append("set-based delete logged {} entries"
+                                .format(logged))
+
+    print(json.dumps({"items": args.items, "results": results,
+                      "failures": failures}, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+############################################################################
+# Compares the peak memory and time of streaming every item with           #
+# /api/items/json?mode=export against building the whole response with     #
+# jsonify(), then checks that a paused export lets writers commit.         #
+# Usage: python benchmarks/bench_export.py [--items N ...]                 #
+############################################################################
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def measure(function):
+    """ Run function and return (peak traced memory in MB, seconds). """
+    tracemalloc.start()
+    start = time.perf_counter()
+    function()
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return round(peak / 1024 / 1024, 1), round(seconds, 2)
+
+
+def checkExportReleasesDatabase(client, engine, db_path):
+    """
+    Pause a sorted export after its first chunk and check that it holds no
+    pooled connection and that a writer can commit meanwhile; then check
+    that the export holds every item once, in order.
+    """
+    response = client.get("/api/items/json?mode=export&sort=-price",
+                          buffered=False)
+    chunks = iter(response.response)
+    body = [next(chunks)]
+    checked_out = engine.pool.checkedout()
+    writer = sqlite3.connect(db_path, timeout=1)
+    try:
+        writer.execute("UPDATE item SET stock = stock WHERE id = 1")
+        writer.commit()
+        writer_blocked = False
+    except sqlite3.OperationalError:
+        writer_blocked = True
+    finally:
+        writer.close()
+    body.extend(chunks)
+    response.close()
+    items = json.loads(b"".join(body))["Items"]
+    order = [(-item["price_cents"], -item["id"]) for item in items]
+    reader = sqlite3.connect(db_path)
+    try:
+        count = reader.execute("SELECT COUNT(*) FROM item").fetchone()[0]
+    finally:
+        reader.close()
+    assert order == sorted(order) and len(items) == count
+    assert checked_out == 0 and not writer_blocked
+    return {"paused_connections": checked_out,
+            "writer_blocked": writer_blocked, "exported": len(items)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Benchmark streamed item exports."
+             )
+    parser.add_argument("--items", type=int, nargs="+",
+                        default=[10000, 100000, 300000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "export.db")
+        os.environ["CATALOG_DATABASE_URL"] = "sqlite:///" + db_path
+        os.environ.setdefault("CATALOG_SECRET_KEYS", "export-bench-key")
+        os.environ["CATALOG_METRICS_ENABLED"] = "0"
+
+        from models import Item, engine
+        import populate_db
+
+        # The app reads its client secret relative to the working directory
+        os.chdir(ROOT)
+        import views
+
+        client = views.app.test_client()
+        results = []
+        loaded = 0
+        for count in sorted(args.items):
+            conn = engine.raw_connection()
+            try:
+                populate_db.loadGeneratedData(conn, 1, count - loaded, 1,
+                                              100000)
+            finally:
+                conn.close()
+            loaded = count
+
+            def stream():
+                response = client.get("/api/items/json?mode=export",
+                                      buffered=False)
+                received = sum(len(chunk) for chunk in response.response)
+                response.close()
+                assert received > 0
+
+            def materialize():
+                with views.app.test_request_context():
+                    items = views.db_session.query(Item).all()
+                    body = views.jsonify(
+                               Items=[item.serialize for item in items]
+                           ).get_data()
+                    views.db_session.remove()
+                    assert body.startswith(b"{")
+
+            stream_mb, stream_s = measure(stream)
+            jsonify_mb, jsonify_s = measure(materialize)
+            results.append({
+                "items": count,
+                "stream_peak_mb": stream_mb,
+                "stream_s": stream_s,
+                "jsonify_peak_mb": jsonify_mb,
+                "jsonify_s": jsonify_s
+            })
+
+        results.append(checkExportReleasesDatabase(client, engine,
+                                                   db_path))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
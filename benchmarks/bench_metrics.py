@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+############################################################################
+# Measures the per-request cost of the timing middleware: the request      #
+# hooks, one timed phase and a few query events, without the rest of the   #
+# app. Usage: python benchmarks/bench_metrics.py [--requests N]            #
+############################################################################
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+
+import metrics  # noqa: E402
+
+
+def timeBareRequests(app, count):
+    """ Return the mean cost in microseconds of a trivial Flask request,
+    to put the middleware cost in proportion. """
+    client = app.test_client()
+    start = time.perf_counter()
+    for _ in range(count):
+        client.get("/")
+    return (time.perf_counter() - start) / count * 1e6
+
+
+class FakeConnection(object):
+    """ Stand-in for the connection passed to cursor event listeners. """
+
+    def __init__(self):
+        self.info = {}
+
+
+def timeRequests(app, count, queries, instrumented):
+    """ Return the mean cost in microseconds of simulated requests. """
+    response = app.response_class("{}", mimetype="application/json")
+    conn = FakeConnection()
+    with app.test_request_context("/"):
+        start = time.perf_counter()
+        for _ in range(count):
+            if instrumented:
+                metrics.startRequest()
+                for _ in range(queries):
+                    metrics.beforeCursorExecute(conn, None, None, None,
+                                                None, False)
+                    metrics.afterCursorExecute(conn, None, None, None,
+                                               None, False)
+                with metrics.timed("serialize"):
+                    pass
+                metrics.finishRequest(response)
+            else:
+                with metrics.timed("serialize"):
+                    pass
+        return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Benchmark the request timing middleware."
+             )
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=3)
+    args = parser.parse_args()
+    app = Flask(__name__)
+    app.add_url_rule("/", "index", lambda: "{}")
+
+    disabled = timeRequests(app, args.requests, args.queries, False)
+    metrics.enabled = True
+    enabled = timeRequests(app, args.requests, args.queries, True)
+    bare = timeBareRequests(app, args.requests // 10)
+
+    print(json.dumps({
+        "requests": args.requests,
+        "queries_per_request": args.queries,
+        "disabled_us": round(disabled, 3),
+        "enabled_us": round(enabled, 3),
+        "bare_flask_request_us": round(bare, 3)
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
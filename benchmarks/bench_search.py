@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+############################################################################
+# Compares the FTS5 item search against the legacy LIKE '%q%' scan on a    #
+# generated catalog. Usage: python benchmarks/bench_search.py [--rows N]  #
+############################################################################
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine  # noqa: E402
+
+
+# Syllables combined into a synthetic vocabulary of a realistic size
+SYLLABLES = ["ba", "co", "de", "fi", "ga", "ho", "ki", "lu", "ma", "ne",
+             "po", "qua", "ri", "sa", "te", "vo", "wi", "xe", "yo", "zu"]
+
+LIKE_SQL = "SELECT * FROM item WHERE name LIKE ? LIMIT ?"
+
+
+def buildVocabulary(rng, size):
+    """ Return a list of distinct pronounceable words. """
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES)
+                          for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def generateRows(count, words, rng):
+    """ Yield item rows with Zipf-distributed words in name/description. """
+    cum_weights = list(itertools.accumulate(
+                      1.0 / rank for rank in range(1, len(words) + 1)
+                  ))
+    for item_id in range(1, count + 1):
+        name = " ".join(rng.choices(words, cum_weights=cum_weights, k=3))
+        description = " ".join(rng.choices(words, cum_weights=cum_weights,
+                                           k=12))
+        yield (item_id, name, description, 500, 1, rng.randint(1, 50))
+
+
+def timeQueries(conn, sql, params_list):
+    """ Run each query and return the latencies in milliseconds. """
+    latencies = []
+    for params in params_list:
+        start = time.perf_counter()
+        conn.execute(sql, params).fetchall()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def summarize(latencies):
+    """ Return median and p95 of a list of latencies. """
+    ordered = sorted(latencies)
+    return {
+        "median_ms": round(statistics.median(ordered), 3),
+        "p95_ms": round(ordered[int(len(ordered) * 0.95) - 1], 3)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Benchmark FTS5 search against LIKE scans."
+             )
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+    words = buildVocabulary(rng, args.vocabulary)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "bench.db")
+        # Importing the models opens (and upgrades) the configured database
+        os.environ["CATALOG_DATABASE_URL"] = "sqlite:///" + db_path
+        from models import Base
+        import search
+
+        engine = create_engine("sqlite:///" + db_path)
+        Base.metadata.create_all(engine)
+
+        conn = sqlite3.connect(db_path)
+        with conn:
+            conn.executemany(
+                "INSERT INTO item (id, name, description, price_cents, stock, "
+                "category_id) VALUES (?, ?, ?, ?, ?, ?)",
+                generateRows(args.rows, words, rng)
+            )
+
+        start = time.perf_counter()
+        search.createSearchIndex(engine)
+        index_seconds = time.perf_counter() - start
+
+        # Simulate a search box: whole words and 3-letter prefixes
+        words_queried = [rng.choice(words) for _ in range(args.queries)]
+        workloads = {
+            "word": words_queried,
+            "prefix": [word[:3] for word in words_queried]
+        }
+        fts_sql = search.ITEM_SEARCH_SQL.replace(":match", "?") \
+                                        .replace(":limit", "?")
+        results = {}
+        for workload, terms in workloads.items():
+            like = timeQueries(conn, LIKE_SQL,
+                               [("%{}%".format(term), args.limit)
+                                for term in terms])
+            fts = timeQueries(conn, fts_sql,
+                              [(search.buildMatchQuery(term), args.limit)
+                               for term in terms])
+            results[workload] = {
+                "like": summarize(like),
+                "fts5": summarize(fts)
+            }
+        conn.close()
+
+    print(json.dumps({
+        "rows": args.rows,
+        "queries": args.queries,
+        "index_build_s": round(index_seconds, 2),
+        "results": results
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Many concurrent clients decrement the stock of a few hot items        #
+# through several app worker processes sharing one SQLite database.     #
+# Compares the atomic /api/adjust/stock route with reading the stock    #
+# and writing it back through /api/update/item, counting lost updates,  #
+# and checks that selling out a small stock never oversells. Exits      #
+# non-zero if the atomic route loses an update or oversells.            #
+# Usage: python benchmarks/bench_stock_contention.py [--clients N]     #
+##########################################################################
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.load_test import freePort, percentile, startServer  # noqa
+
+USERNAME = "stock.bench@example.com"
+PASSWORD = "StockBenchPassword1"
+
+
+def decrementAtomically(http, url, token, item_id):
+    """ Take one unit of stock with the atomic route; return whether the
+    unit was taken. """
+    response = http.post(url + "/api/adjust/stock",
+                         params={"token": token, "id": item_id,
+                                 "delta": -1})
+    if response.status_code not in (200, 409):
+        raise RuntimeError(response.status_code)
+    return response.status_code == 200
+
+
+def decrementReadWrite(http, url, token, item_id):
+    """ Take one unit of stock by reading it and writing back one less, as
+    clients of /api/update/item had to. """
+    stock = http.get(url + "/api/items/json",
+                     params={"id": item_id}).json()["Item"][0]["stock"]
+    if stock <= 0:
+        return False
+    response = http.put(url + "/api/update/item",
+                        params={"token": token, "id": item_id,
+                                "stock": stock - 1})
+    if response.status_code != 200:
+        raise RuntimeError(response.status_code)
+    return True
+
+
+def runClients(decrement, urls, token, item_ids, clients, operations):
+    """ Run clients decrementing random hot items concurrently through
+    every worker; return (units taken, latencies, errors, seconds). """
+    taken = []
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def client(number):
+        rng = random.Random(number)
+        http = requests.Session()
+        url = urls[number % len(urls)]
+        for _ in range(operations):
+            start = time.perf_counter()
+            try:
+                took = decrement(http, url, token, rng.choice(item_ids))
+            except (RuntimeError, requests.RequestException,
+                    ValueError) as error:
+                with lock:
+                    errors.append(str(error))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                taken.append(took)
+
+    threads = [threading.Thread(target=client, args=(number,))
+               for number in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sum(taken), sorted(latencies), errors, \
+        time.perf_counter() - start
+
+
+def setStock(db_path, item_ids, stock):
+    conn = sqlite3.connect(db_path)
+    conn.executemany("UPDATE item SET stock = ? WHERE id = ?",
+                     [(stock, item_id) for item_id in item_ids])
+    conn.commit()
+    conn.close()
+
+
+def totalStock(db_path, item_ids):
+    conn = sqlite3.connect(db_path)
+    stocks = [conn.execute("SELECT stock FROM item WHERE id = ?",
+                           (item_id,)).fetchone()[0]
+              for item_id in item_ids]
+    conn.close()
+    return sum(stocks), min(stocks)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Stress concurrent stock decrements."
+             )
+    parser.add_argument("--workers", type=int, default=4,
+                        help="app processes sharing the database")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--operations", type=int, default=50,
+                        help="decrements attempted per client")
+    parser.add_argument("--hot-items", type=int, default=5)
+    parser.add_argument("--sell-out-stock", type=int, default=100,
+                        help="stock per item in the sell-out run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "stock.db")
+        env = dict(os.environ)
+        env["CATALOG_DATABASE_URL"] = "sqlite:///" + db_path
+        env["CATALOG_BCRYPT_LOG_ROUNDS"] = "4"
+        env["CATALOG_METRICS_ENABLED"] = "0"
+        env.setdefault("CATALOG_SECRET_KEYS", "stock-bench-key")
+        subprocess.run([sys.executable, "populate_db.py",
+                        "--categories", "5", "--items-per-category", "100",
+                        "--seed", "1"],
+                       cwd=ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        item_ids = list(range(1, args.hot_items + 1))
+
+        servers = [startServer("flask", freePort(), env)
+                   for _ in range(args.workers)]
+        urls = [url for process, url in servers]
+        try:
+            requests.post(urls[0] + "/api/registration",
+                          params={"username": USERNAME,
+                                  "password": PASSWORD})
+            token = requests.post(urls[0] + "/api/tokens",
+                                  params={"username": USERNAME,
+                                          "password": PASSWORD}) \
+                            .json()["token"]
+
+            # Enough stock that no decrement is refused: every unit taken
+            # must show in the final stock
+            attempts = args.clients * args.operations
+            results = {}
+            for name, decrement in [("atomic", decrementAtomically),
+                                    ("read_write", decrementReadWrite)]:
+                setStock(db_path, item_ids, attempts)
+                taken, latencies, errors, seconds = runClients(
+                    decrement, urls, token, item_ids, args.clients,
+                    args.operations
+                )
+                final, _ = totalStock(db_path, item_ids)
+                results[name] = {
+                    "units_taken": taken,
+                    "lost_updates": final - (attempts * len(item_ids) -
+                                             taken),
+                    "errors": len(errors),
+                    "decrements_per_second": round(len(latencies) /
+                                                   seconds),
+                    "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+                    "p99_ms": round(percentile(latencies, 0.99) * 1000, 1)
+                }
+
+            # Little stock: exactly that much may be sold, never more
+            setStock(db_path, item_ids, args.sell_out_stock)
+            taken, _, errors, _ = runClients(
+                decrementAtomically, urls, token, item_ids, args.clients,
+                args.operations
+            )
+            final, lowest = totalStock(db_path, item_ids)
+            results["atomic_sell_out"] = {
+                "stock": args.sell_out_stock * len(item_ids),
+                "attempts": attempts,
+                "units_taken": taken,
+                "final_stock": final,
+                "lowest_item_stock": lowest,
+                "errors": len(errors)
+            }
+        finally:
+            for process, url in servers:
+                process.terminate()
+                process.wait()
+
+    print(json.dumps({"workers": args.workers, "clients": args.clients,
+                      "hot_items": args.hot_items, "results": results},
+                     indent=2))
+    sell_out = results["atomic_sell_out"]
+    failed = results["atomic"]["lost_updates"] != 0 or \
+        results["atomic"]["errors"] or sell_out["lowest_item_stock"] < 0 or \
+        sell_out["units_taken"] != min(sell_out["stock"],
+                                       sell_out["attempts"])
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+
+############################################################################
+# Opens thousands of stock streams (/api/stock/stream) on the ASGI app    #
+# and changes stock through the API and, as another worker process       #
+# would, straight in the database. Checks that every stream ends up with  #
+# the stock in the database, that idle streams get heartbeats, that       #
+# streams which stop reading are dropped without holding up the rest,     #
+# that reconnecting streams catch up, and that items moved to another     #
+# category or deleted are removed from it. Reports the latency from a     #
+# commit to its event, and the server's RSS and threads. Exits non-zero   #
+# on any failure. --server flask runs the same checks, bar the dropped    #
+# streams, against the threaded Flask server.                             #
+# Usage: python benchmarks/bench_stock_stream.py [--subscribers N]        #
+############################################################################
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.bench_async_api import startServer  # noqa
+from benchmarks.load_test import freePort, percentile, processTreeRSS  # noqa
+
+USERNAME = "stream.bench@example.com"
+PASSWORD = "StreamBenchPassword1"
+
+# Settings of the server under test; short intervals keep the run short
+SERVER_SETTINGS = {
+    "CATALOG_STOCK_STREAM_POLL_MS": "100",
+    "CATALOG_STOCK_STREAM_HEARTBEAT": "2",
+    "CATALOG_STOCK_STREAM_QUEUE_DEPTH": "8"
+}
+
+
+async def readHead(reader):
+    """ Read a response's status line and headers; return (status,
+    headers). """
+    status = int((await reader.readline()).split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            return status, headers
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip().lower()
+
+
+async def readBody(reader, headers):
+    """ Yield a streamed response body as it arrives. """
+    chunked = headers.get("transfer-encoding") == "chunked"
+    while True:
+        if chunked:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                return
+            data = (await reader.readexactly(size + 2))[:-2]
+        else:
+            data = await reader.read(65536)
+            if not data:
+                return
+        yield data
+
+
+class Subscriber(object):
+    """ A category page following its stock stream. """
+
+    def __init__(self, category_id, since=None, last_event_id=None):
+        self.category_id = category_id
+        self.since = since
+        self.last_event_id = last_event_id
+        self.status = None
+        self.stock = {}
+        self.removed = set()
+        self.first_seen = {}
+        self.events = 0
+        self.heartbeats = 0
+        self.opened = asyncio.Event()
+        self.closed = False
+
+    def request(self):
+        path = "/api/stock/stream?category_id={}".format(self.category_id)
+        if self.since is not None:
+            path += "&since={}".format(self.since)
+        head = "GET {} HTTP/1.1\r\nHost: 127.0.0.1\r\n" \
+               "Accept: text/event-stream\r\n".format(path)
+        if self.last_event_id is not None:
+            head += "Last-Event-ID: {}\r\n".format(self.last_event_id)
+        return (head + "\r\n").encode()
+
+    def handle(self, block):
+        """ Apply one event or comment of the stream. """
+        if block.startswith(b":"):
+            self.heartbeats += 1
+            return
+        fields = dict(line.split(": ", 1)
+                      for line in block.decode().split("\n"))
+        if fields.get("event") != "stock":
+            return
+        now = time.perf_counter()
+        self.events += 1
+        data = json.loads(fields["data"])
+        for item in data["Items"]:
+            self.stock[item["id"]] = item["stock"]
+            self.first_seen.setdefault((item["id"], item["stock"]), now)
+        for item_id in data.get("Removed", []):
+            self.stock.pop(item_id, None)
+            self.removed.add(item_id)
+        self.opened.set()
+
+    async def run(self, port, reader=None, writer=None):
+        """ Follow the stream until the server ends it or run() is
+        cancelled. """
+        if reader is None:
+            reader, writer = await asyncio.open_connection("127.0.0.1",
+                                                           port)
+        try:
+            writer.write(self.request())
+            self.status, headers = await readHead(reader)
+            if self.status != 200:
+                self.opened.set()
+                return
+            buffer = b""
+            async for data in readBody(reader, headers):
+                buffer += data
+                while b"\n\n" in buffer:
+                    block, buffer = buffer.split(b"\n\n", 1)
+                    self.handle(block)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self.closed = True
+            self.opened.set()
+            writer.close()
+
+
+async def openStalled(port, category_id, since):
+    """ Open a stream and never read it; return (reader, writer). """
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, ("127.0.0.1", port))
+    reader, writer = await asyncio.open_connection(sock=sock, limit=4096)
+    writer.write("GET /api/stock/stream?category_id={}&since={} HTTP/1.1\r\n"
+                 "Host: 127.0.0.1\r\n\r\n".format(category_id, since)
+                 .encode())
+    return reader, writer
+
+
+async def drainsToEnd(reader, timeout):
+    """ Return whether the server ended a stalled stream: reading it then
+    reaches the end within timeout seconds. """
+    async def drain():
+        while await reader.read(1 << 20):
+            pass
+
+    try:
+        await asyncio.wait_for(drain(), timeout)
+        return True
+    except (OSError, asyncio.TimeoutError):
+        return False
+
+
+def writeStock(db_path, url, token, item_ids, writes, interval, log):
+    """ Add one unit of stock to each item in turn, alternately through
+    the API and straight in the database; log (commit time, item ID,
+    stock). """
+    http = requests.Session()
+    conn = sqlite3.connect(db_path, timeout=15)
+    for number in range(writes):
+        item_id = item_ids[number % len(item_ids)]
+        if number % 2:
+            stock = http.post(url + "/api/adjust/stock",
+                              params={"token": token, "id": item_id,
+                                      "delta": 1}).json()["stock"]
+        else:
+            stock = conn.execute("UPDATE item SET stock = stock + 1 "
+                                 "WHERE id = ? RETURNING stock",
+                                 (item_id,)).fetchone()[0]
+            conn.commit()
+        log.append((time.perf_counter(), item_id, stock))
+        time.sleep(interval)
+    conn.close()
+
+
+def restockCategory(db_path, category_id, items, times, interval):
+    """ Change the stock of a category's first items at once, times
+    over. """
+    conn = sqlite3.connect(db_path, timeout=15)
+    for _ in range(times):
+        conn.execute("UPDATE item SET stock = stock + 1 WHERE id IN "
+                     "(SELECT id FROM item WHERE category_id = ? "
+                     "ORDER BY id LIMIT ?)", (category_id, items))
+        conn.commit()
+        time.sleep(interval)
+    conn.close()
+
+
+def currentStock(db_path, category_id):
+    conn = sqlite3.connect(db_path)
+    stock = dict(conn.execute("SELECT id, stock FROM item "
+                              "WHERE category_id = ?", (category_id,)))
+    conn.close()
+    return stock
+
+
+async def runChecks(args, port, url, db_path, token, pid):
+    """ Run every check against a started server; return (results,
+    failures). """
+    failures = []
+    heartbeat = int(SERVER_SETTINGS["CATALOG_STOCK_STREAM_HEARTBEAT"])
+    head = requests.get(url + "/api/changes").json()["last_seq"]
+    hot_items = sorted(currentStock(db_path, 1))[:args.hot_items]
+    bulk_before = currentStock(db_path, 2)
+
+    # Most pages show category 1, whose items change one at a time; some
+    # show category 2, many of whose items change at once. The stalled
+    # streams show category 3, whose large events fill their buffers.
+    subscribers = [Subscriber(1 if number % 10 else 2, since=head)
+                   for number in range(args.subscribers)]
+    tasks = []
+    for number in range(0, len(subscribers), 200):
+        batch = subscribers[number:number + 200]
+        tasks += [asyncio.ensure_future(subscriber.run(port))
+                  for subscriber in batch]
+        await asyncio.gather(*[subscriber.opened.wait()
+                               for subscriber in batch])
+    stalled = []
+    if args.server == "asgi":
+        stalled = [await openStalled(port, 3, head)
+                   for _ in range(args.stalled)]
+    opened = sum(subscriber.status == 200 and not subscriber.closed
+                 for subscriber in subscribers)
+    if opened != len(subscribers):
+        failures.append("{} of {} streams opened"
+                        .format(opened, len(subscribers)))
+    rss_kb = processTreeRSS(pid)
+    threads = len(os.listdir("/proc/{}/task".format(pid)))
+
+    log = []
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    await asyncio.gather(
+        loop.run_in_executor(None, writeStock, db_path, url, token,
+                             hot_items, args.writes, 0.02, log),
+        loop.run_in_executor(None, restockCategory, db_path, 2,
+                             args.restock_items, args.restocks, 0.1)
+    )
+    seconds = time.perf_counter() - start
+    if stalled:
+        # Fill the stalled streams' buffers while the other streams keep
+        # receiving changes
+        await asyncio.gather(
+            loop.run_in_executor(None, restockCategory, db_path, 3,
+                                 args.items_per_category,
+                                 args.stalled_restocks, 0.02),
+            loop.run_in_executor(None, writeStock, db_path, url, token,
+                                 hot_items, args.writes // 10, 0.2, [])
+        )
+    # Idle long enough for every stream to get a heartbeat
+    await asyncio.sleep(heartbeat * 1.5 + 1)
+
+    expected = {1: currentStock(db_path, 1), 2: currentStock(db_path, 2)}
+    changed = {1: set(hot_items),
+               2: {item_id for item_id, stock in expected[2].items()
+                   if bulk_before.get(item_id) != stock}}
+    latencies = []
+    stale = 0
+    missing_heartbeats = 0
+    for subscriber in subscribers:
+        category_id = subscriber.category_id
+        if subscriber.closed or any(
+                subscriber.stock.get(item_id) != expected[category_id]
+                [item_id] for item_id in changed[category_id]):
+            stale += 1
+        if subscriber.heartbeats == 0:
+            missing_heartbeats += 1
+        if category_id == 1:
+            latencies += [subscriber.first_seen[item_id, stock] - committed
+                          for committed, item_id, stock in log
+                          if (item_id, stock) in subscriber.first_seen]
+    latencies.sort()
+    if stale:
+        failures.append("{} streams missed stock changes".format(stale))
+    if missing_heartbeats:
+        failures.append("{} idle streams got no heartbeat"
+                        .format(missing_heartbeats))
+    if len(latencies) != args.writes * sum(subscriber.category_id == 1
+                                           for subscriber in subscribers):
+        failures.append("{} commits were not seen by every stream"
+                        .format(args.writes))
+
+    dropped = 0
+    if stalled:
+        ended = await asyncio.gather(*[drainsToEnd(reader, heartbeat * 3)
+                                       for reader, writer in stalled])
+        dropped = sum(ended)
+        if dropped != len(stalled):
+            failures.append("{} of {} stalled streams were not dropped"
+                            .format(len(stalled) - dropped, len(stalled)))
+        for reader, writer in stalled:
+            writer.close()
+
+    # Reconnecting catches up on what changed since the last event seen;
+    # a page without a sequence number gets every item
+    resumed = Subscriber(1, since=0, last_event_id=head)
+    snapshot = Subscriber(1)
+    missing = Subscriber(10 ** 6)
+    malformed = Subscriber("one")
+    checks = [resumed, snapshot, missing, malformed]
+    check_tasks = [asyncio.ensure_future(subscriber.run(port))
+                   for subscriber in checks]
+    await asyncio.gather(*[subscriber.opened.wait()
+                           for subscriber in checks])
+    if resumed.stock != {item_id: expected[1][item_id]
+                         for item_id in hot_items}:
+        failures.append("a reconnecting stream did not catch up exactly")
+    if snapshot.stock != expected[1]:
+        failures.append("a stream without 'since' did not get every item")
+    if (missing.status, malformed.status) != (404, 422):
+        failures.append("unknown and malformed categories got {} and {}"
+                        .format(missing.status, malformed.status))
+
+    # Items moved out of a category or deleted are removed from its live
+    # streams, and from those reconnecting after the last event seen
+    before_move = requests.get(url + "/api/changes").json()["last_seq"]
+    leaving = sorted(expected[1])[-2:]
+    following = [Subscriber(1, since=before_move),
+                 Subscriber(2, since=before_move)]
+    check_tasks += [asyncio.ensure_future(subscriber.run(port))
+                    for subscriber in following]
+    await asyncio.gather(*[subscriber.opened.wait()
+                           for subscriber in following])
+    conn = sqlite3.connect(db_path, timeout=15)
+    conn.execute("UPDATE item SET category_id = 2 WHERE id = ?",
+                 (leaving[0],))
+    conn.execute("DELETE FROM item WHERE id = ?", (leaving[1],))
+    conn.commit()
+    conn.close()
+    await asyncio.sleep(1)
+    reconnected = Subscriber(1, since=0, last_event_id=before_move)
+    check_tasks.append(asyncio.ensure_future(reconnected.run(port)))
+    await reconnected.opened.wait()
+    if following[0].removed != set(leaving):
+        failures.append("a stream did not remove the items that left its "
+                        "category")
+    if reconnected.removed != set(leaving):
+        failures.append("a reconnecting stream did not remove the items "
+                        "that left its category")
+    if leaving[0] not in following[1].stock or following[1].removed:
+        failures.append("a moved item did not reach its new category's "
+                        "stream")
+
+    for task in tasks + check_tasks:
+        task.cancel()
+    await asyncio.gather(*tasks + check_tasks, return_exceptions=True)
+    return {
+        "streams": len(subscribers),
+        "stalled_streams": len(stalled),
+        "server_rss_mb": round(rss_kb / 1024, 1),
+        "server_threads": threads,
+        "writes": args.writes,
+        "writes_per_second": round(args.writes / seconds),
+        "category_restocks": args.restocks,
+        "events_per_stream": round(sum(subscriber.events
+                                       for subscriber in subscribers) /
+                                   len(subscribers), 1),
+        "events_delivered": len(latencies),
+        "commit_to_event_p50_ms": round(percentile(latencies, 0.5) * 1000,
+                                        1) if latencies else None,
+        "commit_to_event_p99_ms": round(percentile(latencies, 0.99) * 1000,
+                                        1) if latencies else None,
+        "stalled_streams_dropped": dropped
+    }, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Check and benchmark the stock streams."
+             )
+    parser.add_argument("--server", choices=["asgi", "flask"],
+                        default="asgi")
+    parser.add_argument("--subscribers", type=int, default=2000)
+    parser.add_argument("--stalled", type=int, default=20,
+                        help="streams that never read (ASGI only)")
+    parser.add_argument("--items-per-category", type=int, default=2000)
+    parser.add_argument("--hot-items", type=int, default=50)
+    parser.add_argument("--writes", type=int, default=100)
+    parser.add_argument("--restocks", type=int, default=20)
+    parser.add_argument("--restock-items", type=int, default=200,
+                        help="items of category 2 changed per restock")
+    parser.add_argument("--stalled-restocks", type=int, default=300,
+                        help="restocks of the stalled streams' category")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "stream.db")
+        env = dict(os.environ, **SERVER_SETTINGS)
+        env["CATALOG_DATABASE_URL"] = "sqlite:///" + db_path
+        env["CATALOG_BCRYPT_LOG_ROUNDS"] = "4"
+        env["CATALOG_METRICS_ENABLED"] = "0"
+        env.setdefault("CATALOG_SECRET_KEYS", "stream-bench-key")
+        subprocess.run([sys.executable, "populate_db.py",
+                        "--categories", "3", "--items-per-category",
+                        str(args.items_per_category), "--seed", "1"],
+                       cwd=ROOT, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+
+        port = freePort()
+        process = startServer(args.server, port, env)
+        url = "http://127.0.0.1:{}".format(port)
+        try:
+            requests.post(url + "/api/registration",
+                          params={"username": USERNAME,
+                                  "password": PASSWORD})
+            token = requests.post(url + "/api/tokens",
+                                  params={"username": USERNAME,
+                                          "password": PASSWORD}) \
+                            .json()["token"]
+            results, failures = asyncio.run(runChecks(
+                args, port, url, db_path, token, process.pid
+            ))
+        finally:
+            process.terminate()
+            process.wait()
+
+    results["server"] = args.server
+    results["failures"] = failures
+    print(json.dumps(results, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Measures the cost of verifying an access token: the original path     #
+# (new serializer per call), a reused serializer, and checkToken() with #
+# its verified-token cache. Usage: python benchmarks/bench_tokens.py    #
+##########################################################################
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def timePerCall(function, calls):
+    """ Return the mean cost of function() in microseconds. """
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return round((time.perf_counter() - start) / calls * 1e6, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Benchmark access token verification."
+             )
+    parser.add_argument("--calls", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["CATALOG_DATABASE_URL"] = \
+            "sqlite:///" + os.path.join(tmp_dir, "catalog.db")
+        os.environ["CATALOG_SECRET_KEYS"] = os.urandom(32).hex()
+        os.chdir(ROOT)
+        import views
+        from itsdangerous import TimedJSONWebSignatureSerializer
+
+        token = views.generateTimedAccessToken(views.TOKEN_TIMEOUT).decode()
+        key = views.app.config["SECRET_KEY"]
+        verifier = TimedJSONWebSignatureSerializer(key)
+
+        def uncached():
+            TimedJSONWebSignatureSerializer(key).loads(token.encode())
+
+        def reused():
+            verifier.loads(token.encode())
+
+        def cached():
+            views.checkToken(token)
+
+        results = {
+            "calls": args.calls,
+            "new_serializer_us": timePerCall(uncached, args.calls),
+            "reused_serializer_us": timePerCall(reused, args.calls),
+            "check_token_cached_us": timePerCall(cached, args.calls),
+            "token_cache": views.token_cache.stats()
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Mirrors a generated catalog the way an edge cache would: a full       #
+# export, then /api/changes after a random mix of API writes. Checks    #
+# that the mirror ends up equal to a fresh export, that polling an      #
+# unchanged catalog is answered with a 304, and that mirrors older than #
+# the compacted log are told to resync. Reports the bytes transferred   #
+# by the feed against a fresh export. Exits non-zero on any failure.    #
+# Usage: python benchmarks/check_change_feed.py [--writes N]           #
+##########################################################################
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USERNAME = "feed.check@example.com"
+PASSWORD = "FeedCheckPassword1"
+
+
+def export(client):
+    """ Return the full catalog as {(type, id): data} and its size in
+    bytes. """
+    mirror = {}
+    size = 0
+    for path, key, kind in [("/api/categories/json", "Categories",
+                             "category"),
+                            ("/api/items/json", "Items", "item")]:
+        response = client.get(path, query_string={"mode": "export"})
+        size += len(response.get_data())
+        for row in response.get_json()[key]:
+            mirror[kind, row["id"]] = row
+    return mirror, size
+
+
+def applyWrites(client, token, rng, writes, category_count, item_count):
+    """ Issue a random mix of category and item writes. """
+    for _ in range(writes):
+        kind = rng.random()
+        category_id = rng.randint(1, category_count)
+        item_id = rng.randint(1, item_count)
+        if kind < 0.2:
+            client.post("/api/add/item", query_string={
+                           "token": token, "name": "Fed item",
+                           "price": rng.randint(1, 99),
+                           "stock": rng.randint(0, 9),
+                           "category_id": category_id
+                       })
+        elif kind < 0.25:
+            client.post("/api/add/items", query_string={"token": token},
+                        json={"Items": [{"name": "Fed batch item",
+                                         "price": 3, "stock": 1,
+                                         "category_id": category_id}
+                                        for _ in range(10)]})
+        elif kind < 0.5:
+            client.put("/api/update/item", query_string={
+                           "token": token, "id": item_id,
+                           "name": "Renamed {}".format(rng.random())
+                       })
+        elif kind < 0.75:
+            client.post("/api/adjust/stock", query_string={
+                            "token": token, "id": item_id,
+                            "delta": rng.randint(-3, 5)
+                        })
+        elif kind < 0.9:
+            client.delete("/api/delete/item",
+                          query_string={"token": token, "id": item_id})
+        elif kind < 0.95:
+            client.put("/api/update/category", query_string={
+                           "token": token, "id": category_id,
+                           "name": "Category {}".format(rng.random())
+                       })
+        elif kind < 0.995:
+            client.post("/api/add/category",
+                        query_string={"token": token, "name": "Fed"})
+        else:
+            client.delete("/api/delete/category",
+                          query_string={"token": token, "id": category_id})
+
+
+def catchUp(client, mirror, since, limit):
+    """ Apply the change feed to a mirror; return the last sequence
+    number, the changes applied and the bytes transferred. """
+    applied = 0
+    size = 0
+    while True:
+        response = client.get("/api/changes",
+                              query_string={"since": since, "limit": limit})
+        size += len(response.get_data())
+        body = response.get_json()
+        for change in body["Changes"]:
+            key = (change["type"], change["id"])
+            if change["deleted"]:
+                mirror.pop(key, None)
+                if change["type"] == "category":
+                    # A category's tombstone stands for its items'
+                    for other in [other for other, data in mirror.items()
+                                  if other[0] == "item" and
+                                  data["category_id"] == change["id"]]:
+                        del mirror[other]
+            else:
+                mirror[key] = change["data"]
+            applied += 1
+        since = body["last_seq"]
+        if not body["has_more"]:
+            return since, applied, size
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Check the change feed against full exports."
+             )
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--items-per-category", type=int, default=1000)
+    parser.add_argument("--writes", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["CATALOG_DATABASE_URL"] = "sqlite:///" + \
+            os.path.join(tmp_dir, "feed.db")
+        os.environ["CATALOG_BCRYPT_LOG_ROUNDS"] = "4"
+        os.environ["CATALOG_METRICS_ENABLED"] = "0"
+        os.environ.setdefault("CATALOG_SECRET_KEYS", "feed-check-key")
+
+        from models import engine
+        import changes
+        import populate_db
+
+        conn = engine.raw_connection()
+        try:
+            populate_db.loadGeneratedData(conn, args.categories,
+                                          args.items_per_category,
+                                          args.seed, 100000)
+            conn.commit()
+        finally:
+            conn.close()
+
+        # The app reads its client secret relative to the working directory
+        os.chdir(ROOT)
+        import views
+
+        client = views.app.test_client()
+        client.post("/api/registration",
+                    query_string={"username": USERNAME,
+                                  "password": PASSWORD})
+        token = client.post("/api/tokens",
+                            query_string={"username": USERNAME,
+                                          "password": PASSWORD}) \
+                      .get_json()["token"]
+
+        # A new mirror notes where the feed stands, then syncs in full
+        since = client.get("/api/changes").get_json()["last_seq"]
+        mirror, _ = export(client)
+
+        applyWrites(client, token, random.Random(args.seed), args.writes,
+                    args.categories,
+                    args.categories * args.items_per_category)
+        start_seq = since
+        since, applied, feed_bytes = catchUp(client, mirror, since,
+                                             args.limit)
+        expected, export_bytes = export(client)
+        differing = [key for key in set(mirror) | set(expected)
+                     if mirror.get(key) != expected.get(key)]
+        if differing:
+            failures.append("{} rows differ from a fresh export"
+                            .format(len(differing)))
+
+        # A page holding exactly the remaining entries is the last one
+        with engine.connect() as seq_conn:
+            page_since = seq_conn.exec_driver_sql(
+                             "SELECT seq FROM catalog_change "
+                             "ORDER BY seq DESC LIMIT 1 OFFSET ?",
+                             (args.limit,)
+                         ).scalar()
+        for limit, more in [(args.limit, False), (args.limit - 1, True)]:
+            body = client.get("/api/changes",
+                              query_string={"since": page_since,
+                                            "limit": limit}).get_json()
+            if body["has_more"] != more:
+                failures.append("has_more {} with {} of {} entries left"
+                                .format(body["has_more"], limit,
+                                        args.limit))
+
+        # Polling an unchanged catalog is a revalidation
+        response = client.get("/api/changes", query_string={"since": since})
+        polled = client.get("/api/changes", query_string={"since": since},
+                            headers={"If-None-Match": response.headers
+                                     ["ETag"]})
+        if polled.status_code != 304:
+            failures.append("unchanged poll returned {}"
+                            .format(polled.status_code))
+
+        # Compacting every entry leaves mirrors that are up to date
+        # current, and tells older ones to resync
+        with engine.begin() as compact_conn:
+            removed = changes.compactChanges(compact_conn, -60)
+        views.catalog_cache.clear()
+        current = client.get("/api/changes", query_string={"since": since})
+        stale = client.get("/api/changes",
+                           query_string={"since": start_seq})
+        if current.status_code != 200 or stale.status_code != 410:
+            failures.append("after compaction: current {}, stale {}"
+                            .format(current.status_code, stale.status_code))
+
+    print(json.dumps({
+              "writes": args.writes,
+              "log_entries": since - start_seq,
+              "changes_applied": applied,
+              "entries_compacted": removed,
+              "feed_bytes": feed_bytes,
+              "export_bytes": export_bytes,
+              "failures": failures
+          }, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
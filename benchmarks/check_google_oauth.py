@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Signs in through /oauth2/google/signin against a local stand-in for    #
+# Google's token, signing key and revocation endpoints. Checks that ID   #
+# tokens are verified without a key fetch per sign-in, that calls reuse  #
+# kept-alive connections, that rotated keys are picked up, and that      #
+# forged, expired, foreign and unverified-email tokens are refused.      #
+# Exits non-zero on any failed check.                                    #
+# Usage: python benchmarks/check_google_oauth.py [--logins N]           #
+##########################################################################
+
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+import rsa
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.load_test import freePort  # noqa
+
+STATE = "oauth-check-state"
+
+
+def encodeSegment(data):
+    """ Encode bytes as an unpadded base64url JWT segment. """
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def encodeNumber(number):
+    """ Encode an integer as a base64url big-endian JWK number. """
+    return encodeSegment(number.to_bytes((number.bit_length() + 7) // 8,
+                                         "big"))
+
+
+class StandInGoogle(object):
+    """ Token, signing key and revocation endpoints signing ID tokens with
+    keys of its own. Counts the requests and connections it serves. """
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+        self.keys = {}
+        self.kid = None
+        self.counts = {"token": 0, "certs": 0, "revoke": 0,
+                       "connections": 0}
+        self.lock = threading.Lock()
+        self.rotate()
+
+    def rotate(self):
+        """ Sign tokens with a new key, still publishing the old ones. """
+        public_key, private_key = rsa.newkeys(1024)
+        self.kid = "key-{}".format(len(self.keys) + 1)
+        self.keys[self.kid] = (public_key, private_key)
+
+    def certs(self):
+        return {"keys": [{"kty": "RSA", "alg": "RS256", "use": "sig",
+                          "kid": kid, "n": encodeNumber(public_key.n),
+                          "e": encodeNumber(public_key.e)}
+                         for kid, (public_key, _) in self.keys.items()]}
+
+    def idToken(self, code):
+        """ Return the ID token issued for an auth code; the code names
+        the user, or a fault to build into the token. """
+        now = int(time.time())
+        claims = {"iss": "https://accounts.google.com",
+                  "aud": self.client_id, "sub": code,
+                  "email": code + "@example.com",
+                  "email_verified": code != "unverified",
+                  "iat": now, "exp": now + 3600}
+        if code == "foreign":
+            claims["aud"] = "another-app.apps.googleusercontent.com"
+        elif code == "expired":
+            claims["iat"], claims["exp"] = now - 7200, now - 3600
+        header = {"alg": "RS256", "kid": self.kid, "typ": "JWT"}
+        signed = "{}.{}".format(encodeSegment(json.dumps(header).encode()),
+                                encodeSegment(json.dumps(claims).encode()))
+        signature = rsa.sign(signed.encode(), self.keys[self.kid][1],
+                             "SHA-256")
+        if code == "forged":
+            claims["sub"] = "someone-else"
+            signed = "{}.{}".format(
+                         signed.split(".")[0],
+                         encodeSegment(json.dumps(claims).encode())
+                     )
+        return "{}.{}".format(signed, encodeSegment(signature))
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def serve(self, port):
+        google = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                google.count("connections")
+                BaseHTTPRequestHandler.setup(self)
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body, headers=()):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/oauth2/v3/certs":
+                    google.count("certs")
+                    self.reply(200, google.certs(),
+                               [("Cache-Control",
+                                 "public, max-age=3600, must-revalidate")])
+                else:
+                    self.reply(404, {"error": "not_found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                form = parse_qs(self.rfile.read(length).decode())
+                if self.path == "/token":
+                    google.count("token")
+                    code = form["code"][0]
+                    self.reply(200, {"access_token": "access-" + code,
+                                     "id_token": google.idToken(code),
+                                     "expires_in": 3599,
+                                     "token_type": "Bearer"})
+                elif self.path == "/revoke":
+                    google.count("revoke")
+                    self.reply(200, {})
+                else:
+                    self.reply(404, {"error": "not_found"})
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def signIn(client, code):
+    """ Post an auth code to the sign-in route as the login page does and
+    return the response. """
+    with client.session_transaction() as session:
+        session["state"] = STATE
+    return client.post("/oauth2/google/signin",
+                       query_string={"state": STATE}, data=code)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Check Google sign-in against a stand-in."
+             )
+    parser.add_argument("--logins", type=int, default=50)
+    args = parser.parse_args()
+
+    port = freePort()
+    base_url = "http://127.0.0.1:{}".format(port)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["CATALOG_DATABASE_URL"] = "sqlite:///" + \
+            os.path.join(tmp_dir, "oauth.db")
+        os.environ.setdefault("CATALOG_SECRET_KEYS", "oauth-check-key")
+        os.environ["CATALOG_GOOGLE_OAUTH_URL"] = base_url
+        os.environ["CATALOG_GOOGLE_APIS_URL"] = base_url
+
+        # The app reads its client secret relative to the working directory
+        os.chdir(ROOT)
+        import oauth
+        import views
+
+        google = StandInGoogle(views.G_CLIENT_ID)
+        server = google.serve(port)
+        checks = []
+
+        def check(name, passed, detail=""):
+            checks.append({"check": name, "passed": bool(passed),
+                           "detail": detail})
+
+        # Showing the login page starts the background key refresh
+        views.app.test_client().get("/login")
+        for _ in range(50):
+            if google.counts["certs"]:
+                break
+            time.sleep(0.1)
+
+        start = time.perf_counter()
+        statuses = set()
+        for number in range(args.logins):
+            client = views.app.test_client()
+            statuses.add(signIn(client, "user{}".format(number)).status_code)
+        seconds = time.perf_counter() - start
+        check("sign-ins succeed", statuses == {302}, sorted(statuses))
+        check("signing keys fetched once", google.counts["certs"] == 1,
+              google.counts["certs"])
+        check("connections reused", google.counts["connections"] <= 2,
+              "{} connections for {} requests".format(
+                  google.counts["connections"],
+                  google.counts["token"] + google.counts["certs"]
+              ))
+
+        with client.session_transaction() as session:
+            signed_in = session.get("email")
+        check("email taken from the ID token",
+              signed_in == "user{}@example.com".format(args.logins - 1),
+              signed_in)
+
+        # Tokens signed with a key published after the last fetch make
+        # the keys be fetched again (once the retry interval has passed)
+        google.rotate()
+        oauth.RETRY_INTERVAL = 0
+        response = signIn(views.app.test_client(), "rotated")
+        check("rotated key picked up",
+              response.status_code == 302 and google.counts["certs"] == 2,
+              "status {}, {} key fetches".format(response.status_code,
+                                                 google.counts["certs"]))
+
+        for code, message in [
+            ("foreign", "Mismatched token and application IDs."),
+            ("expired", "Expired ID token."),
+            ("forged", "Invalid ID token signature."),
+            ("unverified", "Unverified email address.")
+        ]:
+            response = signIn(views.app.test_client(), code)
+            body = response.get_json() or {}
+            check("{} token refused".format(code),
+                  response.status_code == 401 and
+                  body.get("message") == message,
+                  "{} {}".format(response.status_code, body.get("message")))
+
+        response = client.get("/oauth2/google/signout")
+        with client.session_transaction() as session:
+            signed_out = "credentials" not in session
+        check("sign-out revokes the token",
+              response.status_code == 302 and google.counts["revoke"] == 1
+              and signed_out, response.status_code)
+
+        server.shutdown()
+
+    print(json.dumps({"logins": args.logins,
+                      "ms_per_login": round(seconds * 1000 / args.logins, 2),
+                      "requests_to_google": google.counts,
+                      "checks": checks}, indent=2))
+    sys.exit(0 if all(result["passed"] for result in checks) else 1)
+
+
+if __name__ == "__main__":
+    main()
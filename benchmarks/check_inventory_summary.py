@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Applies a random mix of item and category writes through the API and  #
+# checks that /api/categories/summary still matches totals computed     #
+# from the items. Then times the summary against the ways dashboards    #
+# could otherwise get it: a GROUP BY over the items, and paging through #
+# /api/items/json for every category. Exits non-zero on a mismatch.     #
+# Usage: python benchmarks/check_inventory_summary.py [--writes N]     #
+##########################################################################
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USERNAME = "summary.check@example.com"
+PASSWORD = "SummaryCheckPassword1"
+
+
+def applyWrites(client, token, rng, writes, category_count, item_count):
+    """ Issue a random mix of writes changing the category totals; items
+    are picked by ID among the first item_count. """
+    for _ in range(writes):
+        kind = rng.random()
+        category_id = rng.randint(1, category_count)
+        if kind < 0.3:
+            client.post("/api/add/item", query_string={
+                           "token": token, "name": "Checked item",
+                           "price": "{}.{:02d}".format(rng.randint(0, 99),
+                                                       rng.randint(0, 99)),
+                           "stock": rng.randint(0, 50),
+                           "category_id": category_id
+                       })
+        elif kind < 0.4:
+            client.post("/api/add/items", query_string={"token": token},
+                        json={"Items": [{"name": "Batch item",
+                                         "price": rng.randint(1, 20),
+                                         "stock": rng.randint(0, 9),
+                                         "category_id": category_id}
+                                        for _ in range(20)]})
+        elif kind < 0.8:
+            client.put("/api/update/item", query_string={
+                           "token": token, "id": rng.randint(1, item_count),
+                           "stock": rng.randint(0, 100),
+                           "price": rng.randint(1, 200)
+                       })
+        elif kind < 0.99:
+            client.delete("/api/delete/item", query_string={
+                              "token": token,
+                              "id": rng.randint(1, item_count)
+                          })
+        else:
+            client.delete("/api/delete/category", query_string={
+                              "token": token, "id": category_id
+                          })
+
+
+def timeCall(function, repeat):
+    """ Return the mean milliseconds a call takes. """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return round((time.perf_counter() - start) * 1000 / repeat, 2)
+
+
+def pageThroughItems(client, category_count):
+    """ Sum every category's stock as dashboards did, from item pages. """
+    totals = {}
+    for category_id in range(1, category_count + 1):
+        params = {"category_id": category_id, "limit": 500}
+        while True:
+            body = client.get("/api/items/json",
+                              query_string=params).get_json()
+            totals[category_id] = totals.get(category_id, 0) + \
+                sum(item["stock"] for item in body.get("Items", []))
+            if not body.get("next_cursor"):
+                break
+            params["cursor"] = body["next_cursor"]
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Check and time the inventory summary."
+             )
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--items-per-category", type=int, default=5000)
+    parser.add_argument("--writes", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ["CATALOG_DATABASE_URL"] = "sqlite:///" + \
+            os.path.join(tmp_dir, "summary.db")
+        os.environ["CATALOG_BCRYPT_LOG_ROUNDS"] = "4"
+        os.environ["CATALOG_METRICS_ENABLED"] = "0"
+        os.environ.setdefault("CATALOG_SECRET_KEYS", "summary-check-key")
+
+        from sqlalchemy import text
+        from models import engine
+        import inventory
+        import populate_db
+
+        conn = engine.raw_connection()
+        try:
+            populate_db.loadGeneratedData(conn, args.categories,
+                                          args.items_per_category,
+                                          args.seed, 100000)
+            inventory.recomputeSummaries(conn.cursor())
+            conn.commit()
+        finally:
+            conn.close()
+
+        # The app reads its client secret relative to the working directory
+        os.chdir(ROOT)
+        import views
+
+        client = views.app.test_client()
+        client.post("/api/registration",
+                    query_string={"username": USERNAME,
+                                  "password": PASSWORD})
+        token = client.post("/api/tokens",
+                            query_string={"username": USERNAME,
+                                          "password": PASSWORD}) \
+                      .get_json()["token"]
+        applyWrites(client, token, random.Random(args.seed), args.writes,
+                    args.categories,
+                    args.categories * args.items_per_category)
+
+        with engine.connect() as db_conn:
+            computed = {row[0]: list(row[1:]) for row in
+                        db_conn.execute(text(inventory.SUMMARIZE_ITEMS))}
+            category_ids = {row[0] for row in
+                            db_conn.execute(text("SELECT id FROM category"))}
+        served = client.get("/api/categories/summary").get_json()
+        mismatches = [summary for summary in served["Summaries"]
+                      if computed.get(summary["category_id"], [0, 0, 0]) !=
+                      [summary["item_count"], summary["total_stock"],
+                       summary["stock_value_cents"]]]
+        # Existing categories missing from the summary; items added to
+        # IDs of deleted categories are not shown
+        mismatches += sorted(category_ids -
+                             {summary["category_id"]
+                              for summary in served["Summaries"]})
+        single = client.get("/api/categories/summary",
+                            query_string={"category_id": 2}).get_json()
+        single_matches = single.get("Summaries", []) == [
+                             summary for summary in served["Summaries"]
+                             if summary["category_id"] == 2
+                         ]
+
+        def uncachedSummary():
+            views.catalog_cache.clear()
+            client.get("/api/categories/summary")
+
+        def groupBy():
+            with engine.connect() as db_conn:
+                db_conn.execute(text(inventory.SUMMARIZE_ITEMS)).fetchall()
+
+        def pageThrough():
+            views.catalog_cache.clear()
+            pageThroughItems(client, args.categories)
+
+        timings = {
+            "summary_endpoint_ms": timeCall(uncachedSummary, 50),
+            "group_by_items_ms": timeCall(groupBy, 5),
+            "paging_item_lists_ms": timeCall(pageThrough, 1)
+        }
+
+    print(json.dumps({
+              "categories": args.categories,
+              "items": args.categories * args.items_per_category,
+              "writes": args.writes,
+              "categories_checked": len(served["Summaries"]),
+              "mismatches": mismatches,
+              "single_category_matches": single_matches,
+              "timings": timings
+          }, indent=2))
+    sys.exit(1 if mismatches or not single_matches else 0)
+
+
+if __name__ == "__main__":
+    main()
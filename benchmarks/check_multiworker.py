@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Starts N app workers as separate processes sharing one database and    #
+# signing key ring, then checks that access tokens and login sessions    #
+# minted by any worker are accepted by every other worker, including    #
+# across a key rotation, and that no worker serves cached reads older   #
+# than a write made through another. Exits non-zero on failure.         #
+# Usage: python benchmarks/check_multiworker.py [--workers N]           #
+##########################################################################
+
+import argparse
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+USERNAME = "worker.check@example.com"
+PASSWORD = "CheckPassword1"
+
+WORKER_CODE = """
+import sys
+import views
+views.app.run("127.0.0.1", port=int(sys.argv[1]))
+"""
+
+
+def freePort():
+    """ Return a TCP port that is currently free on localhost. """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def startWorkers(count, env):
+    """ Start count app processes and return (process, base URL) pairs. """
+    workers = []
+    for _ in range(count):
+        port = freePort()
+        process = subprocess.Popen([sys.executable, "-c", WORKER_CODE,
+                                    str(port)],
+                                   cwd=ROOT, env=env,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+        workers.append((process, "http://127.0.0.1:{}".format(port)))
+    for process, url in workers:
+        for _ in range(100):
+            try:
+                requests.get(url + "/api/cache/stats", timeout=1)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError("Worker at {} did not start.".format(url))
+    return workers
+
+
+def stopWorkers(workers):
+    """ Terminate worker processes. """
+    for process, url in workers:
+        process.terminate()
+        process.wait()
+
+
+def checkTokens(urls, token):
+    """ Return failures using token for a write on every worker. """
+    failures = []
+    for url in urls:
+        response = requests.put(url + "/api/update/category",
+                                params={"token": token, "id": 1,
+                                        "name": "Electronics"})
+        if response.status_code != 200:
+            failures.append("token rejected by {} ({})"
+                            .format(url, response.status_code))
+    return failures
+
+
+def login(url):
+    """ Log in through a worker's HTML form and return the HTTP session. """
+    http = requests.Session()
+    page = http.get(url + "/login").text
+    state = re.search(r'name="state" value="(\w+)"', page).group(1)
+    http.post(url + "/login", data={"state": state, "username": USERNAME,
+                                    "password": PASSWORD})
+    return http
+
+
+def checkSession(urls, http):
+    """ Return failures opening an admin page on every worker. """
+    failures = []
+    for url in urls:
+        response = http.get(url + "/categories/add", allow_redirects=False)
+        if response.status_code != 200:
+            failures.append("session rejected by {} ({})"
+                            .format(url, response.status_code))
+    return failures
+
+
+def cachedReads(url, item_id, category_id):
+    """ Return the (ETag, body) of reads of an item by a worker. """
+    paths = ["/api/items/json?id={}".format(item_id),
+             "/api/items/json?category_id={}".format(category_id),
+             "/category/{}".format(category_id)]
+    responses = [requests.get(url + path) for path in paths]
+    return [(response.headers.get("ETag"), response.text)
+            for response in responses]
+
+
+def checkCache(urls, token):
+    """ Return failures reading an item renamed through the first worker
+    from the caches of the others. """
+    failures = []
+    item = requests.get(urls[0] + "/api/items/json",
+                        params={"id": 1}).json()["Item"][0]
+    for url in urls:
+        cachedReads(url, item["id"], item["category_id"])
+    name = "Renamed item {}".format(time.time_ns())
+    requests.put(urls[0] + "/api/update/item",
+                 params={"token": token, "id": item["id"], "name": name})
+    for url in urls[1:]:
+        reads = cachedReads(url, item["id"], item["category_id"])
+        if any(name not in body for etag, body in reads):
+            failures.append("stale cached read from {}".format(url))
+        if reads != cachedReads(url, item["id"], item["category_id"]):
+            failures.append("ETag or body changed on re-read from {}"
+                            .format(url))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Check tokens and sessions across workers."
+             )
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = dict(os.environ)
+        env["CATALOG_DATABASE_URL"] = \
+            "sqlite:///" + os.path.join(tmp_dir, "catalog.db")
+        env["CATALOG_SECRET_KEYS_FILE"] = os.path.join(tmp_dir, "keys")
+        env.pop("CATALOG_SECRET_KEYS", None)
+        subprocess.check_call([sys.executable, "populate_db.py"], cwd=ROOT,
+                              env=env, stdout=subprocess.DEVNULL)
+
+        # Workers generating and sharing a key file on first start
+        workers = startWorkers(args.workers, env)
+        urls = [url for process, url in workers]
+        try:
+            requests.post(urls[0] + "/api/registration",
+                          params={"username": USERNAME,
+                                  "password": PASSWORD})
+            tokens = [requests.post(url + "/api/tokens",
+                                    params={"username": USERNAME,
+                                            "password": PASSWORD})
+                      .json()["token"] for url in urls]
+            for token in tokens:
+                failures += checkTokens(urls, token)
+            http = login(urls[-1])
+            failures += checkSession(urls, http)
+            failures += checkCache(urls, tokens[0])
+        finally:
+            stopWorkers(workers)
+
+        # Restarted workers with a rotated key ring must still accept the
+        # tokens and sessions signed with the previous key
+        with open(env["CATALOG_SECRET_KEYS_FILE"]) as key_file:
+            old_key = key_file.read().strip()
+        env["CATALOG_SECRET_KEYS"] = os.urandom(32).hex() + "," + old_key
+        workers = startWorkers(args.workers, env)
+        urls = [url for process, url in workers]
+        try:
+            failures += checkTokens(urls, tokens[0])
+            failures += checkSession(urls, http)
+        finally:
+            stopWorkers(workers)
+
+    for failure in failures:
+        print("FAIL:", failure)
+    print("{} workers: {}".format(args.workers,
+                                  "FAILED" if failures else "OK"))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Drives the catalog routes against a generated database, records every  #
+# SQL statement they issue and prints its EXPLAIN QUERY PLAN. Exits      #
+# non-zero if any statement scans the whole item table.                  #
+# Usage: python benchmarks/check_query_plans.py [--verbose]             #
+##########################################################################
+
+import argparse
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+USERNAME = "plan.check@example.com"
+PASSWORD = "PlanCheckPassword1"
+
+# Plan steps reading every row of the item table; "item_fts" is not matched
+FULL_SCAN = re.compile(r"\bSCAN (TABLE )?item\b(?!_)")
+
+
+def requestRoutes(client, broadcaster):
+    """ Issue a request to every route that reads or writes the catalog,
+    and have the stock broadcaster read the changes. """
+    client.post("/api/registration",
+                query_string={"username": USERNAME, "password": PASSWORD})
+    token = client.post("/api/tokens",
+                        query_string={"username": USERNAME,
+                                      "password": PASSWORD}) \
+                  .get_json()["token"]
+    first_page = client.get("/api/items/json",
+                            query_string={"mode": "list"}).get_json()
+    sorted_page = client.get("/api/items/json",
+                             query_string={"mode": "list",
+                                           "sort": "-price"}).get_json()
+    for path, params in [
+        ("/", {}),
+        ("/category/3", {}),
+        ("/api/categories/json", {"mode": "list"}),
+        ("/api/categories/json", {"mode": "search", "query": "garden"}),
+        ("/api/categories/json", {"id": 3}),
+        ("/api/categories/json", {"name": "Category 3"}),
+        ("/api/items/json", {"mode": "list",
+                             "cursor": first_page["next_cursor"]}),
+        ("/api/items/json", {"mode": "search", "query": "lamp"}),
+        ("/api/items/json", {"mode": "list", "sort": "-price",
+                             "cursor": sorted_page["next_cursor"]}),
+        ("/api/items/json", {"mode": "list", "sort": "price",
+                             "min_price": "10", "max_price": "20"}),
+        ("/api/items/json", {"mode": "list", "sort": "stock"}),
+        ("/api/items/json", {"mode": "list", "sort": "name"}),
+        ("/api/items/json", {"category_id": 3}),
+        ("/api/items/json", {"category_id": 3, "sort": "price",
+                             "max_price": "50"}),
+        ("/api/items/json", {"id": 42}),
+        ("/api/items/json", {"name": "Item 42"}),
+        ("/api/categories/summary", {}),
+        ("/api/changes", {}),
+        ("/api/changes", {"since": 0})
+    ]:
+        client.get(path, query_string=params)
+    # Read the opening event of a category page's stock stream, both
+    # caught up from the log and in full
+    for params in ({"category_id": 3, "since": 0}, {"category_id": 3}):
+        stream = client.get("/api/stock/stream", buffered=False,
+                            query_string=params)
+        next(stream.response)
+        stream.close()
+    client.post("/api/add/item",
+                query_string={"token": token, "name": "Plan item",
+                              "description": "Checked", "price": "5",
+                              "stock": "1", "category_id": 3})
+    client.put("/api/update/item",
+               query_string={"token": token, "id": 42, "stock": "7"})
+    client.post("/api/adjust/stock",
+                query_string={"token": token, "id": 44, "delta": "-1"})
+    client.post("/api/adjust/stocks", query_string={"token": token},
+                json={"Adjustments": [{"id": 45, "delta": 3}]})
+    client.put("/api/update/category",
+               query_string={"token": token, "id": 3, "name": "Renamed"})
+    client.delete("/api/delete/item", query_string={"token": token, "id": 43})
+    client.get("/api/changes", query_string={"since": 0})
+    broadcaster.poll()
+    client.delete("/api/delete/category",
+                  query_string={"token": token, "id": 4})
+
+
+def explain(db_path, statements):
+    """ Return (statement, plan details) for each recorded statement. """
+    conn = sqlite3.connect(db_path)
+    plans = []
+    for statement, parameters in statements:
+        if not statement.lstrip().upper().startswith(("SELECT", "WITH",
+                                                      "UPDATE", "DELETE")):
+            continue
+        rows = conn.execute("EXPLAIN QUERY PLAN " + statement,
+                            parameters).fetchall()
+        plans.append((statement, [row[-1] for row in rows]))
+    conn.close()
+    return plans
+
+
+def isFullScan(statement, details):
+    """
+    Return True if a plan reads the whole item table.
+
+    A scan in primary key order that stops at a LIMIT (the first page of
+    a keyset-paginated list) only reads the rows it returns.
+    """
+    bounded = "LIMIT" in statement.upper() and \
+        not any("TEMP B-TREE" in detail for detail in details)
+    return not bounded and any(FULL_SCAN.search(detail)
+                               for detail in details)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Check the query plans of the catalog routes."
+             )
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--items-per-category", type=int, default=500)
+    parser.add_argument("--verbose", action="store_true",
+                        help="print the plan of every statement")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "plans.db")
+        os.environ["CATALOG_DATABASE_URL"] = "sqlite:///" + db_path
+        os.environ["CATALOG_BCRYPT_LOG_ROUNDS"] = "4"
+        os.environ.setdefault("CATALOG_SECRET_KEYS", "plan-check-key")
+
+        from sqlalchemy import event
+        from models import engine
+        import populate_db
+
+        conn = engine.raw_connection()
+        try:
+            populate_db.loadGeneratedData(conn, args.categories,
+                                          args.items_per_category, 1, 10000)
+        finally:
+            conn.close()
+
+        # The app reads its client secret relative to the working directory
+        os.chdir(ROOT)
+        import views
+
+        statements = []
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def record(conn, cursor, statement, parameters, context,
+                   executemany):
+            statements.append((statement, parameters[0] if executemany
+                               else parameters))
+
+        requestRoutes(views.app.test_client(), views.stock_broadcaster)
+        plans = explain(db_path, statements)
+
+    seen = set()
+    failures = 0
+    for statement, details in plans:
+        if statement in seen:
+            continue
+        seen.add(statement)
+        full_scan = isFullScan(statement, details)
+        failures += full_scan
+        if full_scan or args.verbose:
+            print("{}\n{}\n    {}\n".format(
+                      "FULL SCAN" if full_scan else "ok",
+                      " ".join(statement.split()),
+                      "\n    ".join(details)
+                  ))
+    print("{} distinct statements checked, {} full item scans."
+          .format(len(seen), failures))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
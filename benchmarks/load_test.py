@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# HTTP load test for every catalog route. Generates a catalog of the    #
+# requested size, starts the app in a separate process, drives each     #
+# route with concurrent clients and reports p50/p95/p99 latency,        #
+# requests/sec and the server's peak RSS per endpoint as JSON.          #
+#                                                                        #
+#   python benchmarks/load_test.py --categories 100 \                   #
+#       --items-per-category 1000 --output results.json                 #
+#                                                                        #
+# The Google OAuth2 routes are not driven, as they need the provider.   #
+##########################################################################
+
+import argparse
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+USERNAME = "load.test@example.com"
+PASSWORD = "LoadTestPassword1"
+
+WORKER_CODE = """
+import sys
+import views
+views.app.run("127.0.0.1", port=int(sys.argv[1]), threaded=True)
+"""
+
+
+###########
+# SERVING #
+###########
+
+def freePort():
+    """ Return a TCP port that is currently free on localhost. """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def startServer(server, port, env):
+    """ Start the app in a new process and return it once it answers. """
+    if server == "gunicorn":
+        command = ["gunicorn", "--workers", "4", "--threads", "8",
+                   "--bind", "127.0.0.1:{}".format(port), "views:app"]
+    else:
+        command = [sys.executable, "-c", WORKER_CODE, str(port)]
+    process = subprocess.Popen(command, cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    url = "http://127.0.0.1:{}".format(port)
+    for _ in range(200):
+        try:
+            requests.get(url + "/api/cache/stats", timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Server did not start.")
+
+
+def processTreeRSS(pid):
+    """ Return the resident set size in KB of a process and its children. """
+    total = 0
+    pids = [pid]
+    while pids:
+        current = pids.pop()
+        try:
+            with open("/proc/{}/status".format(current)) as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+            with open("/proc/{0}/task/{0}/children".format(current)) as kids:
+                pids.extend(int(child) for child in kids.read().split())
+        except (IOError, ValueError):
+            continue
+    return total
+
+
+class RSSSampler(threading.Thread):
+    """ Samples the server's RSS in the background, keeping the peak. """
+
+    def __init__(self, pid, interval=0.05):
+        threading.Thread.__init__(self, daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak_kb = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak_kb = max(self.peak_kb, processTreeRSS(self.pid))
+            time.sleep(self.interval)
+
+    def stop(self):
+        """ Stop sampling and return the peak RSS in KB. """
+        self.running = False
+        self.join()
+        return max(self.peak_kb, processTreeRSS(self.pid))
+
+
+###########
+# CLIENTS #
+###########
+
+class Client(object):
+    """ Per-thread HTTP session, optionally logged in via the HTML form. """
+
+    local = threading.local()
+
+    def __init__(self, url, token):
+        self.url = url
+        self.token = token
+
+    def http(self):
+        """ Return this thread's keep-alive HTTP session. """
+        if getattr(self.local, "http", None) is None:
+            self.local.http = requests.Session()
+        return self.local.http
+
+    def admin(self):
+        """ Return this thread's HTTP session, logged in as USERNAME. """
+        if getattr(self.local, "admin", None) is None:
+            admin = requests.Session()
+            page = admin.get(self.url + "/login").text
+            state = re.search(r'name="state" value="(\w+)"', page).group(1)
+            admin.post(self.url + "/login",
+                       data={"state": state, "username": USERNAME,
+                             "password": PASSWORD})
+            self.local.admin = admin
+        return self.local.admin
+
+
+def buildEndpoints(categories, items, requests_per_endpoint):
+    """
+    Return (name, request count, request function) for every route.
+
+    Request functions take the client and the request index and return
+    the response. Redirects after form posts are not followed, so only the
+    route itself is timed. Write routes pick a distinct row per request
+    index, and deletes run last, from the end of the ID ranges, so that
+    every request targets an existing row.
+    """
+    n = requests_per_endpoint
+    # Categories deleted by each delete route; the rest stay for reads
+    category_deletes = max(1, min(n, categories // 4))
+
+    def category(i):
+        return i % (categories - 2 * category_deletes) + 1
+
+    def item(i):
+        return i % (items - 2 * n) + 1
+
+    def itemForm(i):
+        return {"name": "Load item {}".format(i), "price": "9",
+                "stock": "5", "description": "Added by the load test."}
+
+    return [
+        ("GET /", n,
+         lambda c, i: c.http().get(c.url + "/")),
+        ("GET /category/<id>", n,
+         lambda c, i: c.http().get(c.url + "/category/{}"
+                                   .format(category(i)))),
+        ("GET /api/categories/json?mode=list", n,
+         lambda c, i: c.http().get(c.url + "/api/categories/json",
+                                   params={"mode": "list"})),
+        ("GET /api/categories/json?mode=search", n,
+         lambda c, i: c.http().get(c.url + "/api/categories/json",
+                                   params={"mode": "search",
+                                           "query": "gar"})),
+        ("GET /api/categories/json?id=", n,
+         lambda c, i: c.http().get(c.url + "/api/categories/json",
+                                   params={"id": category(i)})),
+        ("GET /api/items/json?mode=list", n,
+         lambda c, i: c.http().get(c.url + "/api/items/json",
+                                   params={"mode": "list"})),
+        ("GET /api/items/json?mode=search", n,
+         lambda c, i: c.http().get(c.url + "/api/items/json",
+                                   params={"mode": "search",
+                                           "query": ["kettle", "brass",
+                                                     "lamp"][i % 3]})),
+        ("GET /api/items/json?category_id=", n,
+         lambda c, i: c.http().get(c.url + "/api/items/json",
+                                   params={"category_id": category(i)})),
+        ("GET /api/items/json?id=", n,
+         lambda c, i: c.http().get(c.url + "/api/items/json",
+                                   params={"id": item(i)})),
+        ("GET /api/cache/stats", n,
+         lambda c, i: c.http().get(c.url + "/api/cache/stats",
+                                   params={"token": c.token})),
+        ("GET /login", n,
+         lambda c, i: c.http().get(c.url + "/login")),
+        ("POST /api/registration", n,
+         lambda c, i: c.http().post(c.url + "/api/registration",
+                                    params={"username":
+                                            "user{}@example.com".format(i),
+                                            "password": PASSWORD})),
+        ("POST /api/tokens", n,
+         lambda c, i: c.http().post(c.url + "/api/tokens",
+                                    params={"username": USERNAME,
+                                            "password": PASSWORD})),
+        ("POST /api/add/category", n,
+         lambda c, i: c.http().post(c.url + "/api/add/category",
+                                    params={"token": c.token,
+                                            "name": "Load {}".format(i)})),
+        ("POST /api/add/item", n,
+         lambda c, i: c.http().post(c.url + "/api/add/item",
+                                    params=dict(itemForm(i),
+                                                token=c.token,
+                                                category_id=category(i)))),
+        ("POST /api/add/categories", n,
+         lambda c, i: c.http().post(c.url + "/api/add/categories",
+                                    params={"token": c.token},
+                                    json={"Categories": [
+                                        {"name": "Batch {}".format(i)}
+                                    ]})),
+        ("POST /api/add/items", n,
+         lambda c, i: c.http().post(c.url + "/api/add/items",
+                                    params={"token": c.token},
+                                    json={"Items": [
+                                        dict(itemForm(i),
+                                             category_id=category(i),
+                                             stock=5)
+                                        for _ in range(100)
+                                    ]})),
+        ("PUT /api/update/category", n,
+         lambda c, i: c.http().put(c.url + "/api/update/category",
+                                   params={"token": c.token,
+                                           "id": category(i),
+                                           "name": "Renamed {}".format(i)})),
+        ("PUT /api/update/item", n,
+         lambda c, i: c.http().put(c.url + "/api/update/item",
+                                   params={"token": c.token, "id": item(i),
+                                           "stock": i % 50})),
+        ("GET /categories/add", n,
+         lambda c, i: c.admin().get(c.url + "/categories/add")),
+        ("POST /categories/add", n,
+         lambda c, i: c.admin().post(c.url + "/categories/add",
+                                     data={"name": "Form {}".format(i)},
+                                     files={"image": ("", b"")},
+                                     allow_redirects=False)),
+        ("GET /categories/update/<id>", n,
+         lambda c, i: c.admin().get(c.url + "/categories/update/{}"
+                                    .format(category(i)))),
+        ("POST /categories/update/<id>", n,
+         lambda c, i: c.admin().post(c.url + "/categories/update/{}"
+                                     .format(category(i)),
+                                     data={"name": "Form {}".format(i)},
+                                     files={"image": ("", b"")},
+                                     allow_redirects=False)),
+        ("GET /items/<category_id>/add", n,
+         lambda c, i: c.admin().get(c.url + "/items/{}/add"
+                                    .format(category(i)))),
+        ("POST /items/<category_id>/add", n,
+         lambda c, i: c.admin().post(c.url + "/items/{}/add"
+                                     .format(category(i)),
+                                     data=itemForm(i),
+                                     allow_redirects=False)),
+        ("GET /items/update/<category_id>/<item_id>", n,
+         lambda c, i: c.admin().get(c.url + "/items/update/1/{}"
+                                    .format(item(i)))),
+        ("POST /items/update/<category_id>/<item_id>", n,
+         lambda c, i: c.admin().post(c.url + "/items/update/1/{}"
+                                     .format(item(i)),
+                                     data=itemForm(i),
+                                     allow_redirects=False)),
+        ("GET /items/delete/<category_id>/<item_id>", n,
+         lambda c, i: c.admin().get(c.url + "/items/delete/1/{}"
+                                    .format(item(i)))),
+        ("POST /items/delete/<category_id>/<item_id>", n,
+         lambda c, i: c.admin().post(c.url + "/items/delete/1/{}"
+                                     .format(items - i),
+                                     allow_redirects=False)),
+        ("DELETE /api/delete/item", n,
+         lambda c, i: c.http().delete(c.url + "/api/delete/item",
+                                      params={"token": c.token,
+                                              "id": items - n - i})),
+        ("GET /categories/delete/<id>", n,
+         lambda c, i: c.admin().get(c.url + "/categories/delete/{}"
+                                    .format(category(i)))),
+        ("POST /categories/delete/<id>", category_deletes,
+         lambda c, i: c.admin().post(c.url + "/categories/delete/{}"
+                                     .format(categories - i),
+                                     allow_redirects=False)),
+        ("DELETE /api/delete/category", category_deletes,
+         lambda c, i: c.http().delete(c.url + "/api/delete/category",
+                                      params={"token": c.token,
+                                              "id": categories -
+                                              category_deletes - i})),
+        ("GET /logout", n,
+         lambda c, i: c.http().get(c.url + "/logout",
+                                   allow_redirects=False))
+    ]
+
+
+#############
+# MEASURING #
+#############
+
+def percentile(ordered, fraction):
+    """ Return the given percentile of a sorted list. """
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def runEndpoint(client, pid, count, request_function, concurrency):
+    """ Issue count requests concurrently and return their statistics. """
+    latencies = []
+    errors = []
+
+    def timed(index):
+        start = time.perf_counter()
+        try:
+            response = request_function(client, index)
+        except requests.RequestException:
+            response = None
+        latencies.append(time.perf_counter() - start)
+        # Admin pages redirect to the login page when not logged in
+        if response is None or response.status_code >= 400 or \
+                response.headers.get("Location", "").endswith("/login"):
+            errors.append(index)
+
+    sampler = RSSSampler(pid)
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(timed, range(count)))
+    elapsed = time.perf_counter() - start
+    peak_rss_kb = sampler.stop()
+
+    ordered = sorted(latencies)
+    return {
+        "requests": count,
+        "errors": len(errors),
+        "requests_per_s": round(count / elapsed, 1),
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+        "peak_rss_kb": peak_rss_kb
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Load test every catalog route."
+             )
+    parser.add_argument("--categories", type=int, default=100)
+    parser.add_argument("--items-per-category", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--requests", type=int, default=200,
+                        help="requests issued per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--bcrypt-log-rounds", type=int, default=12)
+    parser.add_argument("--server", choices=["werkzeug", "gunicorn"],
+                        default="werkzeug")
+    parser.add_argument("--only", help="run only endpoints containing this")
+    parser.add_argument("--output", help="also write the JSON report here")
+    args = parser.parse_args()
+    items = args.categories * args.items_per_category
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = dict(os.environ)
+        env["CATALOG_DATABASE_URL"] = \
+            "sqlite:///" + os.path.join(tmp_dir, "catalog.db")
+        env["CATALOG_SECRET_KEYS"] = os.urandom(32).hex()
+        env["CATALOG_BCRYPT_LOG_ROUNDS"] = str(args.bcrypt_log_rounds)
+        subprocess.check_call([sys.executable, "populate_db.py",
+                               "--categories", str(args.categories),
+                               "--items-per-category",
+                               str(args.items_per_category),
+                               "--seed", str(args.seed)],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+
+        process, url = startServer(args.server, freePort(), env)
+        try:
+            requests.post(url + "/api/registration",
+                          params={"username": USERNAME,
+                                  "password": PASSWORD})
+            token = requests.post(url + "/api/tokens",
+                                  params={"username": USERNAME,
+                                          "password": PASSWORD}
+                                  ).json()["token"]
+            client = Client(url, token)
+            results = {}
+            for name, count, request_function in buildEndpoints(
+                    args.categories, items, args.requests):
+                if args.only and args.only not in name:
+                    continue
+                results[name] = runEndpoint(client, process.pid, count,
+                                            request_function,
+                                            args.concurrency)
+                print("{:<48} {:>8.1f} req/s  p95 {:>8.2f} ms".format(
+                          name, results[name]["requests_per_s"],
+                          results[name]["p95_ms"]), file=sys.stderr)
+        finally:
+            process.terminate()
+            process.wait()
+
+    report = {
+        "config": {
+            "categories": args.categories,
+            "items": items,
+            "requests_per_endpoint": args.requests,
+            "concurrency": args.concurrency,
+            "bcrypt_log_rounds": args.bcrypt_log_rounds,
+            "server": args.server
+        },
+        "endpoints": results
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            output_file.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
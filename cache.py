@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# In-process LRU cache with TTL expiry, a memory cap and tag-based       #
+# invalidation, used to serve catalog reads without touching the DB.     #
+##########################################################################
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+# Returned by LRUCache.get() on a miss, since None is a valid cached value
+MISSING = object()
+
+
+def estimateSize(value):
+    """ Return the approximate memory cost of a cached value in bytes. """
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    return len(json.dumps(value, default=str))
+
+
+class LRUCache(object):
+    """
+    Thread-safe least-recently-used cache.
+
+    Entries expire ttl seconds after being set and the least recently used
+    entries are evicted once either max_entries or max_bytes is exceeded.
+    Each entry may carry tags so that writes can invalidate every entry
+    derived from a given category or item. The generation counter advances
+    on every invalidation, letting callers refuse to cache a value loaded
+    before a concurrent write.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=32 * 1024 * 1024,
+                 ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+        self.size_bytes = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """ Return the value cached under key, or MISSING. """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return MISSING
+            value, size, expires, tags = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return MISSING
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, tags=(), ttl=None, generation=None):
+        """
+        Cache value under key, evicting older entries as needed.
+
+        If generation is given and the cache has been invalidated since it
+        was read, the value may be stale and is not cached.
+        """
+        size = estimateSize(value)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires, tuple(tags))
+            self.size_bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or \
+                    self.size_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def getOrSet(self, key, loader, tags=(), ttl=None):
+        """ Return the value cached under key, loading it on a miss. """
+        value = self.get(key)
+        if value is MISSING:
+            generation = self.generation
+            value = loader()
+            self.set(key, value, tags, ttl, generation)
+        return value
+
+    def invalidate(self, *tags):
+        """ Drop every entry carrying any of the given tags. """
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in self._tags.pop(tag, ()):
+                    if key in self._entries:
+                        self._remove(key)
+                        self.invalidations += 1
+
+    def clear(self):
+        """ Drop every entry. """
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tags.clear()
+            self.size_bytes = 0
+
+    def stats(self):
+        """ Return a dict of usage counters for sizing the cache. """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations
+            }
+
+    def _remove(self, key):
+        """ Remove an entry and its tag references (lock must be held). """
+        value, size, expires, tags = self._entries.pop(key)
+        self.size_bytes -= size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Append-only log of catalog writes behind /api/changes. Triggers add   #
+# an entry with a new sequence number for every item and category       #
+# insert, update and delete, so mirrors can fetch what changed since    #
+# the last sequence number they saw. Entries past the retention window  #
+# are removed; running this file directly removes them once.            #
+##########################################################################
+
+import logging
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+import config
+from inventory import ITEM_DELETE_APPLIES
+from models import CatalogChange, Category, Item
+
+
+#############
+# CONSTANTS #
+#############
+
+# Appends an entry for a row of a table; AUTOINCREMENT keeps sequence
+# numbers increasing even after the newest entries are removed
+LOG_CHANGE = """
+    INSERT INTO catalog_change (entity, entity_id, deleted, changed,
+                                category_id, old_category_id, fields)
+    VALUES ('{table}', {row}.id, {deleted},
+            CAST(strftime('%s', 'now') AS INTEGER),
+            {category}, {old_category}, {fields});
+"""
+
+# Item columns whose changes are logged, bit i of an entry's fields
+# standing for ITEM_FIELDS[i]; inserts, deletes and category writes set
+# every bit (-1)
+ITEM_FIELDS = ("id", "name", "description", "price_cents", "stock",
+               "category_id")
+
+# The fields of an item update: the bits of the columns it changed
+CHANGED_FIELDS = " | ".join("((old.{0} IS NOT new.{0}) << {1})"
+                            .format(field, bit)
+                            for bit, field in enumerate(ITEM_FIELDS))
+
+# The category logged with a write to each table: the item's (before a
+# delete), or the category itself
+LOGGED_CATEGORY = {"item": "{row}.category_id", "category": "{row}.id"}
+
+# The latest sequence number ever handed out; unlike MAX(seq), SQLite's
+# counter survives compaction
+LATEST_SEQ = text("SELECT seq FROM sqlite_sequence "
+                  "WHERE name = 'catalog_change'")
+
+# Up to :limit entries after a sequence number, oldest first
+ENTRIES_AFTER = text("""
+    SELECT seq, entity, entity_id, deleted, category_id, old_category_id,
+           fields
+    FROM catalog_change WHERE seq > :since ORDER BY seq LIMIT :limit
+""")
+
+
+def changeTrigger(table, event, suffix):
+    """ Return the name and DDL of a trigger logging writes to a table. """
+    name = "catalog_change_{}_{}".format(table, suffix)
+    row = "old" if event == "DELETE" else "new"
+    # An update of an item names the columns it changed, and the category
+    # the item left if it was moved
+    item_update = table == "item" and event == "UPDATE"
+    old_category = "NULLIF(old.category_id, new.category_id)" \
+        if item_update else "NULL"
+    # The delete of a category is logged for its items too
+    when = "WHEN {} ".format(ITEM_DELETE_APPLIES) \
+        if table == "item" and event == "DELETE" else ""
+    return name, "CREATE TRIGGER IF NOT EXISTS {} AFTER {} ON {} {}BEGIN " \
+        "{} END".format(name, event, table, when,
+                     LOG_CHANGE.format(
+                         table=table, row=row,
+                         deleted=int(event == "DELETE"),
+                         category=LOGGED_CATEGORY[table].format(row=row),
+                         old_category=old_category,
+                         fields=CHANGED_FIELDS if item_update else -1
+                     ))
+
+
+def changedFields(entry):
+    """ Return the ITEM_FIELDS an item's log entry changed. """
+    return [field for bit, field in enumerate(ITEM_FIELDS)
+            if entry.fields >> bit & 1]
+
+
+# Triggers logging every insert, update and delete, including bulk writes
+# that bypass the ORM
+TRIGGERS = [changeTrigger(table, event, suffix)
+            for table in ("item", "category")
+            for event, suffix in (("INSERT", "ai"), ("UPDATE", "au"),
+                                  ("DELETE", "ad"))]
+
+SCHEMA = [statement for name, statement in TRIGGERS]
+
+TRIGGER_NAMES = [name for name, statement in TRIGGERS]
+
+MODELS = {"item": Item, "category": Category}
+
+logger = logging.getLogger(__name__)
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+def createChangeTriggers(engine):
+    """ Create the triggers appending to the change log if missing. """
+    with engine.begin() as conn:
+        for statement in SCHEMA:
+            conn.execute(text(statement))
+
+
+def dropChangeTriggers(cursor):
+    """
+    Stop logging changes, e.g. during a bulk load.
+
+    resetChangeLog() must then be run so that mirrors sync in full
+    rather than miss the changes made meanwhile.
+    """
+    for name in TRIGGER_NAMES:
+        cursor.execute("DROP TRIGGER IF EXISTS {}".format(name))
+
+
+def resetChangeLog(cursor):
+    """ Remove every entry and move the sequence past every number handed
+    out, so that every mirror is told to sync in full. """
+    cursor.execute("INSERT INTO catalog_change (entity, entity_id, "
+                   "deleted, changed) VALUES ('catalog', 0, 0, 0)")
+    cursor.execute("DELETE FROM catalog_change")
+
+
+def compactChanges(conn, retention):
+    """ Remove the entries older than retention seconds from the change
+    log and return how many were removed. """
+    return conn.execute(
+               text("DELETE FROM catalog_change WHERE changed < :cutoff"),
+               {"cutoff": int(time.time()) - retention}
+           ).rowcount
+
+
+def compactPeriodically(engine):
+    """ Compact the change log every CHANGE_LOG_COMPACT_INTERVAL seconds;
+    runs on a background thread. """
+    while True:
+        try:
+            with engine.begin() as conn:
+                compactChanges(conn, config.CHANGE_LOG_RETENTION)
+        except SQLAlchemyError as error:
+            logger.warning("Could not compact the change log: %s", error)
+        time.sleep(config.CHANGE_LOG_COMPACT_INTERVAL)
+
+
+def startCompaction(engine):
+    """ Start compacting the change log in the background. """
+    threading.Thread(target=compactPeriodically, args=(engine,),
+                     name="change-log-compaction", daemon=True).start()
+
+
+def latestSeq(db_session):
+    """ Return the sequence number of the latest change ever logged, or 0
+    if none has been. """
+    row = db_session.execute(LATEST_SEQ).first()
+    return row.seq if row is not None else 0
+
+
+def changeHorizon(db_session):
+    """
+    Return the lowest sequence number changes can still be fetched after.
+
+    Entries up to it have been compacted away, so a mirror that last saw
+    an older sequence number cannot catch up from the log.
+    """
+    oldest = db_session.query(CatalogChange.seq) \
+                       .order_by(CatalogChange.seq).first()
+    if oldest is not None:
+        return oldest.seq - 1
+    return latestSeq(db_session)
+
+
+def changesSince(db_session, since, limit):
+    """
+    Return (changes, last sequence number, whether more follow) for up to
+    limit log entries after since.
+
+    Each changed item or category appears once, at its latest sequence
+    number in the page, with its current data, or as a tombstone if it no
+    longer exists. Pass the last sequence number as since to continue.
+    """
+    # One entry past the page tells whether more follow
+    entries = db_session.query(CatalogChange) \
+                        .filter(CatalogChange.seq > since) \
+                        .order_by(CatalogChange.seq).limit(limit + 1).all()
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    latest = {}
+    for entry in entries:
+        latest[entry.entity, entry.entity_id] = entry
+    rows = {}
+    for entity, model in MODELS.items():
+        ids = [entity_id for (kind, entity_id) in latest if kind == entity]
+        if ids:
+            rows.update(((entity, row.id), row) for row in
+                        db_session.query(model).filter(model.id.in_(ids)))
+    changes = []
+    for key, entry in sorted(latest.items(), key=lambda pair: pair[1].seq):
+        change = {"seq": entry.seq, "type": entry.entity,
+                  "id": entry.entity_id, "deleted": key not in rows}
+        if key in rows:
+            change["data"] = rows[key].serialize
+        changes.append(change)
+    last_seq = entries[-1].seq if entries else since
+    return changes, last_seq, has_more
+
+
+class ChangeFollower(object):
+    """
+    Applies the change log, in order, to state kept by a process, such as
+    its cache of catalog reads, so that writes made by every process reach
+    it.
+
+    apply is called with each new entry. If entries were missed (removed
+    by compaction or resetChangeLog(), or more than batch pending), reset
+    is called instead and the state must start over. Threads may follow
+    the log concurrently.
+    """
+
+    def __init__(self, apply, reset, batch):
+        self.apply = apply
+        self.reset = reset
+        self.batch = batch
+        self.seq = None
+        self._lock = threading.Lock()
+
+    def behind(self, latest):
+        """ Return True if entries up to latest have not been followed. """
+        return self.seq is None or self.seq < latest
+
+    def follow(self, latest, entries):
+        """
+        Follow the entries of ENTRIES_AFTER read after self.seq, given the
+        latest sequence number read before them.
+
+        The first call resets, as nothing is known of earlier entries.
+        """
+        with self._lock:
+            if self.seq is not None:
+                expected = self.seq + 1
+                for entry in entries:
+                    if entry.seq < expected:
+                        # Followed by another thread meanwhile
+                        continue
+                    if entry.seq > expected:
+                        break
+                    self.apply(entry)
+                    expected += 1
+                else:
+                    if expected > latest:
+                        self.seq = expected - 1
+                        return
+            self.reset()
+            self.seq = max([latest] + [entry.seq for entry in entries])
+
+    def catchUp(self, db_session):
+        """ Read and follow the entries logged since the last call. """
+        latest = latestSeq(db_session)
+        if not self.behind(latest):
+            return
+        entries = [] if self.seq is None else db_session.execute(
+                      ENTRIES_AFTER, {"since": self.seq, "limit": self.batch}
+                  ).fetchall()
+        self.follow(latest, entries)
+
+
+###############################################################################
+
+if __name__ == "__main__":
+    from models import engine
+
+    with engine.begin() as conn:
+        removed = compactChanges(conn, config.CHANGE_LOG_RETENTION)
+    print("Removed {} change log entries older than {} seconds."
+          .format(removed, config.CHANGE_LOG_RETENTION))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Deployment settings shared by the app and its maintenance scripts.     #
+# Every setting can be overridden with the environment variable named.   #
+##########################################################################
+
+import os
+
+
+def envInt(name, default):
+    """ Return an integer setting from the environment or the default. """
+    return int(os.environ.get(name, default))
+
+
+# SQLAlchemy URL of the catalog database
+DATABASE_URL = os.environ.get("CATALOG_DATABASE_URL",
+                              "sqlite:///item_catalog.db")
+
+# Number of connections kept open in the pool, and how many more may be
+# opened temporarily under load
+DB_POOL_SIZE = envInt("CATALOG_DB_POOL_SIZE", 5)
+DB_MAX_OVERFLOW = envInt("CATALOG_DB_MAX_OVERFLOW", 10)
+
+# Seconds to wait for a free pooled connection before failing the request
+DB_POOL_TIMEOUT = envInt("CATALOG_DB_POOL_TIMEOUT", 30)
+
+# Seconds after which pooled connections are replaced
+DB_POOL_RECYCLE = envInt("CATALOG_DB_POOL_RECYCLE", 3600)
+
+# Seconds an SQLite connection waits on a locked database before failing
+DB_BUSY_TIMEOUT = envInt("CATALOG_DB_BUSY_TIMEOUT", 15)
+
+# Keys signing access tokens and session cookies, newest first. The first
+# key signs; the others are still accepted so keys can be rotated without
+# invalidating tokens and sessions. Given inline (comma-separated) or as a
+# file holding one key per line, which is generated if missing.
+SECRET_KEYS = os.environ.get("CATALOG_SECRET_KEYS")
+SECRET_KEYS_FILE = os.environ.get("CATALOG_SECRET_KEYS_FILE",
+                                  os.path.join("data", "secret_keys"))
+
+
+def generateSecretKeysFile():
+    """ Write a new random key to SECRET_KEYS_FILE unless it exists. """
+    key_dir = os.path.dirname(SECRET_KEYS_FILE)
+    if key_dir:
+        os.makedirs(key_dir, exist_ok=True)
+    temp_path = "{}.{}.tmp".format(SECRET_KEYS_FILE, os.getpid())
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as key_file:
+        key_file.write(os.urandom(32).hex() + "\n")
+    try:
+        # Linking fails if another worker got there first, so concurrently
+        # starting workers all end up with the same, complete key file
+        os.link(temp_path, SECRET_KEYS_FILE)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(temp_path)
+
+
+def loadSecretKeys():
+    """
+    Return the signing key ring, newest key first.
+
+    Without configured keys, a key is generated into SECRET_KEYS_FILE so
+    that every worker process on this host, and later restarts, share it.
+    Nodes on other hosts must be given the same keys.
+    """
+    if SECRET_KEYS:
+        keys = [key.strip() for key in SECRET_KEYS.split(",")]
+    else:
+        if not os.path.exists(SECRET_KEYS_FILE):
+            generateSecretKeysFile()
+        with open(SECRET_KEYS_FILE, "r") as key_file:
+            keys = [line.strip() for line in key_file]
+    keys = [key for key in keys if key and not key.startswith("#")]
+    if not keys:
+        raise RuntimeError("No secret keys configured.")
+    return keys
+
+
+# bcrypt cost factor (log2 rounds) for new password hashes; stored hashes
+# with a different cost are re-hashed on the next successful login
+BCRYPT_LOG_ROUNDS = envInt("CATALOG_BCRYPT_LOG_ROUNDS", 12)
+
+# Threads dedicated to password hashing, and the most hashing tasks that
+# may be queued or running before requests are refused with a 503
+PASSWORD_WORKERS = envInt("CATALOG_PASSWORD_WORKERS", 2)
+PASSWORD_QUEUE_DEPTH = envInt("CATALOG_PASSWORD_QUEUE_DEPTH", 16)
+
+# Set to 0 to stop timing requests; when enabled, each response carries a
+# Server-Timing header and /metrics serves Prometheus histograms
+METRICS_ENABLED = envInt("CATALOG_METRICS_ENABLED", 1) != 0
+
+# Directory of the content-addressed image store, holding every uploaded
+# image once together with its resized variants
+IMAGE_STORE_DIR = os.environ.get("CATALOG_IMAGE_STORE_DIR",
+                                 os.path.join("data", "images"))
+
+# Largest image upload accepted (bytes); larger uploads are refused while
+# they are still being received
+MAX_IMAGE_BYTES = envInt("CATALOG_MAX_IMAGE_BYTES", 10 * 1024 * 1024)
+
+# Threads resizing uploaded images, and the most images that may be
+# queued or processing before further uploads are refused
+IMAGE_WORKERS = envInt("CATALOG_IMAGE_WORKERS", 2)
+IMAGE_QUEUE_DEPTH = envInt("CATALOG_IMAGE_QUEUE_DEPTH", 32)
+
+# Threads of the ASGI server (asgi.py) running routes it hands to the
+# Flask app, i.e. everything but the catalog GET API
+ASGI_WSGI_THREADS = envInt("CATALOG_ASGI_WSGI_THREADS", 16)
+
+# Base URLs of Google's OAuth2 endpoints (code exchange and revocation)
+# and APIs (signing keys and user info); point them at a stand-in
+# provider for testing
+GOOGLE_OAUTH_URL = os.environ.get("CATALOG_GOOGLE_OAUTH_URL",
+                                  "https://oauth2.googleapis.com")
+GOOGLE_APIS_URL = os.environ.get("CATALOG_GOOGLE_APIS_URL",
+                                 "https://www.googleapis.com")
+
+# Seconds to wait for a connection to Google and for its response, and
+# the number of kept-alive connections to Google per worker process
+GOOGLE_CONNECT_TIMEOUT = envInt("CATALOG_GOOGLE_CONNECT_TIMEOUT", 3)
+GOOGLE_READ_TIMEOUT = envInt("CATALOG_GOOGLE_READ_TIMEOUT", 5)
+GOOGLE_HTTP_POOL_SIZE = envInt("CATALOG_GOOGLE_HTTP_POOL_SIZE", 10)
+
+# Seconds entries of the change log (/api/changes) are kept; mirrors that
+# fall further behind must sync in full again
+CHANGE_LOG_RETENTION = envInt("CATALOG_CHANGE_LOG_RETENTION",
+                              7 * 24 * 60 * 60)
+
+# Seconds between removals of change log entries past their retention
+CHANGE_LOG_COMPACT_INTERVAL = envInt("CATALOG_CHANGE_LOG_COMPACT_INTERVAL",
+                                     60 * 60)
+
+# Milliseconds between reads of the change log for stock changes to push
+# to live category pages (/api/stock/stream); the reads only run while
+# some page is subscribed
+STOCK_STREAM_POLL_MS = envInt("CATALOG_STOCK_STREAM_POLL_MS", 500)
+
+# Seconds between keep-alive comments on an idle stock stream, so proxies
+# do not close it and dead clients are noticed; clients of the ASGI
+# server that take longer to accept an event are disconnected
+STOCK_STREAM_HEARTBEAT = envInt("CATALOG_STOCK_STREAM_HEARTBEAT", 15)
+
+# Stock events a stream subscriber may fall behind by before it is
+# disconnected; its browser reconnects and catches up from the log
+STOCK_STREAM_QUEUE_DEPTH = envInt("CATALOG_STOCK_STREAM_QUEUE_DEPTH", 32)
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Content-addressed image store. Images are kept once per SHA-256 of     #
+# their bytes, next to pre-generated resized JPEG and WebP variants,     #
+# and referenced from the catalog by that digest. Running this file      #
+# directly moves images still referenced by file path into the store.    #
+##########################################################################
+
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+
+from PIL import Image, ImageOps
+
+import config
+
+
+#############
+# CONSTANTS #
+#############
+
+# Resized variants generated for every image: name -> (width, height,
+# crop). Cropped variants fill the box, the others fit inside it.
+VARIANTS = {
+    "card": (480, 240, False),
+    "thumb": (200, 200, True)
+}
+
+# Formats every variant is encoded in, with their encoder options
+FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True})
+}
+
+MIMETYPES = {"webp": "image/webp", "jpg": "image/jpeg"}
+
+# Every file name a stored image directory may hold besides the original
+VARIANT_FILES = frozenset("{}.{}".format(variant, extension)
+                          for variant in VARIANTS for extension in FORMATS)
+
+# Refuse images whose decoded size could exhaust memory
+Image.MAX_IMAGE_PIXELS = 40 * 1000 * 1000
+
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+CHUNK_BYTES = 64 * 1024
+
+
+class InvalidImage(ValueError):
+    """ Raised for uploads that are not images Pillow can decode. """
+
+
+class ImageTooLarge(Exception):
+    """ Raised while an upload is received once it exceeds the limit. """
+
+
+class UploadSpool(object):
+    """
+    Writable file an upload is streamed into as it is received.
+
+    The bytes go to a temporary file in the store and are hashed and
+    counted on the way, so the upload is never held in memory or read a
+    second time, and an oversized upload is refused as soon as it passes
+    max_bytes. Closing the spool deletes the file unless release() has
+    handed it over.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._digest = hashlib.sha256()
+        fd, self.path = tempfile.mkstemp(dir=stagingDir())
+        self._file = os.fdopen(fd, "w+b")
+        self._released = False
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            # The parser drops the part, so nothing else would clean up
+            self.close()
+            raise ImageTooLarge("Images may be at most {} bytes."
+                                .format(self.max_bytes))
+        self._digest.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        # read(), seek() etc. for the form parser and FileStorage
+        return getattr(self._file, name)
+
+    def release(self):
+        """ Close the file and return its (path, digest); the caller is
+        then responsible for deleting it. """
+        self._file.close()
+        self._released = True
+        return self.path, self._digest.hexdigest()
+
+    def close(self):
+        self._file.close()
+        if not self._released:
+            self._released = True
+            os.unlink(self.path)
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+def isDigest(value):
+    """ Return True if value references a stored image. """
+    return isinstance(value, str) and DIGEST_PATTERN.match(value) is not None
+
+
+def imageDir(digest):
+    """ Return the directory holding a stored image and its variants. """
+    return os.path.join(config.IMAGE_STORE_DIR, digest[:2], digest)
+
+
+def isStored(digest):
+    """ Return True if an image and all its variants are in the store. """
+    return os.path.exists(os.path.join(imageDir(digest), "original"))
+
+
+def decodeImage(image_file):
+    """
+    Decode an open image file and return it turned upright.
+
+    Raises InvalidImage if Pillow cannot decode it.
+    """
+    try:
+        with Image.open(image_file) as image:
+            image.load()
+            return ImageOps.exif_transpose(image)
+    except (OSError, SyntaxError, ValueError,
+            Image.DecompressionBombError) as error:
+        raise InvalidImage("Not a supported image: {}".format(error))
+
+
+def renderVariants(image, directory):
+    """ Write every resized variant of a decoded image into directory. """
+    for variant, (width, height, crop) in VARIANTS.items():
+        if crop:
+            resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail((width, height), Image.LANCZOS)
+        for extension, (image_format, options) in FORMATS.items():
+            output = resized
+            if image_format == "JPEG" and output.mode != "RGB":
+                # JPEG has no alpha channel; flatten onto white
+                output = Image.new("RGB", resized.size, "white")
+                rgba = resized.convert("RGBA")
+                output.paste(rgba, mask=rgba.split()[-1])
+            elif output.mode not in ("RGB", "RGBA"):
+                output = output.convert("RGBA")
+            output.save(os.path.join(directory,
+                                     "{}.{}".format(variant, extension)),
+                        image_format, **options)
+
+
+def storeFile(path, digest=None):
+    """
+    Add the image file at path to the store and return its digest.
+
+    Identical images are stored once: if the digest is already present
+    nothing is written. Variants are rendered into a temporary directory
+    that is renamed into place, so readers never see a partial image.
+    Raises InvalidImage if the file cannot be decoded; errors reading the
+    file or writing the store (e.g. a full disk) propagate as they are.
+    """
+    if digest is None:
+        digest = fileDigest(path)
+    if isStored(digest):
+        return digest
+    with open(path, "rb") as image_file:
+        image = decodeImage(image_file)
+    staging = tempfile.mkdtemp(dir=stagingDir())
+    try:
+        renderVariants(image, staging)
+        shutil.copyfile(path, os.path.join(staging, "original"))
+        target = imageDir(digest)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.rename(staging, target)
+        except OSError:
+            # Another process stored the same image meanwhile
+            if not isStored(digest):
+                raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return digest
+
+
+def acceptUpload(upload):
+    """
+    Take over an upload received into an UploadSpool and return its
+    (path, digest) for storeFile(); the caller then deletes the file.
+
+    Only the image header is read here, so this is cheap enough for a
+    request thread. Raises InvalidImage (and deletes the file) if the
+    upload is not an image of an acceptable size.
+    """
+    path, digest = upload.stream.release()
+    try:
+        with Image.open(path) as image:
+            if image.width * image.height > Image.MAX_IMAGE_PIXELS:
+                raise InvalidImage("Image dimensions are too large.")
+    except (OSError, SyntaxError, ValueError,
+            Image.DecompressionBombError) as error:
+        os.unlink(path)
+        if isinstance(error, InvalidImage):
+            raise
+        raise InvalidImage("Not a supported image: {}".format(error))
+    return path, digest
+
+
+def stagingDir():
+    """ Return the store's directory for files being written. """
+    path = os.path.join(config.IMAGE_STORE_DIR, "tmp")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def fileDigest(path):
+    """ Return the SHA-256 hex digest of a file's contents. """
+    digest = hashlib.sha256()
+    with open(path, "rb") as image_file:
+        for chunk in iter(lambda: image_file.read(CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def importLegacyImages(conn):
+    """
+    Move images referenced by file path into the store.
+
+    Rewrites the image column of categories and items to the digest of
+    the file they point at. Returns (rows updated, images stored), which
+    differ by the number of duplicates. Missing or unreadable files are
+    left as they are.
+    """
+    cursor = conn.cursor()
+    updated = 0
+    stored = set()
+    for table in ("category", "item"):
+        rows = cursor.execute(
+                   "SELECT id, image FROM {} WHERE image IS NOT NULL "
+                   "AND image != ''".format(table)
+               ).fetchall()
+        for row_id, image in rows:
+            if isDigest(image) or not os.path.isfile(image):
+                continue
+            try:
+                digest = storeFile(image)
+            except InvalidImage:
+                continue
+            cursor.execute("UPDATE {} SET image = ? WHERE id = ?"
+                           .format(table), (digest, row_id))
+            updated += 1
+            stored.add(digest)
+    conn.commit()
+    return updated, len(stored)
+
+
+###############################################################################
+
+if __name__ == "__main__":
+    from models import engine
+
+    conn = engine.raw_connection()
+    try:
+        updated, stored = importLegacyImages(conn)
+    finally:
+        conn.close()
+    print("Moved {} images into the store as {} unique files."
+          .format(updated, stored))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Per-category inventory totals (item count, total stock and stock      #
+# value), kept in the category_summary table by triggers that apply     #
+# each item write as a delta, so reading them never scans the items.    #
+# Running this file directly recomputes every total from the items.     #
+##########################################################################
+
+from sqlalchemy import text
+
+
+#############
+# CONSTANTS #
+#############
+
+# Condition under which the triggers of an item delete apply it to the
+# catalog versions, inventory totals and change log. Items deleted after
+# their category (see views.deleteCategoryWithItems()) are skipped, the
+# category's own delete standing for theirs.
+ITEM_DELETE_APPLIES = "old.category_id IS NULL OR EXISTS " \
+    "(SELECT 1 FROM category WHERE id = old.category_id)"
+
+# Adds a delta to a category's totals; the row is created on the first
+# item. Rows without a category are skipped.
+APPLY_DELTA = """
+    INSERT INTO category_summary (category_id, item_count, total_stock,
+                                  stock_value_cents)
+    SELECT {row}.category_id, {sign}1, {sign}{row}.stock,
+           {sign}{row}.stock * {row}.price_cents
+    WHERE {row}.category_id IS NOT NULL
+    ON CONFLICT (category_id) DO UPDATE
+    SET item_count = item_count + excluded.item_count,
+        total_stock = total_stock + excluded.total_stock,
+        stock_value_cents = stock_value_cents + excluded.stock_value_cents;
+"""
+
+ADD_NEW = APPLY_DELTA.format(row="new", sign="")
+SUBTRACT_OLD = APPLY_DELTA.format(row="old", sign="-")
+
+# Triggers applying every item insert, delete and change of stock, price
+# or category to the totals, including bulk writes that bypass the ORM.
+# A category's totals are removed with it at once.
+SCHEMA = [
+    "CREATE TRIGGER IF NOT EXISTS category_summary_item_ai "
+    "AFTER INSERT ON item BEGIN {} END".format(ADD_NEW),
+    "CREATE TRIGGER IF NOT EXISTS category_summary_item_ad "
+    "AFTER DELETE ON item WHEN {} BEGIN {} END".format(ITEM_DELETE_APPLIES,
+                                                      SUBTRACT_OLD),
+    "CREATE TRIGGER IF NOT EXISTS category_summary_item_au "
+    "AFTER UPDATE OF stock, price_cents, category_id ON item "
+    "BEGIN {} {} END".format(SUBTRACT_OLD, ADD_NEW),
+    "CREATE TRIGGER IF NOT EXISTS category_summary_category_ad "
+    "AFTER DELETE ON category BEGIN "
+    "DELETE FROM category_summary WHERE category_id = old.id; END"
+]
+
+TRIGGER_NAMES = ["category_summary_item_ai", "category_summary_item_ad",
+                 "category_summary_item_au", "category_summary_category_ad"]
+
+# Totals of every category, computed from the items
+SUMMARIZE_ITEMS = """
+    SELECT category_id, COUNT(*), SUM(stock), SUM(stock * price_cents)
+    FROM item WHERE category_id IS NOT NULL
+    GROUP BY category_id
+"""
+
+# Every category with its totals; categories without items have none
+SUMMARY_QUERY = """
+    SELECT category.id, category.name,
+           COALESCE(category_summary.item_count, 0),
+           COALESCE(category_summary.total_stock, 0),
+           COALESCE(category_summary.stock_value_cents, 0)
+    FROM category
+    LEFT JOIN category_summary
+    ON category_summary.category_id = category.id
+"""
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+def createSummaryTriggers(engine):
+    """ Create the triggers maintaining the category totals if missing. """
+    with engine.begin() as conn:
+        for statement in SCHEMA:
+            conn.execute(text(statement))
+
+
+def dropSummaryTriggers(cursor):
+    """
+    Stop maintaining the category totals, e.g. during a bulk load.
+
+    recomputeSummaries() must be run before createSummaryTriggers()
+    restores the triggers, so that the totals include the loaded items.
+    """
+    for name in TRIGGER_NAMES:
+        cursor.execute("DROP TRIGGER IF EXISTS {}".format(name))
+
+
+def recomputeSummaries(cursor):
+    """
+    Replace every category's totals with ones computed from the items.
+
+    Returns the number of categories whose stored totals differed from
+    the computed ones. The caller commits.
+    """
+    stored = {row[0]: tuple(row[1:]) for row in cursor.execute(
+                  "SELECT category_id, item_count, total_stock, "
+                  "stock_value_cents FROM category_summary "
+                  "WHERE item_count != 0"
+              ).fetchall()}
+    computed = {row[0]: tuple(row[1:])
+                for row in cursor.execute(SUMMARIZE_ITEMS).fetchall()}
+    cursor.execute("DELETE FROM category_summary")
+    cursor.executemany(
+        "INSERT INTO category_summary (category_id, item_count, "
+        "total_stock, stock_value_cents) VALUES (?, ?, ?, ?)",
+        [(category_id,) + totals for category_id, totals in computed.items()]
+    )
+    return sum(stored.get(category_id) != computed.get(category_id)
+               for category_id in set(stored) | set(computed))
+
+
+def categorySummaries(db_session, category_id=None):
+    """
+    Return the totals of every category, or of one category, as
+    (id, name, item count, total stock, stock value in cents) rows in
+    category ID order.
+
+    Reads one row per category however many items there are.
+    """
+    if category_id is None:
+        return db_session.execute(
+                   text(SUMMARY_QUERY + " ORDER BY category.id")
+               ).fetchall()
+    return db_session.execute(
+               text(SUMMARY_QUERY + " WHERE category.id = :category_id"),
+               {"category_id": category_id}
+           ).fetchall()
+
+
+###############################################################################
+
+if __name__ == "__main__":
+    from models import engine
+
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        repaired = recomputeSummaries(cursor)
+        categories = cursor.execute(
+                         "SELECT COUNT(*) FROM category_summary"
+                     ).fetchone()[0]
+        conn.commit()
+    finally:
+        conn.close()
+    print("Recomputed the inventory totals of {} categories; {} needed "
+          "repair.".format(categories, repaired))
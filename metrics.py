@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Per-request timing of catalog routes: wall time, DB time and query    #
+# count, bcrypt time and JSON serialization time, reported as a         #
+# Server-Timing header and as Prometheus histograms on /metrics.        #
+# Figures are per process; scrape every worker to cover a deployment.   #
+##########################################################################
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import request
+from flask.json import JSONEncoder
+from sqlalchemy import event
+
+
+#############
+# CONSTANTS #
+#############
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+
+# Request phases timed besides the total wall time
+PHASES = ("db", "bcrypt", "serialize")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+############
+# REGISTRY #
+############
+
+class Histogram(object):
+    """ Cumulative-bucket latency histogram in the Prometheus style. """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        """ Record a duration in seconds. """
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+
+class Registry(object):
+    """ Thread-safe store of per-endpoint histograms and counters. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.queries = {}
+        self.responses = {}
+
+    def record(self, endpoint, status, total, timings):
+        """ Record the measurements of one finished request. """
+        with self.lock:
+            for phase in ("total",) + PHASES:
+                key = (endpoint, phase)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram()
+                histogram.observe(total if phase == "total"
+                                  else getattr(timings, phase))
+            self.queries[endpoint] = \
+                self.queries.get(endpoint, 0) + timings.queries
+            key = (endpoint, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def render(self):
+        """ Return all measurements in the Prometheus text format. """
+        lines = [
+            "# HELP catalog_request_duration_seconds Time spent per "
+            "request phase (total, db, bcrypt, serialize).",
+            "# TYPE catalog_request_duration_seconds histogram"
+        ]
+        with self.lock:
+            for (endpoint, phase), histogram in sorted(
+                    self.histograms.items()):
+                labels = 'endpoint="{}",phase="{}"'.format(endpoint, phase)
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",),
+                                        histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        'catalog_request_duration_seconds_bucket{{{},'
+                        'le="{}"}} {}'.format(labels, bound, cumulative)
+                    )
+                lines.append("catalog_request_duration_seconds_sum{{{}}} {}"
+                             .format(labels, histogram.sum))
+                lines.append("catalog_request_duration_seconds_count{{{}}} "
+                             "{}".format(labels, histogram.count))
+            lines += [
+                "# HELP catalog_db_queries_total SQL statements executed.",
+                "# TYPE catalog_db_queries_total counter"
+            ]
+            for endpoint, count in sorted(self.queries.items()):
+                lines.append('catalog_db_queries_total{{endpoint="{}"}} {}'
+                             .format(endpoint, count))
+            lines += [
+                "# HELP catalog_responses_total Responses by status code.",
+                "# TYPE catalog_responses_total counter"
+            ]
+            for (endpoint, status), count in sorted(self.responses.items()):
+                lines.append('catalog_responses_total{{endpoint="{}",'
+                             'status="{}"}} {}'
+                             .format(endpoint, status, count))
+        return "\n".join(lines) + "\n"
+
+
+class RequestTimings(object):
+    """ Measurements of the request being handled by the current thread. """
+
+    __slots__ = ("start", "db", "bcrypt", "serialize", "queries")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db = self.bcrypt = self.serialize = 0.0
+        self.queries = 0
+
+
+registry = Registry()
+enabled = False
+
+# Holds the RequestTimings of each thread's current request; a plain
+# thread-local is far cheaper to reach than flask.g from the cursor hooks
+current = threading.local()
+current.timings = None
+
+
+##########
+# TIMING #
+##########
+
+class NullTimer(object):
+    """ Context manager doing nothing, used while metrics are disabled. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = NullTimer()
+
+
+@contextmanager
+def phaseTimer(phase):
+    """ Add the time spent in the with-block to a phase of the request. """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = getattr(current, "timings", None)
+        if timings is not None:
+            setattr(timings, phase,
+                    getattr(timings, phase) + time.perf_counter() - start)
+
+
+def timed(phase):
+    """ Return a context manager timing a phase of the current request. """
+    if not enabled:
+        return NULL_TIMER
+    return phaseTimer(phase)
+
+
+class TimedJSONEncoder(JSONEncoder):
+    """ Flask JSON encoder recording its time as the serialize phase. """
+
+    def encode(self, obj):
+        with phaseTimer("serialize"):
+            return JSONEncoder.encode(self, obj)
+
+
+#########
+# HOOKS #
+#########
+
+def startRequest():
+    current.timings = RequestTimings()
+
+
+def finishRequest(response):
+    timings = getattr(current, "timings", None)
+    if timings is None:
+        return response
+    total = time.perf_counter() - timings.start
+    registry.record(request.endpoint or "unmatched", response.status_code,
+                    total, timings)
+    response.headers["Server-Timing"] = \
+        'total;dur={:.2f}, db;dur={:.2f};desc="{} queries", ' \
+        'bcrypt;dur={:.2f}, serialize;dur={:.2f}'.format(
+            total * 1000, timings.db * 1000, timings.queries,
+            timings.bcrypt * 1000, timings.serialize * 1000
+        )
+    return response
+
+
+def clearRequest(exception=None):
+    current.timings = None
+
+
+def beforeCursorExecute(conn, cursor, statement, parameters, context,
+                        executemany):
+    # A single start time rather than a stack: a statement that raises
+    # never reaches afterCursorExecute(), and its start time is simply
+    # overwritten by the next statement on the connection
+    conn.info["metrics_query_start"] = time.perf_counter()
+
+
+def afterCursorExecute(conn, cursor, statement, parameters, context,
+                       executemany):
+    start = conn.info.pop("metrics_query_start", None)
+    if start is None:
+        return
+    timings = getattr(current, "timings", None)
+    if timings is not None:
+        timings.db += time.perf_counter() - start
+        timings.queries += 1
+
+
+def init(app, engine):
+    """
+    Start measuring requests to app and statements run on engine, and
+    serve the measurements at /metrics.
+
+    Nothing is registered unless this is called, so disabled metrics cost
+    nothing.
+    """
+    global enabled
+    enabled = True
+    app.before_request(startRequest)
+    app.after_request(finishRequest)
+    app.teardown_request(clearRequest)
+    app.json_encoder = TimedJSONEncoder
+    event.listen(engine, "before_cursor_execute", beforeCursorExecute)
+    event.listen(engine, "after_cursor_execute", afterCursorExecute)
+
+    @app.route("/metrics")
+    def getMetrics():
+        return app.response_class(registry.render(),
+                                  content_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Versioned schema migrations for existing SQLite catalog databases.     #
+# The applied version is kept in PRAGMA user_version; running this file  #
+# directly upgrades the configured database.                             #
+##########################################################################
+
+import logging
+
+from sqlalchemy import inspect
+
+import inventory
+from prices import parsePrice
+
+logger = logging.getLogger(__name__)
+
+
+###################
+# MIGRATION STEPS #
+###################
+
+def addItemLookupIndexes(cursor):
+    """ Index the item columns looked up by category and by name. """
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_item_category_id "
+                   "ON item (category_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_item_name ON item (name)")
+
+
+def convertItemPriceToCents(cursor):
+    """
+    Replace the "$25"-style item price strings with indexed integer cents.
+
+    SQLite cannot change a column's type in place, so the item table is
+    rebuilt, each price parsed as the app parses submitted ones. Prices
+    it cannot parse are logged with their item IDs and abort the
+    migration, leaving the database unchanged until they are fixed.
+    Dropping the old table also drops the search index triggers;
+    search.createSearchIndex() restores them when the app starts. The
+    rebuilt table, and the category table, also get the image_seq column
+    ordering image uploads.
+    """
+    columns = [row[1] for row in
+               cursor.execute("PRAGMA table_info(category)")]
+    if "image_seq" not in columns:
+        cursor.execute("ALTER TABLE category ADD COLUMN image_seq INTEGER")
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(item)")]
+    if "price_cents" in columns:
+        return
+    cursor.execute("""
+        CREATE TABLE item_migrated (
+            id INTEGER NOT NULL,
+            name VARCHAR NOT NULL,
+            description VARCHAR,
+            price_cents INTEGER NOT NULL,
+            stock INTEGER NOT NULL,
+            image VARCHAR,
+            image_seq INTEGER,
+            category_id INTEGER,
+            PRIMARY KEY (id),
+            FOREIGN KEY(category_id) REFERENCES category (id)
+        )
+    """)
+    invalid = []
+
+    def migratedRows(rows):
+        for item_id, name, description, price, stock, image, \
+                category_id in rows:
+            try:
+                price_cents = parsePrice(price)
+            except ValueError:
+                invalid.append((item_id, price))
+                continue
+            yield (item_id, name, description, price_cents, stock, image,
+                   None, category_id)
+
+    # The rows are read on a cursor of their own while inserting
+    reader = cursor.connection.cursor()
+    reader.execute("SELECT id, name, description, price, stock, image, "
+                   "category_id FROM item")
+    cursor.executemany("INSERT INTO item_migrated "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       migratedRows(reader))
+    if invalid:
+        for item_id, price in invalid:
+            logger.error("Item %s has an invalid price: %r", item_id, price)
+        raise RuntimeError("{} item prices could not be converted to cents; "
+                           "correct them and start again."
+                           .format(len(invalid)))
+    cursor.execute("DROP TABLE item")
+    cursor.execute("ALTER TABLE item_migrated RENAME TO item")
+    for column in ("name", "category_id", "price_cents", "stock"):
+        cursor.execute("CREATE INDEX ix_item_{0} ON item ({0})"
+                       .format(column))
+
+
+def summarizeInventory(cursor):
+    """
+    Fill the category_summary table (created empty by create_all()) with
+    the totals of the existing items; inventory.createSummaryTriggers()
+    keeps them up to date from then on.
+    """
+    inventory.recomputeSummaries(cursor)
+
+
+# Migration steps in order; a database at version N has had the first N
+# applied. Append new steps, never reorder or remove them.
+MIGRATIONS = [
+    addItemLookupIndexes,
+    convertItemPriceToCents,
+    summarizeInventory
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+def schemaVersion(cursor):
+    """ Return the migration version a database is at. """
+    return cursor.execute("PRAGMA user_version").fetchone()[0]
+
+
+def upgradeSchema(engine, metadata):
+    """
+    Create missing tables and bring an existing database up to date.
+
+    A database created from scratch already has the latest schema and is
+    only stamped with the latest version. Migrations run under an
+    immediate write lock, so concurrently starting workers apply each
+    step once. Steps must be idempotent, since a worker may find tables
+    another worker created moments before. Returns the steps applied.
+    """
+    fresh = not inspect(engine).get_table_names()
+    metadata.create_all(engine)
+    if engine.dialect.name != "sqlite":
+        return []
+    conn = engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        version = LATEST_VERSION if fresh else schemaVersion(cursor)
+        applied = MIGRATIONS[version:]
+        for migration in applied:
+            migration(cursor)
+        # PRAGMA statements take no bound parameters
+        cursor.execute("PRAGMA user_version = {:d}"
+                       .format(max(version, LATEST_VERSION)))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return applied
+
+
+###############################################################################
+
+if __name__ == "__main__":
+    # Importing the models upgrades the configured database
+    from models import engine
+
+    conn = engine.raw_connection()
+    try:
+        version = schemaVersion(conn.cursor())
+    finally:
+        conn.close()
+    print("Schema version {} of {}.".format(version, LATEST_VERSION))
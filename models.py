@@ -4,6 +4,11 @@ from sqlalchemy import Column, String, Integer, ForeignKey
 from sqlalchemy import create_engine
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import QueuePool
+
+import config
+import migrations
+from prices import formatPrice, parsePrice
 
 Base = declarative_base()
 
@@ -14,6 +19,8 @@ class Category(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     image = Column(String)
+    # Upload sequence of the image (see views.processImage())
+    image_seq = Column(Integer)
 
     @property
     def serialize(self):
@@ -28,13 +35,24 @@ class Item(Base):
     """ Table storing item information """
     __tablename__ = "item"
     id = Column(Integer, primary_key=True)
-    name = Column(String, nullable=False)
+    name = Column(String, nullable=False, index=True)
     description = Column(String)
-    price = Column(String, nullable=False)
-    stock = Column(Integer, nullable=False)
+    price_cents = Column(Integer, nullable=False, index=True)
+    stock = Column(Integer, nullable=False, index=True)
     image = Column(String)
+    # Upload sequence of the image (see views.processImage())
+    image_seq = Column(Integer)
     category = relationship(Category)
-    category_id = Column(ForeignKey("category.id"))
+    category_id = Column(ForeignKey("category.id"), index=True)
+
+    @property
+    def price(self):
+        """ Price as a currency string, e.g. "$25" """
+        return formatPrice(self.price_cents)
+
+    @price.setter
+    def price(self, price):
+        self.price_cents = parsePrice(price)
 
     @property
     def serialize(self):
@@ -44,11 +62,49 @@ class Item(Base):
             "name": self.name,
             "description": self.description,
             "price": self.price,
+            "price_cents": self.price_cents,
             "stock": self.stock,
             "category_id": self.category_id
         }
 
 
+class CatalogVersion(Base):
+    """ Table storing the version counters of catalog scopes (see
+    versions.py) """
+    __tablename__ = "catalog_version"
+    scope = Column(Integer, primary_key=True, autoincrement=False)
+    version = Column(Integer, nullable=False)
+    modified = Column(Integer, nullable=False)
+
+
+class CategorySummary(Base):
+    """ Table storing the inventory totals of each category (see
+    inventory.py) """
+    __tablename__ = "category_summary"
+    category_id = Column(Integer, primary_key=True, autoincrement=False)
+    item_count = Column(Integer, nullable=False)
+    total_stock = Column(Integer, nullable=False)
+    stock_value_cents = Column(Integer, nullable=False)
+
+
+class CatalogChange(Base):
+    """ Table storing the append-only log of catalog writes (see
+    changes.py) """
+    __tablename__ = "catalog_change"
+    __table_args__ = {"sqlite_autoincrement": True}
+    seq = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    deleted = Column(Integer, nullable=False)
+    changed = Column(Integer, nullable=False, index=True)
+    # The item's category (before a delete) or the category itself, and
+    # the category an item was moved out of
+    category_id = Column(Integer)
+    old_category_id = Column(Integer)
+    # Bit mask of the item columns changed (see changes.ITEM_FIELDS)
+    fields = Column(Integer, nullable=False, server_default="-1")
+
+
 class User(Base):
     """ Table storing authenticating user information """
     __tablename__ = "user"
@@ -59,5 +115,24 @@ class User(Base):
 
 ###################################################
 
-engine = create_engine("sqlite:///item_catalog.db")
-Base.metadata.create_all(engine)
+def createEngine(url=config.DATABASE_URL):
+    """ Create a database engine with a connection pool sized by config. """
+    options = {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE
+    }
+    if url.startswith("sqlite"):
+        # SQLite file databases default to opening a connection per
+        # checkout; pool them instead and allow use across request threads
+        options["poolclass"] = QueuePool
+        options["connect_args"] = {
+            "check_same_thread": False,
+            "timeout": config.DB_BUSY_TIMEOUT
+        }
+    return create_engine(url, **options)
+
+
+engine = createEngine()
+migrations.upgradeSchema(engine, Base.metadata)
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Google OAuth2 sign-in without per-request round-trips to Google for    #
+# verification. ID tokens are checked locally against Google's signing   #
+# keys, which are cached and refreshed by a background thread; the       #
+# remaining calls (code exchange, revocation) share one pooled           #
+# keep-alive HTTP session with timeouts.                                 #
+##########################################################################
+
+import base64
+import json
+import logging
+import re
+import threading
+import time
+
+import requests
+import rsa
+from requests.adapters import HTTPAdapter
+
+import config
+
+
+#############
+# CONSTANTS #
+#############
+
+TOKEN_URL = config.GOOGLE_OAUTH_URL + "/token"
+REVOKE_URL = config.GOOGLE_OAUTH_URL + "/revoke"
+CERTS_URL = config.GOOGLE_APIS_URL + "/oauth2/v3/certs"
+USER_INFO_URL = config.GOOGLE_APIS_URL + "/oauth2/v1/userinfo"
+
+# Issuers of Google ID tokens
+ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+# Seconds of clock difference tolerated when checking token lifetimes
+CLOCK_SKEW = 300
+
+# Seconds signing keys are kept if Google's response does not say
+DEFAULT_KEYS_MAX_AGE = 3600
+
+# Seconds before a failed key fetch is retried; also the shortest interval
+# between fetches forced by tokens signed with an unknown key
+RETRY_INTERVAL = 60
+
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+logger = logging.getLogger(__name__)
+
+
+class OAuthError(Exception):
+    """ Raised when Google cannot be reached, rejects a request, or
+    returns a token that fails verification. """
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+def loadClientSecrets(path):
+    """ Return the (client ID, client secret) of a client_secret.json. """
+    with open(path, "r") as secrets_file:
+        web = json.load(secrets_file)["web"]
+    return web["client_id"], web.get("client_secret")
+
+
+def createSession():
+    """ Return an HTTP session keeping connections to Google open. """
+    http = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4,
+                          pool_maxsize=config.GOOGLE_HTTP_POOL_SIZE)
+    http.mount("https://", adapter)
+    http.mount("http://", adapter)
+    return http
+
+
+http = createSession()
+
+
+def googleRequest(method, url, **kwargs):
+    """ Send a request to Google over the pooled session and return the
+    response. Raises OAuthError if Google cannot be reached in time. """
+    try:
+        return http.request(method, url,
+                            timeout=(config.GOOGLE_CONNECT_TIMEOUT,
+                                     config.GOOGLE_READ_TIMEOUT),
+                            **kwargs)
+    except requests.RequestException as error:
+        raise OAuthError("Google request failed: {}".format(error))
+
+
+def decodeSegment(segment):
+    """ Decode a base64url segment of a JWT. """
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def decodeNumber(segment):
+    """ Decode a base64url-encoded big-endian integer of a JWK. """
+    return int.from_bytes(decodeSegment(segment), "big")
+
+
+class SigningKeys(object):
+    """
+    Google's ID token signing keys by key ID.
+
+    A background thread refetches the keys before the lifetime Google
+    gives them runs out, so verifying a token needs no network round-trip.
+    Only a token signed with a key not yet known (e.g. just after Google
+    rotates keys) makes the request fetch them, at most once per
+    RETRY_INTERVAL.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self._keys = {}
+        self._expires = 0
+        self._attempted = -RETRY_INTERVAL
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self._thread = None
+
+    def refresh(self):
+        """ Fetch the keys and return how many seconds they stay valid. """
+        with self._refreshing:
+            return self._fetch()
+
+    def _fetch(self):
+        self._attempted = time.monotonic()
+        response = googleRequest("GET", self.url)
+        if response.status_code != 200:
+            raise OAuthError("Fetching signing keys failed with status {}."
+                             .format(response.status_code))
+        try:
+            keys = {key["kid"]: rsa.PublicKey(decodeNumber(key["n"]),
+                                              decodeNumber(key["e"]))
+                    for key in response.json()["keys"]
+                    if key.get("kty") == "RSA"}
+        except (ValueError, KeyError, TypeError):
+            raise OAuthError("Malformed signing keys.")
+        match = MAX_AGE_PATTERN.search(
+                    response.headers.get("Cache-Control", "")
+                )
+        max_age = int(match.group(1)) if match else DEFAULT_KEYS_MAX_AGE
+        with self._lock:
+            self._keys = keys
+            self._expires = time.monotonic() + max_age
+        return max_age
+
+    def run(self):
+        """ Keep the keys fresh; runs on the background thread. """
+        while True:
+            try:
+                # Refetch well before expiry so requests never see stale
+                # keys, even if one attempt fails
+                delay = max(RETRY_INTERVAL, self.refresh() * 0.8)
+            except OAuthError as error:
+                logger.warning("Could not refresh Google signing keys: %s",
+                               error)
+                delay = RETRY_INTERVAL
+            time.sleep(delay)
+
+    def start(self):
+        """ Start the background refresh unless already running. """
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self.run,
+                                            name="google-signing-keys",
+                                            daemon=True)
+        self._thread.start()
+
+    def _lookup(self, key_id):
+        with self._lock:
+            if time.monotonic() >= self._expires:
+                return None
+            return self._keys.get(key_id)
+
+    def get(self, key_id):
+        """ Return the public key of a key ID, or None if Google does not
+        publish it. """
+        key = self._lookup(key_id)
+        if key is None:
+            with self._refreshing:
+                # A refresh under way may have brought the key meanwhile
+                key = self._lookup(key_id)
+                if key is None and \
+                        time.monotonic() - self._attempted >= RETRY_INTERVAL:
+                    self._fetch()
+                    key = self._lookup(key_id)
+        return key
+
+
+signing_keys = SigningKeys(CERTS_URL)
+
+
+def verifyIdToken(id_token, client_id):
+    """
+    Verify a Google ID token locally and return its claims.
+
+    Checks the RS256 signature against Google's cached signing keys, that
+    the token was issued by Google for this client, its lifetime, and that
+    Google verified the email address it carries, if any. Raises
+    OAuthError if any check fails.
+    """
+    try:
+        header_segment, payload_segment, signature_segment = \
+            id_token.split(".")
+        header = json.loads(decodeSegment(header_segment))
+        claims = json.loads(decodeSegment(payload_segment))
+        signature = decodeSegment(signature_segment)
+    except (ValueError, AttributeError, TypeError):
+        raise OAuthError("Malformed ID token.")
+    if header.get("alg") != "RS256":
+        raise OAuthError("Unsupported ID token algorithm.")
+    key = signing_keys.get(header.get("kid"))
+    if key is None:
+        raise OAuthError("ID token signed with an unknown key.")
+    signed = "{}.{}".format(header_segment, payload_segment).encode()
+    try:
+        if rsa.verify(signed, signature, key) != "SHA-256":
+            raise rsa.VerificationError()
+    except rsa.VerificationError:
+        raise OAuthError("Invalid ID token signature.")
+    if claims.get("iss") not in ISSUERS:
+        raise OAuthError("ID token not issued by Google.")
+    if claims.get("aud") != client_id:
+        raise OAuthError("Mismatched token and application IDs.")
+    now = time.time()
+    try:
+        if not claims["iat"] - CLOCK_SKEW <= now < \
+                claims["exp"] + CLOCK_SKEW:
+            raise OAuthError("Expired ID token.")
+    except (KeyError, TypeError):
+        raise OAuthError("ID token without a valid lifetime.")
+    if not claims.get("sub"):
+        raise OAuthError("ID token without a user ID.")
+    # Older tokens encode the flag as a string
+    if "email" in claims and \
+            claims.get("email_verified") not in (True, "true"):
+        raise OAuthError("Unverified email address.")
+    return claims
+
+
+def exchangeCode(auth_code, client_id, client_secret):
+    """ Upgrade a sign-in auth code into Google's token response (with
+    access_token and id_token). Raises OAuthError if Google refuses. """
+    response = googleRequest("POST", TOKEN_URL, data={
+                   "code": auth_code,
+                   "client_id": client_id,
+                   "client_secret": client_secret,
+                   "redirect_uri": "postmessage",
+                   "grant_type": "authorization_code"
+               })
+    if response.status_code != 200:
+        raise OAuthError("Failed to upgrade auth code.")
+    try:
+        tokens = response.json()
+    except ValueError:
+        tokens = None
+    if not isinstance(tokens, dict) or "access_token" not in tokens or \
+            "id_token" not in tokens:
+        raise OAuthError("Malformed token response.")
+    return tokens
+
+
+def userEmail(access_token):
+    """ Return the email address of the user an access token belongs to,
+    or None if Google has not verified it; only needed for ID tokens
+    issued without the email scope. """
+    response = googleRequest("GET", USER_INFO_URL, headers={
+                   "Authorization": "Bearer " + access_token
+               })
+    try:
+        info = response.json()
+        return info["email"] if info.get("verified_email") else None
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise OAuthError("Failed to obtain user information.")
+
+
+def revokeToken(access_token):
+    """ Revoke an access token; return True if Google accepted. """
+    try:
+        response = googleRequest("POST", REVOKE_URL,
+                                 data={"token": access_token})
+    except OAuthError:
+        return False
+    return response.status_code == 200
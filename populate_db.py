@@ -1,19 +1,24 @@
 #!/usr/bin/env python3
 
-##############################################################
-# This file populates the item catalog with some sample data #
-##############################################################
+##########################################################################
+# This file populates the item catalog with the sample data, or with a  #
+# generated catalog of any size:                                         #
+#                                                                        #
+#   python populate_db.py                                                #
+#   python populate_db.py --categories 100 --items-per-category 10000   #
+##########################################################################
 
-from models import Base, Item, Category
+import argparse
+import itertools
+import random
+import time
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-
-engine = create_engine("sqlite:///item_catalog.db")
-Base.metadata.bind = engine
-
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+from models import engine, parsePrice
+import search
+import versions
+import inventory
+import changes
+import images
 
 categories = ["Electronics", "Kitchenware", "Hardware",
               "Appliances", "Apparel", "Musical Instruments",
@@ -287,173 +292,236 @@ food_items = [
     }
 ]
 
-electronics = categories[0]
-image_file = "static/images/categories/1/electronics.jpg"
-category = Category(name=electronics, image=image_file)
-session.add(category)
-session.commit()
-for i in electronics_items:
-    item_name = i["name"]
-    item_description = i["description"]
-    item_price = i["price"]
-    item_category = i["category"]
-    item_stock = i["stock"]
-    item = Item(name=item_name,
-                description=item_description,
-                price=item_price,
-                stock=item_stock,
-                category=category)
-    session.add(item)
-    session.commit()
-
-kitchenware = categories[1]
-image_file = "static/images/categories/2/kitchenware.jpeg"
-category = Category(name=kitchenware, image=image_file)
-session.add(category)
-session.commit()
-for i in kitchenware_items:
-    item_name = i["name"]
-    item_description = i["description"]
-    item_price = i["price"]
-    item_category = i["category"]
-    item_stock = i["stock"]
-    item = Item(name=item_name,
-                description=item_description,
-                price=item_price,
-                stock=item_stock,
-                category=category)
-    session.add(item)
-    session.commit()
-
-hardware = categories[2]
-image_file = "static/images/categories/3/hardware.jpg"
-category = Category(name=hardware, image=image_file)
-session.add(category)
-session.commit()
-for i in hardware_items:
-    item_name = i["name"]
-    item_description = i["description"]
-    item_price = i["price"]
-    item_category = i["category"]
-    item_stock = i["stock"]
-    item = Item(name=item_name,
-                description=item_description,
-                price=item_price,
-                stock=item_stock,
-                category=category)
-    session.add(item)
-    session.commit()
-
-appliances = categories[3]
-image_file = "static/images/categories/4/appliances.jpeg"
-category = Category(name=appliances, image=image_file)
-session.add(category)
-session.commit()
-for i in appliances_items:
-    item_name = i["name"]
-    item_description = i["description"]
-    item_price = i["price"]
-    item_category = i["category"]
-    item_stock = i["stock"]
-    item = Item(name=item_name,
-                description=item_description,
-                price=item_price,
-                stock=item_stock,
-                category=category)
-    session.add(item)
-    session.commit()
-
-apparel = categories[4]
-image_file = "static/images/categories/5/apparel.jpg"
-category = Category(name=apparel, image=image_file)
-session.add(category)
-session.commit()
-for i in apparel_items:
-    item_name = i["name"]
-    item_description = i["description"]
-    item_price = i["price"]
-    item_category = i["category"]
-    item_stock = i["stock"]
-    item = Item(name=item_name,
-                description=item_description,
-                price=item_price,
-                stock=item_stock,
-                category=category)
-    session.add(item)
-    session.commit()
-
-musical_instruments = categories[5]
-image_file = "static/images/categories/6/musical_instruments.jpeg"
-category = Category(name=musical_instruments, image=image_file)
-session.add(category)
-session.commit()
-for i in musical_instruments_items:
-    item_name = i["name"]
-    item_description = i["description"]
-    item_price = i["price"]
-    item_category = i["category"]
-    item_stock = i["stock"]
-    item = Item(name=item_name,
-                description=item_description,
-                price=item_price,
-                stock=item_stock,
-                category=category)
-    session.add(item)
-    session.commit()
-
-furniture = categories[6]
-image_file = "static/images/categories/7/furniture.jpeg"
-category = Category(name=furniture, image=image_file)
-session.add(category)
-session.commit()
-for i in furniture_items:
-    item_name = i["name"]
-    item_description = i["description"]
-    item_price = i["price"]
-    item_category = i["category"]
-    item_stock = i["stock"]
-    item = Item(name=item_name,
-                description=item_description,
-                price=item_price,
-                stock=item_stock,
-                category=category)
-    session.add(item)
-    session.commit()
-
-medical_consumables = categories[7]
-image_file = "static/images/categories/8/medical_consumables.jpeg"
-category = Category(name=medical_consumables, image=image_file)
-session.add(category)
-session.commit()
-for i in medical_consumables_items:
-    item_name = i["name"]
-    item_description = i["description"]
-    item_price = i["price"]
-    item_category = i["category"]
-    item_stock = i["stock"]
-    item = Item(name=item_name,
-                description=item_description,
-                price=item_price,
-                stock=item_stock,
-                category=category)
-    session.add(item)
-    session.commit()
-
-food = categories[8]
-image_file = "static/images/categories/9/food.jpg"
-category = Category(name=food, image=image_file)
-session.add(category)
-session.commit()
-for i in food_items:
-    item_name = i["name"]
-    item_description = i["description"]
-    item_price = i["price"]
-    item_category = i["category"]
-    item_stock = i["stock"]
-    item = Item(name=item_name,
-                description=item_description,
-                price=item_price,
-                stock=item_stock,
-                category=category)
-    session.add(item)
-    session.commit()
+SAMPLE_CATALOG = [
+    (categories[0], "static/images/categories/1/electronics.jpg",
+     electronics_items),
+    (categories[1], "static/images/categories/2/kitchenware.jpeg",
+     kitchenware_items),
+    (categories[2], "static/images/categories/3/hardware.jpg",
+     hardware_items),
+    (categories[3], "static/images/categories/4/appliances.jpeg",
+     appliances_items),
+    (categories[4], "static/images/categories/5/apparel.jpg",
+     apparel_items),
+    (categories[5], "static/images/categories/6/musical_instruments.jpeg",
+     musical_instruments_items),
+    (categories[6], "static/images/categories/7/furniture.jpeg",
+     furniture_items),
+    (categories[7], "static/images/categories/8/medical_consumables.jpeg",
+     medical_consumables_items),
+    (categories[8], "static/images/categories/9/food.jpg",
+     food_items)
+]
+
+
+##################
+# GENERATED DATA #
+##################
+
+DEPARTMENTS = ["Electronics", "Kitchenware", "Hardware", "Appliances",
+               "Apparel", "Musical Instruments", "Furniture",
+               "Medical Consumables", "Food", "Garden", "Toys", "Stationery",
+               "Sporting Goods", "Automotive", "Lighting", "Plumbing",
+               "Luggage", "Footwear", "Pet Supplies", "Camping"]
+
+ADJECTIVES = ["Used", "Rusty", "Vintage", "Refurbished", "Heavy-Duty",
+              "Compact", "Deluxe", "Chipped", "Bent", "Oversized",
+              "Miniature", "Polished", "Second-Hand", "Industrial",
+              "Portable", "Antique", "Cracked", "Infested", "Stripped",
+              "Hooded"]
+
+MATERIALS = ["Copper", "Steel", "Oak", "Walnut", "Brass", "Plastic",
+             "Ceramic", "Glass", "Leather", "Wool", "Cast Iron", "Bamboo",
+             "Aluminium", "Titanium", "Rubber", "Canvas"]
+
+NOUNS = ["Kettle", "Hammer", "Teapot", "Screwdriver", "Lamp", "Chair",
+         "Guitar", "Bandage", "Toaster", "Cloak", "Fork", "Monitor", "Drill",
+         "Plate", "Amplifier", "Stool", "Whisk", "Lantern", "Spanner",
+         "Blender", "Couch", "Circuit Board", "Teaspoon", "Harmonica"]
+
+SENTENCES = ["Previously owned by a very {adjective} prince.",
+             "Great value for anyone in need of a {material} {noun}.",
+             "Easier to use than a straight {noun}.",
+             "May contain traces of {material} and other nasties.",
+             "Ships with {count} spare parts and no instructions.",
+             "Will outlast any {noun} you have owned before.",
+             "Pulled from a working {noun} collection."]
+
+
+def generateCategories(count, first_id):
+    """ Yield (id, name) rows for count generated categories. """
+    for index in range(count):
+        name = DEPARTMENTS[index % len(DEPARTMENTS)]
+        if index >= len(DEPARTMENTS):
+            name += " {}".format(index // len(DEPARTMENTS) + 1)
+        yield (first_id + index, name)
+
+
+def generateItems(category_ids, items_per_category, first_id, rng):
+    """
+    Yield (id, name, description, price_cents, stock, category_id) rows.
+
+    Prices are whole dollar amounts log-normally distributed around $20
+    and stock levels are exponentially distributed around 25 units, with
+    one item in ten out of stock.
+    """
+    item_id = first_id
+    for category_id in category_ids:
+        for _ in range(items_per_category):
+            noun = rng.choice(NOUNS)
+            material = rng.choice(MATERIALS)
+            name = "{} {} {}".format(rng.choice(ADJECTIVES), material, noun)
+            description = " ".join(
+                sentence.format(adjective=rng.choice(ADJECTIVES).lower(),
+                                material=material.lower(),
+                                noun=noun.lower(),
+                                count=rng.randint(2, 12))
+                for sentence in rng.sample(SENTENCES, rng.randint(1, 2))
+            )
+            price_cents = max(1, int(rng.lognormvariate(3.0, 1.0))) * 100
+            stock = 0 if rng.random() < 0.1 \
+                else int(rng.expovariate(1 / 25.0))
+            yield (item_id, name, description, price_cents, stock,
+                   category_id)
+            item_id += 1
+
+
+###########
+# LOADING #
+###########
+
+def bulkInsert(conn, sql, rows, batch_size):
+    """
+    Insert rows with one executemany and commit per batch_size rows.
+
+    Returns the number of rows inserted.
+    """
+    cursor = conn.cursor()
+    inserted = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return inserted
+        cursor.executemany(sql, batch)
+        conn.commit()
+        inserted += len(batch)
+
+
+def loadSampleData(conn):
+    """ Insert the sample categories and items, adding their images to
+    the image store. """
+    cursor = conn.cursor()
+    for name, image, items in SAMPLE_CATALOG:
+        cursor.execute("INSERT INTO category (name, image) VALUES (?, ?)",
+                       (name, images.storeFile(image)))
+        category_id = cursor.lastrowid
+        cursor.executemany(
+            "INSERT INTO item (name, description, price_cents, stock, "
+            "category_id) VALUES (?, ?, ?, ?, ?)",
+            [(item["name"], item["description"], parsePrice(item["price"]),
+              item["stock"], category_id) for item in items]
+        )
+    conn.commit()
+
+
+def loadGeneratedData(conn, category_count, items_per_category, seed,
+                      batch_size):
+    """ Insert a generated catalog and return the number of items. """
+    rng = random.Random(seed)
+    cursor = conn.cursor()
+    first_category_id = cursor.execute(
+                            "SELECT COALESCE(MAX(id), 0) + 1 FROM category"
+                        ).fetchone()[0]
+    first_item_id = cursor.execute(
+                        "SELECT COALESCE(MAX(id), 0) + 1 FROM item"
+                    ).fetchone()[0]
+    bulkInsert(conn, "INSERT INTO category (id, name) VALUES (?, ?)",
+               generateCategories(category_count, first_category_id),
+               batch_size)
+    category_ids = range(first_category_id,
+                         first_category_id + category_count)
+    return bulkInsert(
+               conn,
+               "INSERT INTO item (id, name, description, price_cents, stock, "
+               "category_id) VALUES (?, ?, ?, ?, ?, ?)",
+               generateItems(category_ids, items_per_category,
+                             first_item_id, rng),
+               batch_size
+           )
+
+
+def restoreTriggers(conn):
+    """
+    Recreate the triggers dropped for a bulk load, then bring the search
+    index, versions, summaries and change log they maintain up to date
+    with the rows loaded meanwhile.
+
+    The triggers come first, so that writes made by the app while the
+    tables are caught up are not missed either.
+    """
+    versions.createVersionTriggers(engine)
+    inventory.createSummaryTriggers(engine)
+    changes.createChangeTriggers(engine)
+    indexed = search.createSearchIndex(engine)
+    cursor = conn.cursor()
+    versions.bumpAllVersions(cursor)
+    inventory.recomputeSummaries(cursor)
+    changes.resetChangeLog(cursor)
+    conn.commit()
+    if indexed:
+        with engine.begin() as index_conn:
+            search.rebuildSearchIndex(index_conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+                 description="Populate the item catalog database."
+             )
+    parser.add_argument("--categories", type=int, default=0,
+                        help="number of categories to generate (default: "
+                             "load the sample data instead)")
+    parser.add_argument("--items-per-category", type=int, default=100,
+                        help="number of items generated per category")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed; equal seeds give equal data")
+    parser.add_argument("--batch-size", type=int, default=100000,
+                        help="rows inserted per transaction")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    conn = engine.raw_connection()
+    try:
+        # Per-row index, version, summary and change log triggers would
+        # dominate a bulk load, so they are dropped while loading
+        search.dropSearchTriggers(conn.cursor())
+        versions.dropVersionTriggers(conn.cursor())
+        inventory.dropSummaryTriggers(conn.cursor())
+        changes.dropChangeTriggers(conn.cursor())
+        # Loading can simply be re-run if the machine crashes part way,
+        # so skip waiting for each commit to reach the disk
+        conn.cursor().execute("PRAGMA synchronous = OFF")
+        try:
+            if args.categories:
+                item_count = loadGeneratedData(conn, args.categories,
+                                               args.items_per_category,
+                                               args.seed, args.batch_size)
+            else:
+                loadSampleData(conn)
+                item_count = sum(len(items)
+                                 for _, _, items in SAMPLE_CATALOG)
+        finally:
+            # Batches committed before a failed load stay in the database,
+            # so the triggers are restored and caught up either way
+            conn.rollback()
+            conn.cursor().execute("PRAGMA synchronous = FULL")
+            load_seconds = time.perf_counter() - start
+            restoreTriggers(conn)
+    finally:
+        conn.close()
+    print("Loaded {} items in {:.1f}s (triggers caught up in {:.1f}s)."
+          .format(item_count, load_seconds,
+                  time.perf_counter() - start - load_seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Conversion of item prices between the "$25"-style strings of forms,    #
+# the API and older databases and the integer cents stored.              #
+##########################################################################
+
+import re
+from decimal import Decimal, InvalidOperation
+
+#############
+# CONSTANTS #
+#############
+
+# Commas in a price may only separate thousands ("1,200.99"), so that a
+# decimal comma ("12,50") is refused rather than read as 1250
+THOUSANDS_PATTERN = re.compile(r"\d{1,3}(,\d{3})+(\.\d*)?$")
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+def parsePrice(price):
+    """
+    Convert a price such as "$25", "25.5", "$1,200" or 25 into integer
+    cents.
+
+    Raises ValueError unless the price is a non-negative amount with at
+    most two decimal places.
+    """
+    if isinstance(price, bool) or not isinstance(price, (str, int, float)):
+        raise ValueError("Price must be an amount.")
+    text = str(price).strip()
+    if text.startswith("$"):
+        text = text[1:]
+    if "," in text and not THOUSANDS_PATTERN.match(text):
+        raise ValueError("Price must be an amount.")
+    try:
+        amount = Decimal(text.replace(",", ""))
+    except InvalidOperation:
+        raise ValueError("Price must be an amount.")
+    cents = amount * 100
+    if not amount.is_finite() or amount < 0 or cents != cents.to_integral():
+        raise ValueError("Price must be an amount.")
+    return int(cents)
+
+
+def formatPrice(cents):
+    """ Return a price in cents as a currency string (e.g. "$25.50"). """
+    if cents % 100:
+        return "${}.{:02d}".format(cents // 100, cents % 100)
+    return "${}".format(cents // 100)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Full-text search over catalog items and categories via SQLite FTS5.    #
+# Running this file directly (re)builds the index from existing rows.    #
+##########################################################################
+
+import re
+
+from sqlalchemy import select, text
+from sqlalchemy.exc import OperationalError
+
+from models import Item, Category
+
+
+#############
+# CONSTANTS #
+#############
+
+# Item columns that may be searched via the 'fields' API parameter
+ITEM_FIELDS = ("name", "description")
+
+# Item columns searched when no 'fields' parameter is supplied
+DEFAULT_ITEM_FIELDS = ("name",)
+
+# BM25 column weights for the item index; name matches outrank description
+# matches
+ITEM_BM25_WEIGHTS = (10.0, 1.0)
+
+# External-content FTS5 tables mirroring the item and category tables, plus
+# the triggers that keep them in sync with every insert, update and delete
+# (including bulk writes that bypass the ORM)
+SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5(
+        name, description,
+        content='item', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS item_fts_ai AFTER INSERT ON item BEGIN
+        INSERT INTO item_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS item_fts_ad AFTER DELETE ON item BEGIN
+        INSERT INTO item_fts(item_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS item_fts_au
+    AFTER UPDATE OF name, description ON item BEGIN
+        INSERT INTO item_fts(item_fts, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO item_fts(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS category_fts USING fts5(
+        name,
+        content='category', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS category_fts_ai AFTER INSERT ON category
+    BEGIN
+        INSERT INTO category_fts(rowid, name) VALUES (new.id, new.name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS category_fts_ad AFTER DELETE ON category
+    BEGIN
+        INSERT INTO category_fts(category_fts, rowid, name)
+        VALUES ('delete', old.id, old.name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS category_fts_au
+    AFTER UPDATE OF name ON category BEGIN
+        INSERT INTO category_fts(category_fts, rowid, name)
+        VALUES ('delete', old.id, old.name);
+        INSERT INTO category_fts(rowid, name) VALUES (new.id, new.name);
+    END
+    """
+]
+
+ITEM_SEARCH_SQL = """
+    SELECT item.* FROM item_fts JOIN item ON item.id = item_fts.rowid
+    WHERE item_fts MATCH :match
+    ORDER BY bm25(item_fts, {weights}) LIMIT :limit
+""".format(weights=", ".join(str(w) for w in ITEM_BM25_WEIGHTS))
+
+CATEGORY_SEARCH_SQL = """
+    SELECT category.* FROM category_fts
+    JOIN category ON category.id = category_fts.rowid
+    WHERE category_fts MATCH :match
+    ORDER BY bm25(category_fts) LIMIT :limit
+"""
+
+# Characters making up a single search term; everything else separates terms
+TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+def createSearchIndex(engine):
+    """
+    Create the search index and its sync triggers if missing.
+
+    A freshly created index is populated from the existing rows. Returns
+    False if the SQLite build lacks FTS5, in which case callers should fall
+    back to LIKE matching.
+    """
+    with engine.begin() as conn:
+        existing = conn.execute(text(
+                       "SELECT name FROM sqlite_master "
+                       "WHERE name IN ('item_fts', 'category_fts')"
+                   )).fetchall()
+        try:
+            for statement in SCHEMA:
+                conn.execute(text(statement))
+        except OperationalError:
+            return False
+        if len(existing) < 2:
+            rebuildSearchIndex(conn)
+    return True
+
+
+def rebuildSearchIndex(conn):
+    """ Re-index every item and category row. """
+    conn.execute(text("INSERT INTO item_fts(item_fts) VALUES ('rebuild')"))
+    conn.execute(text(
+        "INSERT INTO category_fts(category_fts) VALUES ('rebuild')"
+    ))
+
+
+def dropSearchTriggers(cursor):
+    """
+    Stop keeping the search index in sync, e.g. during a bulk load.
+
+    createSearchIndex() restores the triggers; rebuildSearchIndex() must
+    then be run to index rows written in the meantime.
+    """
+    for table in ("item", "category"):
+        for suffix in ("ai", "ad", "au"):
+            cursor.execute("DROP TRIGGER IF EXISTS {}_fts_{}"
+                           .format(table, suffix))
+
+
+def parseFields(value):
+    """
+    Parse a comma-separated 'fields' parameter into a tuple of item columns.
+
+    Raises ValueError if the value names a column that is not searchable.
+    """
+    if value is None:
+        return DEFAULT_ITEM_FIELDS
+    fields = tuple(field.strip() for field in value.split(",")
+                   if field.strip())
+    if not fields or any(field not in ITEM_FIELDS for field in fields):
+        raise ValueError("Unsupported search field.")
+    return fields
+
+
+def buildMatchQuery(query, fields=None):
+    """
+    Convert free text into an FTS5 MATCH expression.
+
+    Every term is quoted (so user input cannot inject FTS5 syntax) and
+    matched as a prefix, and all terms must match. Returns None if the
+    query contains no searchable terms.
+    """
+    terms = TERM_PATTERN.findall(query)
+    if not terms:
+        return None
+    expression = " ".join('"{}"*'.format(term) for term in terms)
+    if fields:
+        return "{{{fields}}} : ({expression})".format(
+                   fields=" ".join(fields), expression=expression
+               )
+    return expression
+
+
+def itemSearchStatement(query, fields, limit):
+    """
+    Return a select() of up to limit items matching query, best matches
+    first, or None if the query contains no searchable terms.
+    """
+    match = buildMatchQuery(query, fields)
+    if match is None:
+        return None
+    return select(Item).from_statement(
+               text(ITEM_SEARCH_SQL).bindparams(match=match, limit=limit)
+           )
+
+
+def categorySearchStatement(query, limit):
+    """
+    Return a select() of up to limit categories matching query, best
+    matches first, or None if the query contains no searchable terms.
+    """
+    match = buildMatchQuery(query)
+    if match is None:
+        return None
+    return select(Category).from_statement(
+               text(CATEGORY_SEARCH_SQL).bindparams(match=match, limit=limit)
+           )
+
+
+###############################################################################
+
+if __name__ == "__main__":
+    from models import engine
+
+    if not createSearchIndex(engine):
+        raise SystemExit("This SQLite build does not support FTS5.")
+    with engine.begin() as conn:
+        rebuildSearchIndex(conn)
+    print("Search index rebuilt.")
@@ -43,18 +43,111 @@ function insertStockbar(id, stock) {
         .attr('width', stockScale(stock));
 }
 
+// Moves an item's stock bar to a new stock level; returns false if the
+// item is not on the page
+function updateStockbar(id, stock) {
+    var item = document.getElementById(id);
+
+    // Items added since the page was rendered have no bar
+    if (!item) {
+      return false;
+    }
+    item.dataset.stock = stock;
+
+    d3.select('#' + id + ' .stock-bar rect')
+      .transition()
+        .duration(1000)
+        .ease(d3.easeCubic)
+        .attr('width', stockScale(stock))
+        .attr('fill', colorScale(stock));
+    return true;
+}
+
+// Draws the stock bars of every item listed
+function insertStockbars() {
+    $('.list--items .item').each(function() {
+      insertStockbar(this.id, this.dataset.stock);
+    });
+}
+
+// Replaces the list with the one of a fresh render of the page, to show
+// items added to or moved into the category; reloads once more if asked
+// again while loading
+var reloadingItems = false;
+var reloadItemsAgain = false;
+
+function reloadItems() {
+    if (reloadingItems) {
+      reloadItemsAgain = true;
+      return;
+    }
+    reloadingItems = true;
+
+    $.get(window.location.pathname)
+      .done(function(page) {
+        var $list = $('<div>').append($.parseHTML(page))
+                              .find('.list--items');
+
+        $('.list--items').html($list.html());
+        insertStockbars();
+      })
+      .always(function() {
+        reloadingItems = false;
+        if (reloadItemsAgain) {
+          reloadItemsAgain = false;
+          reloadItems();
+        }
+      });
+}
+
+// Drops an item that has left the category, bar and all
+function removeItem(id) {
+    var item = document.getElementById(id);
+
+    if (item) {
+      $(item).closest('.list__item').remove();
+    }
+}
+
+// Keeps the stock bars up to date from the page's stock stream, drops
+// items moved to another category or deleted, and reloads the list for
+// items it does not show yet; the browser reconnects by itself if the
+// stream is dropped
+function followStockLevels(url) {
+    if (!url || !window.EventSource) {
+      return;
+    }
+    var source = new EventSource(url);
+
+    source.addEventListener('stock', function(event) {
+      var data = JSON.parse(event.data);
+      var items = data.Items;
+      var removed = data.Removed || [];
+      var unknown = false;
+
+      for (var i = 0; i < items.length; i++) {
+        if (!updateStockbar('item-' + items[i].id, items[i].stock)) {
+          unknown = true;
+        }
+      }
+      for (var j = 0; j < removed.length; j++) {
+        removeItem('item-' + removed[j]);
+      }
+      if (data.Deleted) {
+        // The category and all of its items are gone
+        $('.list--items .list__item').remove();
+        source.close();
+      } else if (unknown) {
+        reloadItems();
+      }
+    });
+}
+
 
 $(document).ready(function() {
 
-  var $items = $('.item');
-  var numItems = $items.length;
-  var id, item, stock;
+  insertStockbars();
 
-  for (var i = 0; i < numItems; i++) {
-    item = $items[i];
-    id = $(item).attr('id');
-    stock = $items[i].dataset.stock;
-    insertStockbar(id, stock);
-  }
+  followStockLevels($('.list--items').data('stock-stream'));
 
 });
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Live stock levels for category pages, sent as Server-Sent Events by   #
+# /api/stock/stream. One broadcaster per process reads the change log   #
+# while any page is subscribed, encodes each category's stock changes   #
+# once and hands that same event to every subscriber of the category.   #
+# Items moved out of a category or deleted are sent as removed from it, #
+# and the deletion of a category as such.                               #
+# Writes from any worker process reach every process's subscribers,     #
+# since they all read the log. Subscribers that fall too far behind     #
+# are disconnected, and catch up from the log when they reconnect.      #
+##########################################################################
+
+import json
+import logging
+import queue
+import random
+import threading
+import time
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+import changes
+
+
+#############
+# CONSTANTS #
+#############
+
+# Log entries read per query by the broadcaster
+POLL_BATCH = 5000
+
+# Every log entry after a sequence number, with the categories it logged
+# and the current category and stock of the item it names; the latter
+# NULL for categories and deleted items
+CHANGED_STOCK = text("""
+    SELECT catalog_change.seq, catalog_change.entity,
+           catalog_change.entity_id, catalog_change.deleted,
+           catalog_change.category_id AS logged_category_id,
+           catalog_change.old_category_id, item.category_id, item.stock
+    FROM catalog_change
+    LEFT JOIN item
+    ON catalog_change.entity = 'item' AND item.id = catalog_change.entity_id
+    WHERE catalog_change.seq > :since
+    ORDER BY catalog_change.seq
+    LIMIT :limit
+""")
+
+# The latest sequence number, whether the category exists, and the stock
+# of its items changed after :since; of all its items instead if :since
+# is -1 or entries after it were compacted away. Items that left the
+# category after :since follow, with a NULL stock. One statement, so the
+# sequence number and stock levels agree.
+CATCH_UP = text("""
+    WITH head AS (
+        SELECT COALESCE(MAX(seq), 0) AS seq FROM sqlite_sequence
+        WHERE name = 'catalog_change'
+    ), sync AS (
+        SELECT head.seq AS seq,
+               (SELECT 1 FROM category WHERE id = :category_id) AS found,
+               :since < COALESCE((SELECT MIN(seq) FROM catalog_change),
+                                 head.seq + 1) - 1 AS every_item
+        FROM head
+    )
+    SELECT sync.seq AS seq, sync.found AS found, item.id AS item_id,
+           item.stock AS stock
+    FROM sync
+    LEFT JOIN item
+    ON item.category_id = :category_id
+    AND (sync.every_item
+         OR item.id IN (SELECT entity_id FROM catalog_change
+                        WHERE seq > :since AND entity = 'item'))
+    UNION ALL
+    SELECT sync.seq, sync.found, catalog_change.entity_id, NULL
+    FROM sync
+    JOIN catalog_change
+    ON NOT sync.every_item AND catalog_change.seq > :since
+    AND catalog_change.entity = 'item'
+    AND :category_id IN (catalog_change.category_id,
+                         catalog_change.old_category_id)
+    WHERE NOT EXISTS (SELECT 1 FROM item
+                      WHERE item.id = catalog_change.entity_id
+                      AND item.category_id = :category_id)
+""")
+
+STREAM_PARAMS_MESSAGE = "Parameter 'category_id' must be an integer and " \
+    "'since' a non-negative integer."
+
+# Comment line sent on idle streams
+HEARTBEAT = b": keep-alive\n\n"
+
+# Milliseconds browsers wait before reconnecting a dropped stream; each
+# stream is given a random delay up to twice this, so that clients
+# dropped together do not all reconnect at once
+RECONNECT_MS = 3000
+
+logger = logging.getLogger(__name__)
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+def streamParams(args, last_event_id=None):
+    """
+    Return the (category ID, sequence number) a stream request asks for.
+
+    The sequence number is the last event a reconnecting browser saw, or
+    the 'since' parameter of the page the stream belongs to; -1 if
+    neither is given, for every item's stock. Raises ValueError if
+    either is malformed.
+    """
+    category_id = int(args["category_id"]) if "category_id" in args \
+        else None
+    since = last_event_id or args.get("since")
+    if category_id is None or since is not None and int(since) < 0:
+        raise ValueError(STREAM_PARAMS_MESSAGE)
+    return category_id, -1 if since is None else int(since)
+
+
+def stockEvent(seq, stock, removed=(), deleted=False):
+    """ Encode (item ID, stock) pairs, and the IDs of items removed from
+    the category or whether it was deleted, as a 'stock' event with ID
+    seq. """
+    data = {"Items": [{"id": item_id, "stock": level}
+                      for item_id, level in stock]}
+    if removed:
+        data["Removed"] = sorted(removed)
+    if deleted:
+        data["Deleted"] = True
+    data = json.dumps(data, separators=(",", ":"))
+    return "id: {}\nevent: stock\ndata: {}\n\n".format(seq, data).encode()
+
+
+def openingEvent(rows):
+    """
+    Return (sequence number, first bytes of the stream) from the rows of
+    CATCH_UP, or None if the category does not exist.
+
+    The stream opens with the reconnection delay and the stock levels and
+    removed items the page may have missed, so live events up to the
+    returned sequence number can be skipped.
+    """
+    if rows[0].found is None:
+        return None
+    seq = rows[0].seq
+    stock = [(row.item_id, row.stock) for row in rows
+             if row.stock is not None]
+    removed = {row.item_id for row in rows
+               if row.item_id is not None and row.stock is None}
+    retry = "retry: {}\n\n".format(random.randint(RECONNECT_MS,
+                                                  2 * RECONNECT_MS))
+    return seq, retry.encode() + stockEvent(seq, stock, removed)
+
+
+def catchUp(conn, category_id, since):
+    """ Run CATCH_UP on a connection or session; see openingEvent(). """
+    return openingEvent(conn.execute(CATCH_UP, {
+               "category_id": category_id, "since": since
+           }).fetchall())
+
+
+class Subscription(object):
+    """
+    A stream client's bounded queue of the events of one category, for
+    servers running each stream on a thread of its own.
+
+    Once the client falls max_events behind, its backlog is discarded and
+    the stream ends; the browser then reconnects and catches up from the
+    log, rather than events piling up for a client that cannot keep up.
+    """
+
+    def __init__(self, max_events):
+        self.queue = queue.Queue(max_events)
+
+    def publish(self, seq, event):
+        """ Queue an event; return False if the client was dropped. """
+        try:
+            self.queue.put_nowait((seq, event))
+            return True
+        except queue.Full:
+            self.close()
+            return False
+
+    def close(self):
+        """ End the stream after the event being sent, if any. """
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.queue.put_nowait(None)
+
+    def events(self, seq, heartbeat):
+        """ Yield the events after sequence number seq as they are
+        published, and HEARTBEAT after heartbeat idle seconds. """
+        while True:
+            try:
+                published = self.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield HEARTBEAT
+                continue
+            if published is None:
+                return
+            if published[0] > seq:
+                yield published[1]
+
+
+class StockBroadcaster(object):
+    """
+    Reads the stock changes from the change log and publishes them to the
+    subscribers of each category.
+
+    A subscriber, or sink, is any object with a publish(seq, event)
+    method returning False once it wants no more events. Each poll that
+    finds changes encodes one event per subscribed category, shared by
+    all of that category's sinks: the current stock of its items that
+    changed, the items that changed while in it but are no longer, and
+    whether the category was deleted (its items' deletes are not logged).
+    The polling thread only runs while there are sinks.
+    """
+
+    def __init__(self, engine, interval):
+        self.engine = engine
+        self.interval = interval
+        self._sinks = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._since = None
+
+    def subscribe(self, category_id, sink):
+        """
+        Start publishing a category's stock events to a sink.
+
+        Every change logged after this returns is published, so a
+        subscriber that reads the current stock afterwards misses none.
+        """
+        with self._lock:
+            self._sinks.setdefault(category_id, set()).add(sink)
+            if self._thread is not None:
+                return
+            try:
+                with self.engine.connect() as conn:
+                    self._since = changes.latestSeq(conn)
+            except SQLAlchemyError:
+                self._discard(category_id, sink)
+                raise
+            self._thread = threading.Thread(target=self.run,
+                                            name="stock-broadcaster",
+                                            daemon=True)
+            self._thread.start()
+
+    def unsubscribe(self, category_id, sink):
+        """ Stop publishing to a sink. """
+        with self._lock:
+            self._discard(category_id, sink)
+
+    def _discard(self, category_id, sink):
+        sinks = self._sinks.get(category_id)
+        if sinks is not None:
+            sinks.discard(sink)
+            if not sinks:
+                del self._sinks[category_id]
+
+    def subscribers(self):
+        """ Return the number of sinks of every category. """
+        with self._lock:
+            return sum(len(sinks) for sinks in self._sinks.values())
+
+    def poll(self):
+        """ Publish the stock changes logged since the last poll; return
+        the number of log entries read. """
+        with self.engine.connect() as conn:
+            rows = conn.execute(CHANGED_STOCK, {
+                       "since": self._since, "limit": POLL_BATCH
+                   }).fetchall()
+        if not rows:
+            return 0
+        self._since = rows[-1].seq
+        stock = {}
+        removed = {}
+        deleted = set()
+        for row in rows:
+            if row.entity != "item":
+                if row.deleted:
+                    deleted.add(row.entity_id)
+                continue
+            if row.category_id is not None:
+                stock.setdefault(row.category_id, {})[row.entity_id] = \
+                    row.stock
+            # Categories the item was logged in but has left since, or
+            # was deleted from
+            for category_id in (row.logged_category_id,
+                                row.old_category_id):
+                if category_id not in (None, row.category_id):
+                    removed.setdefault(category_id, set()).add(
+                        row.entity_id
+                    )
+        with self._lock:
+            targets = [(category_id, list(self._sinks[category_id]))
+                       for category_id in set(stock) | set(removed) | deleted
+                       if category_id in self._sinks]
+        for category_id, sinks in targets:
+            event = stockEvent(self._since,
+                               stock.get(category_id, {}).items(),
+                               removed.get(category_id),
+                               category_id in deleted)
+            for sink in sinks:
+                if not sink.publish(self._since, event):
+                    self.unsubscribe(category_id, sink)
+        return len(rows)
+
+    def run(self):
+        """ Poll every interval seconds while there are sinks; runs on the
+        broadcaster's thread. A failed poll is logged and the next one
+        goes on from the entries after it. """
+        try:
+            while True:
+                with self._lock:
+                    if not self._sinks:
+                        self._thread = None
+                        return
+                try:
+                    # Read a backlog in consecutive batches without waiting
+                    while self.poll() == POLL_BATCH:
+                        pass
+                except SQLAlchemyError as error:
+                    logger.warning("Could not read stock changes: %s",
+                                   error)
+                except Exception:
+                    logger.exception("Could not publish stock changes.")
+                time.sleep(self.interval)
+        finally:
+            # Should the thread still end unexpectedly, let the next
+            # subscriber start another
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
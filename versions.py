@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Catalog version counters behind the ETags of catalog responses. Every  #
+# write to an item or category advances a catalog-wide sequence, and    #
+# the scopes the write affects take its new value.                      #
+##########################################################################
+
+from sqlalchemy import text
+
+from inventory import ITEM_DELETE_APPLIES
+from models import CatalogVersion
+
+
+#############
+# CONSTANTS #
+#############
+
+# Scope advanced by every catalog write (items and categories)
+CATALOG_SCOPE = 0
+
+# Scope advanced by writes to the category table only; positive scopes
+# are category IDs, advanced by writes to the category or its items
+CATEGORIES_SCOPE = -1
+
+# Advances the catalog-wide sequence, which every other scope copies
+BUMP_CATALOG = """
+    INSERT INTO catalog_version (scope, version, modified)
+    VALUES (0, 1, CAST(strftime('%s', 'now') AS INTEGER))
+    ON CONFLICT (scope) DO UPDATE
+    SET version = version + 1, modified = excluded.modified;
+"""
+
+# Sets a scope to the current catalog-wide version
+COPY_VERSION = """
+    INSERT INTO catalog_version (scope, version, modified)
+    SELECT {scope}, version, modified FROM catalog_version
+    WHERE scope = 0 AND {scope} IS NOT NULL
+    ON CONFLICT (scope) DO UPDATE
+    SET version = excluded.version, modified = excluded.modified;
+"""
+
+
+def versionTrigger(name, event, table, scopes, when=None):
+    """ Return the DDL of a trigger advancing the given scopes, when the
+    condition holds if one is given. """
+    return "CREATE TRIGGER IF NOT EXISTS {} AFTER {} ON {} {}BEGIN {} END" \
+        .format(name, event, table,
+                "" if when is None else "WHEN {} ".format(when),
+                BUMP_CATALOG + "".join(COPY_VERSION.format(scope=scope)
+                                       for scope in scopes))
+
+
+# Triggers advancing the versions on every insert, update and delete,
+# including bulk writes that bypass the ORM
+SCHEMA = [
+    versionTrigger("catalog_version_item_ai", "INSERT", "item",
+                   ["new.category_id"]),
+    versionTrigger("catalog_version_item_ad", "DELETE", "item",
+                   ["old.category_id"], ITEM_DELETE_APPLIES),
+    versionTrigger("catalog_version_item_au", "UPDATE", "item",
+                   ["old.category_id", "new.category_id"]),
+    versionTrigger("catalog_version_category_ai", "INSERT", "category",
+                   [CATEGORIES_SCOPE, "new.id"]),
+    versionTrigger("catalog_version_category_ad", "DELETE", "category",
+                   [CATEGORIES_SCOPE, "old.id"]),
+    versionTrigger("catalog_version_category_au", "UPDATE", "category",
+                   [CATEGORIES_SCOPE, "old.id", "new.id"])
+]
+
+TRIGGER_NAMES = ["catalog_version_{}_{}".format(table, suffix)
+                 for table in ("item", "category")
+                 for suffix in ("ai", "ad", "au")]
+
+
+####################
+# HELPER FUNCTIONS #
+####################
+
+def createVersionTriggers(engine):
+    """ Create the triggers maintaining the catalog versions if missing. """
+    with engine.begin() as conn:
+        for statement in SCHEMA:
+            conn.execute(text(statement))
+
+
+def dropVersionTriggers(cursor):
+    """
+    Stop maintaining the catalog versions, e.g. during a bulk load.
+
+    createVersionTriggers() restores the triggers; bumpAllVersions() must
+    then be run so that no client keeps data from before the load.
+    """
+    for name in TRIGGER_NAMES:
+        cursor.execute("DROP TRIGGER IF EXISTS {}".format(name))
+
+
+def bumpAllVersions(cursor):
+    """ Advance the version of every scope. """
+    cursor.execute(BUMP_CATALOG)
+    cursor.execute(COPY_VERSION.format(scope=CATEGORIES_SCOPE))
+    cursor.execute("""
+        INSERT INTO catalog_version (scope, version, modified)
+        SELECT category.id, catalog_version.version, catalog_version.modified
+        FROM category, catalog_version WHERE catalog_version.scope = 0
+        ON CONFLICT (scope) DO UPDATE
+        SET version = excluded.version, modified = excluded.modified
+    """)
+
+
+def currentVersion(db_session, scope):
+    """
+    Return the (version, modified timestamp) of a scope.
+
+    A scope no write has touched yet is at version 0, modified None.
+    """
+    row = db_session.query(CatalogVersion.version, CatalogVersion.modified) \
+                    .filter_by(scope=scope).first()
+    if row is None:
+        return 0, None
+    return row.version, row.modified
@@ -5,25 +5,40 @@
 ##################
 
 from flask import Flask, abort, url_for, jsonify, flash, make_response, \
-                  redirect, render_template, request, session
-from werkzeug import secure_filename
-
-from models import Base, Item, Category, User
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.orm.exc import NoResultFound
+                  redirect, render_template, request, session, g, \
+                  stream_with_context, send_from_directory, Request
+from flask.sessions import SecureCookieSessionInterface
+
+from models import Base, Item, Category, User, engine, parsePrice, \
+    formatPrice
+import search
+import cache
+import config
+import workers
+import metrics
+import versions
+import images
+import oauth
+import inventory
+import changes
+import stockstream
+from sqlalchemy import func, select, text, tuple_
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
 
 import os
 import uuid
 import json
-from httplib2 import Http
-import requests
+import base64
+import functools
+import hashlib
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode
 
-from oauth2client.client import flow_from_clientsecrets, FlowExchangeError, \
-                                OAuth2Credentials
 from flask_bcrypt import Bcrypt
 from itsdangerous import TimedJSONWebSignatureSerializer, BadSignature, \
-                         SignatureExpired
+                         SignatureExpired, URLSafeTimedSerializer
 import bleach
 
 
@@ -33,15 +48,108 @@ import bleach
 
 # Init Flask app
 app = Flask(__name__)
-app.config["IMG_DIR"] = os.path.join("static", "images")
-app.config["SECRET_KEY"] = str(uuid.uuid4()).replace("-", "")
+app.config["BCRYPT_LOG_ROUNDS"] = config.BCRYPT_LOG_ROUNDS
 bcrypt = Bcrypt(app)
 
-# Init database and SQLAlchemy database session instance
-engine = create_engine("sqlite:///item_catalog.db")
+# Init pool running password hashing off the request threads, so a burst of
+# logins cannot take every worker thread's CPU time from catalog reads
+password_pool = workers.BoundedExecutor(config.PASSWORD_WORKERS,
+                                        config.PASSWORD_QUEUE_DEPTH,
+                                        "password")
+
+# Init pool resizing uploaded images, so request threads only receive the
+# upload and a burst of uploads cannot queue unbounded work
+image_pool = workers.BoundedExecutor(config.IMAGE_WORKERS,
+                                     config.IMAGE_QUEUE_DEPTH, "image")
+
+
+class CatalogRequest(Request):
+    """ Requests streaming uploaded files straight into the image store
+    rather than into memory or a temporary file of their own. """
+
+    def _get_file_stream(self, total_content_length, content_type,
+                         filename=None, content_length=None):
+        return images.UploadSpool(config.MAX_IMAGE_BYTES)
+
+
+app.request_class = CatalogRequest
+
+# Load the signing key ring shared by all workers; the first key signs new
+# tokens and session cookies, the rest remain valid during key rotation
+SECRET_KEYS = config.loadSecretKeys()
+app.config["SECRET_KEY"] = SECRET_KEYS[0]
+
+
+class KeyRingSessionInterface(SecureCookieSessionInterface):
+    """ Cookie sessions signed with the current key, also accepting cookies
+    signed with the older keys of the ring. """
+
+    def getSigningSerializers(self, app):
+        """ Yield a session serializer for each key, newest first. """
+        signer_kwargs = {
+            "key_derivation": self.key_derivation,
+            "digest_method": self.digest_method
+        }
+        for key in SECRET_KEYS:
+            yield URLSafeTimedSerializer(key, salt=self.salt,
+                                         serializer=self.serializer,
+                                         signer_kwargs=signer_kwargs)
+
+    def open_session(self, app, request):
+        value = request.cookies.get(app.session_cookie_name)
+        if not value:
+            return self.session_class()
+        max_age = int(app.permanent_session_lifetime.total_seconds())
+        for serializer in self.getSigningSerializers(app):
+            try:
+                data = serializer.loads(value, max_age=max_age)
+            except SignatureExpired:
+                return self.session_class()
+            except BadSignature:
+                continue
+            return self.session_class(data)
+        return self.session_class()
+
+
+app.session_interface = KeyRingSessionInterface()
+
+# Init database and a SQLAlchemy session registry providing each request
+# (thread) with its own session
 Base.metadata.bind = engine
 DBSession = sessionmaker(bind=engine)
-db_session = DBSession()
+db_session = scoped_session(DBSession)
+
+
+@app.teardown_appcontext
+def removeDBSession(exception=None):
+    """ Close the request's session, rolling back uncommitted work. """
+    db_session.remove()
+
+# Init full-text search index (falls back to LIKE matching without FTS5)
+SEARCH_ENABLED = search.createSearchIndex(engine)
+
+# Init triggers advancing the catalog versions behind response ETags
+versions.createVersionTriggers(engine)
+
+# Init triggers keeping the per-category inventory totals up to date
+inventory.createSummaryTriggers(engine)
+
+# Init triggers appending catalog writes to the change log
+changes.createChangeTriggers(engine)
+
+# Init per-request timing and the /metrics endpoint
+if config.METRICS_ENABLED:
+    metrics.init(app, engine)
+
+# Init periodic compaction of the change log; started after the metrics
+# hooks, which must see both ends of every statement
+changes.startCompaction(engine)
+
+# Init the broadcaster pushing stock changes to live category pages; it
+# polls the change log only while some page is subscribed
+stock_broadcaster = stockstream.StockBroadcaster(
+                        engine, config.STOCK_STREAM_POLL_MS / 1000
+                    )
 
 
 #############
@@ -54,17 +162,91 @@ TITLE = "ACME Trading"
 # Sets the value for session access token timeout
 TOKEN_TIMEOUT = 900
 
-# Google OAuth2 URLs
-G_TOKEN_CHK_BASE_URL = \
-    "https://www.googleapis.com/oauth2/v1/tokeninfo?access_token={}"
-G_TOKEN_REVOKE_BASE_URL = \
-    "https://accounts.google.com/o/oauth2/revoke?token={}"
-G_USER_INFO_URL = \
-    "https://www.googleapis.com/oauth2/v1/userinfo"
-
-# Google Auth2 Client secret
-with open("data/client_secret.json", "r") as gcs:
-    G_CLIENT_SECRET = json.loads(gcs.read())["web"]["client_id"]
+# Sets the number of verified access tokens remembered between requests
+TOKEN_CACHE_MAX_ENTRIES = 10000
+
+# Sets the default and maximum number of rows returned per page by the
+# paginated API list routes
+PAGE_SIZE_DEFAULT = 100
+PAGE_SIZE_MAX = 500
+
+# Message of the 422 response to malformed paging parameters
+PAGE_PARAMS_MESSAGE = "Parameter 'limit' must be a positive integer " \
+                      "and 'cursor' a value returned by this endpoint."
+
+# Sets the item columns the items API can be sorted by with 'sort' (a "-"
+# prefix sorts in descending order); each is indexed
+ITEM_SORT_COLUMNS = {
+    "price": Item.price_cents,
+    "stock": Item.stock,
+    "name": Item.name
+}
+
+# Message of the 422 response to a malformed price range or sort
+ITEM_FILTER_MESSAGE = "Parameters 'min_price' and 'max_price' must be " \
+                      "non-negative amounts and 'sort' one of " + \
+                      ", ".join(sorted(ITEM_SORT_COLUMNS)) + \
+                      " (prefixed with '-' for descending order)."
+
+# Sets the number of rows fetched from the database at a time, and the
+# approximate size (bytes) of the chunks sent, when streaming an export
+EXPORT_FETCH_ROWS = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+# Sets how long (seconds) clients may cache stored images
+IMAGE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Messages shown for uploads that are unusable, or that cannot be
+# processed while the image pool is saturated
+IMAGE_INVALID_MESSAGE = "The uploaded file is not a supported image."
+IMAGE_BUSY_MESSAGE = "The image could not be processed right now. " \
+                     "Please upload it again shortly."
+
+# Sets the maximum number of rows accepted by a batch create request
+BATCH_MAX_ROWS = 10000
+
+# Adds a delta to an item's stock unless that would take it below zero;
+# checking and writing in one statement makes concurrent adjustments safe
+STOCK_DELTA_UPDATE = text(
+    "UPDATE item SET stock = stock + :delta "
+    "WHERE id = :id AND stock + :delta >= 0 "
+    "RETURNING stock"
+)
+STOCK_UNKNOWN_ITEM_MESSAGE = "No item found under this ID."
+STOCK_INSUFFICIENT_MESSAGE = "Insufficient stock for this adjustment."
+STOCK_PARAMS_MESSAGE = "Item ID and stock delta must be integers."
+
+# Sets the lifetime (seconds), entry limit and memory cap (bytes) of the
+# cache serving catalog reads
+CACHE_TTL = 300
+CACHE_MAX_ENTRIES = 4096
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Sets how many change log entries a cache read applies at most; further
+# behind, the cache is cleared instead
+CACHE_SYNC_BATCH = 1000
+
+# Google OAuth2 client credentials
+G_CLIENT_ID, G_CLIENT_SECRET = oauth.loadClientSecrets(
+                                   "data/client_secret.json"
+                               )
+
+# Init cache for catalog reads; reads first follow the change log to drop
+# by tag what any process changed
+catalog_cache = cache.LRUCache(max_entries=CACHE_MAX_ENTRIES,
+                               max_bytes=CACHE_MAX_BYTES,
+                               ttl=CACHE_TTL)
+catalog_changes = changes.ChangeFollower(
+                      lambda entry: applyChange(entry),
+                      catalog_cache.clear, CACHE_SYNC_BATCH
+                  )
+
+# Init cache of verified access tokens (by digest) and their expiry times,
+# and a token verifier for each signing key
+token_cache = cache.LRUCache(max_entries=TOKEN_CACHE_MAX_ENTRIES,
+                             ttl=TOKEN_TIMEOUT)
+TOKEN_VERIFIERS = [TimedJSONWebSignatureSerializer(key)
+                   for key in SECRET_KEYS]
 
 
 ####################
@@ -89,35 +271,85 @@ def generateToken():
     return (uuid_1 + uuid_2).replace("-", "")
 
 
+def hashPassword(password):
+    """ Hash a password on the password pool and return the hash. """
+    with metrics.timed("bcrypt"):
+        return password_pool.run(bcrypt.generate_password_hash, password)
+
+
+def passwordCost(password_hash):
+    """ Return the bcrypt cost factor a password hash was created with. """
+    if isinstance(password_hash, bytes):
+        password_hash = password_hash.decode()
+    return int(password_hash.split("$")[2])
+
+
 def checkPassword(user, password):
-    """ Check a user password and return True if correct. """
-    return bcrypt.check_password_hash(user.password_hash, password)
+    """
+    Check a user password and return True if correct.
+
+    A correct password whose stored hash uses an outdated cost factor is
+    re-hashed with the current one.
+    """
+    with metrics.timed("bcrypt"):
+        correct = password_pool.run(bcrypt.check_password_hash,
+                                    user.password_hash, password)
+    if not correct:
+        return False
+    if passwordCost(user.password_hash) != app.config["BCRYPT_LOG_ROUNDS"]:
+        try:
+            user.password_hash = hashPassword(password)
+            db_session.commit()
+        except Exception:
+            # Keep the old hash; the login itself is still valid
+            db_session.rollback()
+    return True
+
+
+@functools.lru_cache(maxsize=None)
+def tokenSigner(seconds):
+    """ Return the token signer for the specified TTL, built once. """
+    return TimedJSONWebSignatureSerializer(app.config["SECRET_KEY"],
+                                          expires_in=seconds)
 
 
 def generateTimedAccessToken(seconds):
     """ Generate a signed token with specified TTL and return it. """
-    token_signer = TimedJSONWebSignatureSerializer(
-                       app.config["SECRET_KEY"],
-                       expires_in=seconds
-                   )
     token = generateToken()
-    return token_signer.dumps({"token": token})
+    return tokenSigner(seconds).dumps({"token": token})
+
+
+def tokenExpiry(token):
+    """
+    Return the expiry time (Unix seconds) of a valid token, else None.
+
+    Verified tokens are cached by digest until they expire, so repeated
+    calls with the same token skip the signature check.
+    """
+    digest = hashlib.sha256(token.encode()).digest()
+    expiry = token_cache.get(digest)
+    if expiry is not cache.MISSING:
+        return expiry
+    # Accept tokens signed with any key of the ring
+    for token_verifier in TOKEN_VERIFIERS:
+        try:
+            challenge, header = token_verifier.loads(token.encode(),
+                                                     return_header=True)
+        except SignatureExpired:
+            # Token is valid but has an expired signature
+            return None
+        except BadSignature:
+            # Token is invalid for this key
+            continue
+        expiry = header["exp"]
+        token_cache.set(digest, expiry, ttl=expiry - time.time())
+        return expiry
+    return None
 
 
 def checkToken(token):
     """ Check a token is current/valid and return True if so. """
-    token_signer = TimedJSONWebSignatureSerializer(
-                       app.config["SECRET_KEY"]
-                   )
-    try:
-        challenge = token_signer.loads(token.encode())
-    except SignatureExpired:
-        # Token is valid but has an expired signature
-        return False
-    except BadSignature:
-        # Token is invalid
-        return False
-    return True
+    return tokenExpiry(token) is not None
 
 
 def refreshSessionAccessToken(seconds):
@@ -149,14 +381,19 @@ def requireLogin():
     if session.get("google_id") is not None:
         return False
     # Login session cannot be stale
-    if (session.get("access_token") is None) or \
-            (not checkToken(session["access_token"])):
+    expiry = None
+    if session.get("access_token") is not None:
+        expiry = tokenExpiry(session["access_token"])
+    if expiry is None:
         if session.get("email") is not None:
             del session["email"]
         flash("Session expired.")
         return True
-    # Login session must be able to refresh correctly
-    if not refreshSessionAccessToken(TOKEN_TIMEOUT):
+    # Login session must be able to refresh correctly once half of its
+    # lifetime has passed (refreshing on every page would defeat the
+    # verified-token cache)
+    if (expiry - time.time() < TOKEN_TIMEOUT / 2) and \
+            (not refreshSessionAccessToken(TOKEN_TIMEOUT)):
         if session.get("email") is not None:
             del session["email"]
         flash("Could not confirm valid user access.")
@@ -164,6 +401,879 @@ def requireLogin():
     return False
 
 
+def encodeCursor(after, sort=None):
+    """
+    Encode the position of the last row of a page as an opaque cursor.
+
+    after is the row's ID, or a [sort value, ID] pair for pages in the
+    given sort order.
+    """
+    data = {"after": after}
+    if sort is not None:
+        data["sort"] = sort
+    payload = json.dumps(data).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+def decodeCursor(cursor, sort=None):
+    """
+    Decode a cursor and return the row position it points after.
+
+    Raises ValueError if the cursor is malformed or was issued for a
+    different sort order.
+    """
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        after = data["after"]
+    except (ValueError, TypeError, KeyError):
+        raise ValueError("Malformed cursor.")
+    if data.get("sort") != sort:
+        raise ValueError("Cursor of a different sort order.")
+    if sort is not None:
+        if not isinstance(after, list) or len(after) != 2 or \
+                not isinstance(after[0], (int, str)) or \
+                not isinstance(after[1], int):
+            raise ValueError("Malformed cursor.")
+    elif not isinstance(after, int):
+        raise ValueError("Malformed cursor.")
+    return after
+
+
+def pageLimit(args):
+    """ Return the requested page size, capped at PAGE_SIZE_MAX. """
+    if "limit" not in args:
+        return PAGE_SIZE_DEFAULT
+    limit = int(args["limit"])
+    if limit < 1:
+        raise ValueError("Limit must be a positive integer.")
+    return min(limit, PAGE_SIZE_MAX)
+
+
+def pageQuery(query, args, key_column, sort_column=None, descending=False,
+              limit=None):
+    """
+    Restrict a query (or select() statement) to the page requested by
+    args, and return it with the page size; limit, if given, replaces the
+    page size args request.
+
+    Rows are ordered by key_column, which must be unique (e.g. a primary
+    key), or by sort_column with key_column breaking ties, and the page
+    starts after the row encoded in the 'cursor' parameter. Seeking on
+    the key keeps every page as cheap as the first, unlike OFFSET. One
+    row more than the page size is fetched to tell whether another page
+    follows. Raises ValueError if 'limit' or 'cursor' is malformed.
+    """
+    if limit is None:
+        limit = pageLimit(args)
+    sort = None if sort_column is None else args["sort"]
+    if sort_column is None:
+        if "cursor" in args:
+            query = query.filter(key_column > decodeCursor(args["cursor"]))
+        order = [key_column]
+    else:
+        if "cursor" in args:
+            after = tuple_(*decodeCursor(args["cursor"], sort))
+            position = tuple_(sort_column, key_column)
+            query = query.filter(position < after if descending
+                                 else position > after)
+        if descending:
+            order = [sort_column.desc(), key_column.desc()]
+        else:
+            order = [sort_column, key_column]
+    return query.order_by(*order).limit(limit + 1), limit
+
+
+def pageResult(rows, limit, args, sort_column=None):
+    """
+    Return the rows fetched by a pageQuery() query that belong to the
+    page, and the cursor for the next page (None on the last page).
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    if sort_column is None:
+        return rows, encodeCursor(rows[-1].id)
+    return rows, encodeCursor([getattr(rows[-1], sort_column.key),
+                               rows[-1].id], args["sort"])
+
+
+def exportRows(read):
+    """
+    Yield every row of an ExportRead, EXPORT_FETCH_ROWS at a time.
+
+    Each batch is read in a short transaction of its own; the session
+    then returns its connection to the pool before the rows are sent. A
+    slow client thus holds neither a lock that would keep writers
+    waiting nor a pooled connection.
+    """
+    while True:
+        rows, more = read.batchResult(
+                         db_session.execute(read.batch()).scalars().all()
+                     )
+        db_session.close()
+        for row in rows:
+            yield row
+        if not more:
+            return
+
+
+def rowDict(row):
+    """ Return a dict of every column value of an ORM object. """
+    return {column.name: getattr(row, column.name)
+            for column in row.__table__.columns}
+
+
+def cacheKey():
+    """ Return a cache key for the current request's route and arguments. """
+    return request.path + "?" + urlencode(sorted(
+                                    request.args.items(multi=True)
+                                ))
+
+
+def categoryTag(category_id):
+    """ Return the cache tag for data derived from a category. """
+    try:
+        return "category:{}".format(int(category_id))
+    except (TypeError, ValueError):
+        return "category:{}".format(category_id)
+
+
+def itemTag(item_id):
+    """ Return the cache tag for data derived from a single item. """
+    try:
+        return "item:{}".format(int(item_id))
+    except (TypeError, ValueError):
+        return "item:{}".format(item_id)
+
+
+def itemsColumnTag(column):
+    """ Return the cache tag for data depending on a column of every item,
+    such as a list of items sorted or filtered by it. """
+    return "items.{}".format(column)
+
+
+def changeTags(entry):
+    """ Return the cache tags a change log entry invalidates. """
+    if entry.entity == "category":
+        return ["categories", categoryTag(entry.entity_id)]
+    return [itemTag(entry.entity_id)] + \
+        [categoryTag(category_id) for category_id
+         in (entry.category_id, entry.old_category_id)
+         if category_id is not None] + \
+        [itemsColumnTag(field) for field in changes.changedFields(entry)]
+
+
+def applyChange(entry):
+    """ Drop the cached reads a change log entry makes stale. """
+    if entry.entity == "category" and entry.deleted:
+        # The items deleted with the category are not logged, and may be
+        # in any cached list
+        catalog_cache.clear()
+    else:
+        catalog_cache.invalidate(*changeTags(entry))
+
+
+def syncCatalogCache():
+    """
+    Drop the cached catalog reads that writes by any process changed.
+
+    Called before a cached read, and after a conditional view has read
+    its version, so that a response is never older than its ETag.
+    """
+    catalog_changes.catchUp(db_session)
+
+
+def cachedRoute(tags):
+    """
+    Decorate a JSON GET view so that its successful responses are cached.
+
+    tags is called after the view and returns the cache tags whose
+    change log entries (see changeTags()) drop the cached response.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            syncCatalogCache()
+            key = cacheKey()
+            body = catalog_cache.get(key)
+            if body is not cache.MISSING:
+                return app.response_class(body, mimetype="application/json")
+            generation = catalog_cache.generation
+            response = view(*args, **kwargs)
+            # Streamed exports are never cached: buffering them would undo
+            # the point of streaming
+            if response.status_code == 200 and not response.is_streamed:
+                catalog_cache.set(key, response.get_data(), tags(),
+                                  generation=generation)
+            return response
+        return wrapper
+    return decorator
+
+
+def readTags():
+    """ Return the cache tags of the APIRead answering the current
+    request (see readResponse()). """
+    return g.cache_tags
+
+
+def summaryTags():
+    """ Return the cache tags for the current inventory summary request. """
+    if "category_id" in request.args:
+        return [categoryTag(request.args["category_id"])]
+    return ["categories"] + [itemsColumnTag(column) for column
+                             in ("stock", "price_cents", "category_id")]
+
+
+def conditionalRoute(scope):
+    """
+    Decorate a GET view so that its responses carry the version of the
+    catalog scope they show as ETag, and requests whose If-None-Match
+    holds the current ETag get an empty 304 without running the view.
+
+    scope is called during the request with the view's arguments and
+    returns the catalog scope (see versions.py) the response depends on,
+    or None if the response must not be conditional.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            scope_id = scope(*args, **kwargs)
+            if scope_id is None:
+                return view(*args, **kwargs)
+            # Only the version table is read to answer a revalidation
+            version, modified = versions.currentVersion(db_session, scope_id)
+            etag = "{}.{}".format(scope_id, version)
+            if request.if_none_match.contains_weak(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag, weak=True)
+            if modified is not None:
+                response.last_modified = datetime.fromtimestamp(
+                                             modified, timezone.utc
+                                         )
+            # Clients must revalidate rather than guess a freshness period
+            # from Last-Modified
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+def anonymousPage():
+    """ Return True unless the page shows a login or flashed messages. """
+    return not session.get("email") and not session.get("_flashes")
+
+
+def cachedPage(key, tags, render):
+    """
+    Return the response of an HTML page rendered by render().
+
+    Every anonymous visitor without flashed messages sees the same page,
+    so it is rendered once and then served as bytes from the cache under
+    key until a write invalidates one of its tags. Logged-in users get a
+    fresh render including their admin controls.
+    """
+    syncCatalogCache()
+    if not anonymousPage():
+        return render()
+    body = catalog_cache.getOrSet(key, lambda: render().encode(), tags=tags)
+    return app.response_class(body, mimetype="text/html")
+
+
+def categoryScope(category_id):
+    """ Return the version scope of a category, or None if malformed. """
+    try:
+        return int(category_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def homeScope():
+    """ Return the version scope of the home page. """
+    return versions.CATEGORIES_SCOPE if anonymousPage() else None
+
+
+def categoryPageScope(category_id):
+    """ Return the version scope of a category page. """
+    return categoryScope(category_id) if anonymousPage() else None
+
+
+def categoriesJSONScope():
+    """ Return the version scope of the current categories API request. """
+    return versions.CATEGORIES_SCOPE
+
+
+def summaryScope():
+    """ Return the version scope of the current inventory summary request. """
+    if "category_id" in request.args:
+        return categoryScope(request.args["category_id"])
+    return versions.CATALOG_SCOPE
+
+
+def changesScope():
+    """ Return the version scope of the change feed. """
+    return versions.CATALOG_SCOPE
+
+
+def itemsJSONScope():
+    """ Return the version scope of the current items API request. """
+    if "category_id" in request.args and \
+            request.args.get("mode") in (None, "export"):
+        return categoryScope(request.args["category_id"])
+    return versions.CATALOG_SCOPE
+
+
+def processImage(table, row_id, path, digest, seq):
+    """
+    Store an accepted upload and point a catalog row at it.
+
+    Runs on image_pool, whose futures nobody waits on, so failures are
+    logged here and the upload's file is deleted whatever happens. The row
+    keeps its previous image until every variant of the new one exists,
+    and then changes in a single UPDATE. Uploads may finish out of order:
+    the UPDATE only applies if no upload with a later seq has.
+    """
+    try:
+        digest = images.storeFile(path, digest)
+        with engine.begin() as conn:
+            conn.execute(table.update().where(
+                             (table.c.id == row_id) &
+                             (func.coalesce(table.c.image_seq, 0) < seq)
+                         ).values(image=digest, image_seq=seq))
+    except images.InvalidImage:
+        app.logger.warning("Discarded unreadable image for %s %s.",
+                           table.name, row_id)
+    except Exception:
+        app.logger.exception("Could not store the image for %s %s.",
+                             table.name, row_id)
+    finally:
+        os.unlink(path)
+
+
+def queueImage(pending_image, model, row_id):
+    """
+    Schedule processing of an upload accepted with images.acceptUpload().
+
+    Returns False, discarding the upload, if the image pool is saturated.
+    Uploads are sequenced by the time they were accepted.
+    """
+    path, digest = pending_image
+    try:
+        image_pool.submit(processImage, model.__table__, row_id, path,
+                          digest, time.time_ns())
+    except workers.PoolSaturated:
+        os.unlink(path)
+        return False
+    return True
+
+
+def acceptImageField():
+    """
+    Return the accepted upload of the form's image field, or None if no
+    file was chosen. Raises images.InvalidImage for unusable uploads.
+    """
+    upload = request.files.get("image")
+    if not upload:
+        return None
+    return images.acceptUpload(upload)
+
+
+@app.template_filter("image_url")
+def imageURLFilter(image, variant="card", extension="jpg"):
+    """ Return the URL of a variant of a stored image in templates. Images
+    still referenced by file path are served as they are. """
+    if images.isDigest(image):
+        return url_for("storedImage", digest=image,
+                       name="{}.{}".format(variant, extension))
+    return "/" + image
+
+
+@app.template_filter("currency")
+def currencyFilter(cents):
+    """ Render a price in cents as a currency string in templates. """
+    return formatPrice(cents)
+
+
+def itemSortOrder(args):
+    """
+    Return the (column, descending) pair requested by the 'sort'
+    parameter, or (None, False) to keep the default ID order.
+
+    Raises ValueError if the parameter names an unsupported column.
+    """
+    if "sort" not in args:
+        return None, False
+    sort = args["sort"]
+    descending = sort.startswith("-")
+    column = ITEM_SORT_COLUMNS.get(sort.lstrip("-"))
+    if column is None:
+        raise ValueError("Unsupported sort order.")
+    return column, descending
+
+
+def filterPriceRange(query, args):
+    """
+    Restrict an item query (or select() statement) to the
+    'min_price'/'max_price' range.
+
+    Raises ValueError if either bound is not a valid price.
+    """
+    if "min_price" in args:
+        query = query.filter(
+                    Item.price_cents >= parsePrice(args["min_price"])
+                )
+    if "max_price" in args:
+        query = query.filter(
+                    Item.price_cents <= parsePrice(args["max_price"])
+                )
+    return query
+
+
+class APIRead(object):
+    """
+    A read request of the JSON API, parsed and validated by
+    categoriesRead() or itemsRead(), for views.py and asgi.py alike to
+    run: each executes statement, which selects ORM objects (or is None
+    if nothing can match), and responds with result() of its rows.
+
+    tags are the cache tags of which rows are selected; result() sets
+    cache_tags to them and the tags of the items shown. (Reads of
+    categories are tagged "categories" as a whole.)
+
+    A plain APIRead lists every row selected under key.
+    """
+
+    def __init__(self, key, statement, tags):
+        self.key = key
+        self.statement = statement
+        self.tags = list(tags)
+        self.cache_tags = None
+
+    def showRows(self, rows):
+        """ Set cache_tags for a response showing the rows. """
+        self.cache_tags = self.tags + [itemTag(row.id) for row in rows
+                                       if isinstance(row, Item)]
+
+    def result(self, rows):
+        """ Return the (status, data) of the response for the rows. """
+        self.showRows(rows)
+        return 200, {self.key: [row.serialize for row in rows]}
+
+
+class PageRead(APIRead):
+    """
+    A page of a list, requested by args as pageQuery() describes; shape
+    returns the data listed for a row. The last page also has end_tags,
+    those of rows added after the end of the list. Raises ValueError if
+    the paging parameters are malformed.
+    """
+
+    def __init__(self, key, statement, tags, args, key_column,
+                 sort_column=None, descending=False, shape=None,
+                 end_tags=()):
+        statement, self.limit = pageQuery(statement, args, key_column,
+                                          sort_column, descending)
+        APIRead.__init__(self, key, statement, tags)
+        self.args = args
+        self.sort_column = sort_column
+        self.shape = shape
+        self.end_tags = list(end_tags)
+
+    def result(self, rows):
+        rows, next_cursor = pageResult(rows, self.limit, self.args,
+                                       self.sort_column)
+        self.showRows(rows)
+        if next_cursor is None:
+            self.cache_tags += self.end_tags
+        return 200, {self.key: [row.serialize if self.shape is None
+                                else self.shape(row) for row in rows],
+                     "next_cursor": next_cursor}
+
+
+class RowRead(APIRead):
+    """ A single row; missing is the message of the 404 response given if
+    there is none. """
+
+    def __init__(self, key, statement, tags, missing):
+        # A second row is only fetched to tell that the match is not unique
+        APIRead.__init__(self, key, statement.limit(2), tags)
+        self.missing = missing
+
+    def result(self, rows):
+        if not rows:
+            return 404, {"status": 404, "message": self.missing}
+        if len(rows) > 1:
+            raise MultipleResultsFound("Multiple rows match.")
+        return APIRead.result(self, rows)
+
+
+class ExportRead(APIRead):
+    """
+    Every row of a list, in the order of its pages, sent as one streamed
+    response. The server reads the rows in batches: it executes batch()
+    and passes the rows to batchResult() until no more batches follow.
+    Exports are not cached, so have no tags.
+    """
+
+    def __init__(self, key, statement, args, key_column, sort_column=None,
+                 descending=False):
+        APIRead.__init__(self, key, statement, ())
+        self.args = {"sort": args.get("sort")}
+        self.key_column = key_column
+        self.sort_column = sort_column
+        self.descending = descending
+        self.limit = EXPORT_FETCH_ROWS
+
+    def batch(self):
+        """ Return the statement selecting the next batch, which continues
+        after the last row of the one before. """
+        statement, self.limit = pageQuery(self.statement, self.args,
+                                          self.key_column, self.sort_column,
+                                          self.descending, EXPORT_FETCH_ROWS)
+        return statement
+
+    def batchResult(self, rows):
+        """ Return the rows of a batch to send, and whether another batch
+        follows. """
+        rows, self.args["cursor"] = pageResult(rows, self.limit, self.args,
+                                               self.sort_column)
+        return rows, self.args["cursor"] is not None
+
+
+def itemsOrderTags(sort_column, args):
+    """
+    Return the cache tags of which items a page of every item shows: those
+    of the columns it is sorted and filtered by.
+
+    Pages in ID order only change with the items they show, save the last
+    (see PageRead).
+    """
+    columns = set()
+    if sort_column is not None:
+        columns.add(sort_column.key)
+    if "min_price" in args or "max_price" in args:
+        columns.add("price_cents")
+    return [itemsColumnTag(column) for column in sorted(columns)]
+
+
+def itemNameAndId(item):
+    """ Return the data listed for an item by 'mode=list'. """
+    return {"name": item.name, "id": item.id}
+
+
+def categoriesRead(args):
+    """
+    Parse the args of a categories API request.
+
+    Returns the APIRead answering it, the (status, message) of the error
+    response for an invalid request, or None if the request names no
+    read at all.
+    """
+    if "mode" in args:
+        if args["mode"] == "list":
+            # A page of categories
+            try:
+                return PageRead("Categories", select(Category),
+                                ["categories"], args, Category.id)
+            except ValueError:
+                return 422, PAGE_PARAMS_MESSAGE
+        elif args["mode"] == "export":
+            # Every category in a single response
+            return ExportRead("Categories", select(Category), args,
+                              Category.id)
+        elif args["mode"] == "search":
+            if "query" not in args:
+                return 422, "Must supply a value for 'query' parameter " \
+                            "if using 'mode=search'"
+            try:
+                limit = pageLimit(args)
+            except ValueError:
+                return 422, "Parameter 'limit' must be a positive integer."
+            # Categories matching the search term, best matches first
+            if SEARCH_ENABLED:
+                statement = search.categorySearchStatement(args["query"],
+                                                           limit)
+            else:
+                statement = select(Category).filter(
+                                Category.name.like(
+                                    "%{}%".format(args["query"])
+                                )
+                            ).limit(limit)
+            return APIRead("QueryCategories", statement, ["categories"])
+        return 422, "Incorrect option for 'mode' parameter."
+    elif "id" in args or "name" in args:
+        # A category by ID or by name
+        if "id" in args and "name" in args:
+            return 422, "Parameter 'name' cannot be used with 'id'."
+        if "id" in args:
+            return RowRead("Category",
+                           select(Category).filter_by(id=args["id"]),
+                           ["categories"],
+                           "No category corresponding to this ID.")
+        return RowRead("Category",
+                       select(Category).filter_by(name=args["name"]),
+                       ["categories"], "No category found under this name.")
+    return None
+
+
+def itemsRead(args):
+    """ Parse the args of an items API request, like categoriesRead(). """
+    if "mode" in args:
+        if args["mode"] in ("list", "export"):
+            # A page of item names, or every item (of a category, if
+            # given), optionally within a price range and sorted
+            try:
+                sort_column, descending = itemSortOrder(args)
+                statement = filterPriceRange(select(Item), args)
+            except ValueError:
+                return 422, ITEM_FILTER_MESSAGE
+            if args["mode"] == "export":
+                if "category_id" in args:
+                    statement = statement.filter_by(
+                                    category_id=args["category_id"]
+                                )
+                return ExportRead("Items", statement, args, Item.id,
+                                  sort_column, descending)
+            try:
+                return PageRead("Items", statement,
+                                itemsOrderTags(sort_column, args), args,
+                                Item.id, sort_column, descending,
+                                itemNameAndId, [itemsColumnTag("id")])
+            except ValueError:
+                return 422, PAGE_PARAMS_MESSAGE
+        elif args["mode"] == "search":
+            if "query" not in args:
+                return 422, "Must supply a value for 'query' parameter " \
+                            "if using 'mode=search'."
+            try:
+                limit = pageLimit(args)
+                fields = search.parseFields(args.get("fields"))
+            except ValueError:
+                return 422, "Parameter 'limit' must be a positive " \
+                            "integer and 'fields' a list of " + \
+                            ", ".join(search.ITEM_FIELDS) + "."
+            # Items matching the search term, best matches first
+            if SEARCH_ENABLED:
+                statement = search.itemSearchStatement(args["query"],
+                                                       fields, limit)
+            else:
+                statement = select(Item).filter(
+                                Item.name.like("%{}%".format(args["query"]))
+                            ).limit(limit)
+            return APIRead("QueryItems", statement,
+                           [itemsColumnTag(field) for field in fields])
+        return 422, "Incorrect option for 'mode' parameter."
+    elif "category_id" in args:
+        # A page of the items of a category, optionally within a price
+        # range and sorted
+        try:
+            sort_column, descending = itemSortOrder(args)
+            statement = filterPriceRange(
+                            select(Item).filter_by(
+                                category_id=args["category_id"]
+                            ), args
+                        )
+        except ValueError:
+            return 422, ITEM_FILTER_MESSAGE
+        try:
+            return PageRead("Items", statement,
+                            [categoryTag(args["category_id"])], args,
+                            Item.id, sort_column, descending)
+        except ValueError:
+            return 422, PAGE_PARAMS_MESSAGE
+    elif "id" in args or "name" in args:
+        # An item by ID or by name
+        if "id" in args and "name" in args:
+            return 422, "Parameter 'name' cannot be used with 'id'."
+        if "id" in args:
+            return RowRead("Item", select(Item).filter_by(id=args["id"]),
+                           [itemTag(args["id"])],
+                           "No item found under this ID.")
+        return RowRead("Item", select(Item).filter_by(name=args["name"]),
+                       [itemsColumnTag("name")],
+                       "No item found under this name.")
+    return None
+
+
+def readResponse(read):
+    """ Run the APIRead (or error) parsed from the current request and
+    return its response. """
+    if read is None:
+        return badRequestError()
+    if isinstance(read, tuple):
+        return jsonRespObj(*read)
+    if isinstance(read, ExportRead):
+        return streamJSONList(read.key, exportRows(read))
+    rows = [] if read.statement is None \
+        else db_session.execute(read.statement).scalars().all()
+    status, data = read.result(rows)
+    g.cache_tags = read.cache_tags
+    response = jsonify(data)
+    response.status_code = status
+    return response
+
+
+def validateItemRow(row, category_ids):
+    """
+    Validate an item of a batch create request.
+
+    Returns a dict of column values ready for insertion, or a string
+    describing why the row was rejected.
+    """
+    if not isinstance(row, dict):
+        return "Item must be a JSON object."
+    if not isinstance(row.get("name"), str) or not row["name"]:
+        return "Item name must be provided for item to be added."
+    if row.get("category_id") not in category_ids:
+        return "Category ID must be that of an existing category."
+    if row.get("price") in (None, ""):
+        return "Price must be provided for item to be added."
+    try:
+        price_cents = parsePrice(row["price"])
+    except ValueError:
+        return "Price must be a non-negative amount in whole cents."
+    stock = row.get("stock", 0)
+    if not isinstance(stock, int) or isinstance(stock, bool) or stock < 0:
+        return "Stock must be a non-negative integer."
+    description = row.get("description")
+    if description is not None and not isinstance(description, str):
+        return "Description must be a string."
+    return {
+        "name": row["name"],
+        "category_id": row["category_id"],
+        "price_cents": price_cents,
+        "stock": stock,
+        "description": description
+    }
+
+
+def validateCategoryRow(row):
+    """
+    Validate a category of a batch create request.
+
+    Returns a dict of column values ready for insertion, or a string
+    describing why the row was rejected.
+    """
+    if not isinstance(row, dict):
+        return "Category must be a JSON object."
+    if not isinstance(row.get("name"), str) or not row["name"]:
+        return "Name must be provided for category to be added."
+    return {"name": row["name"]}
+
+
+def batchRows(key):
+    """
+    Return the list of rows under key in the request's JSON body.
+
+    Raises ValueError if the body is not of the form {key: [...]} or holds
+    more than BATCH_MAX_ROWS rows.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or not isinstance(body.get(key), list):
+        raise ValueError("Malformed batch.")
+    if len(body[key]) > BATCH_MAX_ROWS:
+        raise ValueError("Batch too large.")
+    return body[key]
+
+
+def batchRespObj(results, inserted):
+    """ Generate a JSONified batch create response object and return it. """
+    resp_data = {
+        "status": 200,
+        "inserted": inserted,
+        "rejected": len(results) - inserted,
+        "Results": results
+    }
+    response = jsonify(resp_data)
+    response.status_code = 200
+    return response
+
+
+def parseInteger(value):
+    """
+    Return an integer given as such or as a string of digits.
+
+    Raises ValueError for anything else, including booleans and floats.
+    """
+    if isinstance(value, str):
+        value = int(value)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ValueError("Must be an integer.")
+    return value
+
+
+def adjustStock(item_id, delta):
+    """
+    Add delta to an item's stock and return the new stock.
+
+    Returns an error message instead if the item does not exist or has
+    less stock than a negative delta takes away; the stock is then left
+    unchanged. The caller commits.
+    """
+    row = db_session.execute(STOCK_DELTA_UPDATE,
+                             {"id": item_id, "delta": delta}).first()
+    if row is not None:
+        return row.stock
+    if db_session.query(Item.id).filter_by(id=item_id).first() is None:
+        return STOCK_UNKNOWN_ITEM_MESSAGE
+    return STOCK_INSUFFICIENT_MESSAGE
+
+
+def deleteCategoryWithItems(category):
+    """
+    Delete a category and all of its items, and return the number of
+    items deleted.
+
+    The items are removed with a single DELETE rather than being loaded
+    and deleted one by one, keeping the write transaction short. The
+    category goes first: the version, inventory and change log triggers
+    then apply its delete once and skip its items (see
+    inventory.ITEM_DELETE_APPLIES), leaving only their search index entries
+    to remove row by row. The caller commits.
+    """
+    db_session.delete(category)
+    db_session.flush()
+    return db_session.query(Item).filter_by(
+               category_id=category.id
+           ).delete(synchronize_session=False)
+
+
+def streamJSONList(key, rows):
+    """
+    Return a response streaming {key: [...]} built from rows.
+
+    Rows are serialized one at a time and sent in chunks of roughly
+    EXPORT_CHUNK_BYTES, so memory use stays flat however many rows the
+    query returns. Pass the rows of exportRows() to also fetch them in
+    batches.
+    """
+    def generate():
+        chunk = ['{{"{}":['.format(key)]
+        size = 0
+        separator = ""
+        for row in rows:
+            text = separator + json.dumps(row.serialize, sort_keys=True,
+                                          separators=(",", ":"))
+            separator = ","
+            chunk.append(text)
+            size += len(text)
+            if size >= EXPORT_CHUNK_BYTES:
+                yield "".join(chunk)
+                chunk = []
+                size = 0
+        chunk.append("]}")
+        yield "".join(chunk)
+
+    # Keep the request context, and with it the scoped DB session, while
+    # the body is sent
+    return app.response_class(stream_with_context(generate()),
+                              mimetype="application/json")
+
+
 def validEmailInput(email):
     """ Perform simple email validation and return True on pass. """
     if "@" and "." not in email:
@@ -223,6 +1333,9 @@ def login():
     if request.method == "GET":
         # Set a new state for the login session
         session["state"] = generateToken()
+        # Have Google's signing keys fetched while the user signs in, and
+        # kept fresh from then on
+        oauth.signing_keys.start()
         return render_template("login.html",
                                title=TITLE,
                                STATE=session["state"])
@@ -249,32 +1362,17 @@ def googleLogin():
     if session.get("state") != request.args.get("state"):
         return jsonRespObj(401, "Invalid state parameter.")
 
-    # Attempt upgrade of auth code into a credentials object
-    auth_code = request.data
+    # Attempt upgrade of auth code into tokens, and verify the ID token
+    # locally against Google's cached signing keys: it must be signed by
+    # Google, for this application, unexpired, and carry no unverified
+    # email address
+    auth_code = request.get_data(as_text=True)
     try:
-        oauth_flow = flow_from_clientsecrets("data/client_secret.json",
-                                             scope="",
-                                             redirect_uri="postmessage")
-        credentials = oauth_flow.step2_exchange(auth_code)
-    except FlowExchangeError:
-        return jsonRespObj(401, "Failed to upgrade auth code.")
-
-    # Check validity of access token
-    access_token = credentials.access_token
-    chk_url = G_TOKEN_CHK_BASE_URL.format(access_token)
-    chk_result = json.loads(Http().request(chk_url, "GET")[1])
-    # Abort if access token not valid
-    if chk_result.get("error") is not None:
-        return jsonRespObj(500, chk_result.get("error"))
-
-    # Verify that the access token is being used by the intended user
-    google_id = credentials.id_token["sub"]
-    if chk_result["user_id"] != google_id:
-        return jsonRespObj(401, "Mismatched token and user IDs.")
-
-    # Verify that access token is valid for this application
-    if chk_result["issued_to"] != G_CLIENT_SECRET:
-        return jsonRespObj(401, "Mismatched token and application IDs.")
+        tokens = oauth.exchangeCode(auth_code, G_CLIENT_ID, G_CLIENT_SECRET)
+        claims = oauth.verifyIdToken(tokens["id_token"], G_CLIENT_ID)
+    except oauth.OAuthError as error:
+        return jsonRespObj(401, str(error))
+    google_id = claims["sub"]
 
     # Verify that the user is not already logged in so session variables do
     # not get unnecessarily reset
@@ -283,20 +1381,21 @@ def googleLogin():
     if (saved_credentials is not None) and (google_id == saved_google_id):
         return jsonRespObj(200, "Current user is already logged in.")
 
-    # Store access token in session object
-    session["credentials"] = credentials.access_token
+    # Obtain the user's email from the ID token; only tokens issued
+    # without the email scope need a call for user information
+    email = claims.get("email")
+    if email is None:
+        try:
+            email = oauth.userEmail(tokens["access_token"])
+        except oauth.OAuthError as error:
+            return jsonRespObj(502, str(error))
+        if email is None:
+            return jsonRespObj(401, "Unverified email address.")
+
+    # Store access token and user information in session object
+    session["credentials"] = tokens["access_token"]
     session["google_id"] = google_id
-
-    # Obtain user information
-    params = {
-        "access_token": session["credentials"],
-        "alt": "json"
-    }
-    response = requests.get(G_USER_INFO_URL, params=params)
-    user_data = json.loads(response.text)
-
-    # Store user information in session
-    session["email"] = user_data["email"]
+    session["email"] = email
     return redirect(url_for("home"))
 
 
@@ -308,10 +1407,8 @@ def googleLogout():
     if access_token is None:
         return jsonRespObj(401, "Current user is not logged in.")
 
-    revoke_url = G_TOKEN_REVOKE_BASE_URL.format(access_token)
-    revoke_result = Http().request(revoke_url, "GET")[0]
     # Revoke access token
-    if revoke_result["status"] == "200":
+    if oauth.revokeToken(access_token):
         # Reset the user session
         del session["credentials"]
         del session["google_id"]
@@ -321,7 +1418,7 @@ def googleLogout():
         return redirect(url_for("home"))
     else:
         # Respond that the token was invalid
-        return jsonRespObj("Failed to revoke token for given user.", 400)
+        return jsonRespObj(400, "Failed to revoke token for given user.")
 
 
 ###############
@@ -330,25 +1427,71 @@ def googleLogout():
 
 @app.route("/")
 @app.route("/index")
+@conditionalRoute(homeScope)
 def home():
-    subheading = "Browse Catalog"
-    categories = db_session.query(Category).all()
-    return render_template("index.html",
-                           title=TITLE,
-                           subheading=subheading,
-                           categories=categories)
+    def renderHome():
+        subheading = "Browse Catalog"
+        categories = catalog_cache.getOrSet(
+                         "page-data:home",
+                         lambda: [rowDict(category) for category
+                                  in db_session.query(Category).all()],
+                         tags=["categories"]
+                     )
+        return render_template("index.html",
+                               title=TITLE,
+                               subheading=subheading,
+                               categories=categories)
+
+    return cachedPage("page:home", ["categories"], renderHome)
 
 
 @app.route("/category/<int:category_id>")
+@conditionalRoute(categoryPageScope)
 def displayCategory(category_id):
-    category = db_session.query(Category).filter_by(id=category_id).one()
-    items = db_session.query(Item).filter_by(category=category).all()
-    subheading = "Displaying items for category '" + category.name + "'"
-    return render_template("category.html",
-                           title=TITLE,
-                           subheading=subheading,
-                           category=category,
-                           items=items)
+    def loadCategoryPage():
+        category = db_session.query(Category).filter_by(
+                       id=category_id
+                   ).one()
+        # Read before the items, so the page's stock stream sends every
+        # change the items may not include
+        seq = changes.latestSeq(db_session)
+        items = db_session.query(Item).filter_by(category=category).all()
+        return rowDict(category), [rowDict(item) for item in items], seq
+
+    def renderCategoryPage():
+        category, items, seq = catalog_cache.getOrSet(
+                              "page-data:category:{}".format(category_id),
+                              loadCategoryPage,
+                              tags=[categoryTag(category_id)]
+                          )
+        subheading = "Displaying items for category '" + \
+                     category["name"] + "'"
+        return render_template("category.html",
+                               title=TITLE,
+                               subheading=subheading,
+                               category=category,
+                               items=items,
+                               stock_seq=seq)
+
+    return cachedPage("page:category:{}".format(category_id),
+                      [categoryTag(category_id)], renderCategoryPage)
+
+
+# Route serving stored images. A digest names the same bytes forever, so
+# responses may be cached indefinitely.
+@app.route("/images/<digest>/<name>")
+def storedImage(digest, name):
+    if not images.isDigest(digest) or name not in images.VARIANT_FILES:
+        return abort(404)
+    extension = name.rsplit(".", 1)[1]
+    response = send_from_directory(
+                   os.path.abspath(images.imageDir(digest)), name,
+                   mimetype=images.MIMETYPES[extension],
+                   cache_timeout=IMAGE_MAX_AGE
+               )
+    response.headers["Cache-Control"] = \
+        "public, max-age={}, immutable".format(IMAGE_MAX_AGE)
+    return response
 
 
 # Route for adding items
@@ -359,32 +1502,32 @@ def addItems(category_id):
     category = db_session.query(Category).filter_by(id=category_id).one()
     subheading = "Add items for category '{category}' (id: {id})" \
                  .format(category=category.name, id=category_id)
-    last_item = db_session.query(Item).order_by(Item.id.desc()).first()
-    image_dir = app.config["IMG_DIR"] + "/categories/" + str(category_id) \
-        + "/items/" + str(last_item.id + 1) + "/"
 
     if request.method == "POST":
         new_item = Item()
         new_item.category_id = category_id
         new_item.name = request.form["name"]
-        new_item.price = "$" + request.form["price"]
+        try:
+            new_item.price = request.form["price"]
+        except ValueError:
+            flash("Price must be an amount in dollars and cents.")
+            return redirect(url_for("addItems", category_id=category_id))
         new_item.stock = request.form["stock"]
         new_item.description = request.form["description"]
         if not request.form["description"]:
             new_item.description = ""
-        # TODO: Add item image functionality
-        # if request.files["image"]:
-        #     # create the image folder for the item
-        #     if not os.path.exists(image_dir):
-        #         os.makedirs(image_dir)
-        #     uploaded_image = request.files["image"]
-        #     safe_image = secure_filename(uploaded_image.filename)
-        #     uploaded_image.save(os.path.join(image_dir, safe_image))
-        #     new_item.image = os.path.join(image_dir, safe_image)
+        try:
+            pending_image = acceptImageField()
+        except images.InvalidImage:
+            flash(IMAGE_INVALID_MESSAGE)
+            return redirect(url_for("addItems", category_id=category_id))
 
         db_session.add(new_item)
         db_session.commit()
         flash("Successfully added item '{}'.".format(new_item.name))
+        if pending_image and \
+                not queueImage(pending_image, Item, new_item.id):
+            flash(IMAGE_BUSY_MESSAGE)
         return redirect(url_for("displayCategory", category_id=category_id))
 
     elif request.method == "GET":
@@ -412,47 +1555,44 @@ def updateItem(item_id, category_id):
                             cat_name=category.name, cat_id=category.id)
 
     if request.method == "POST":
-        image_dir = app.config["IMG_DIR"] \
-                    + "/categories/" \
-                    + str(category_id) \
-                    + "/items/" \
-                    + str(item.id) + "/"
-
         # default the updated data to existing
         updated_name = item.name
         updated_price = item.price
         updated_stock = item.stock
         if item.description:
             updated_description = item.description
-        if item.image:
-            updated_image = item.image
 
         if request.form["name"]:
             updated_name = request.form["name"]
             item.name = updated_name
         if request.form["price"]:
             updated_price = request.form["price"]
-            item.price = "$" + updated_price
+            try:
+                item.price = updated_price
+            except ValueError:
+                flash("Price must be an amount in dollars and cents.")
+                return redirect(url_for("updateItem", item_id=item_id,
+                                        category_id=category_id))
         if request.form["stock"]:
             updated_stock = request.form["stock"]
             item.stock = updated_stock
         if request.form["description"]:
             updated_description = request.form["description"]
             item.description = updated_description
-        # TODO: Add item image functionality
-        # if request.files["image"]:
-        #     # creates a directory for the item images if this was not
-        #     # done during creation of item
-        #     if not os.path.exists(image_dir):
-        #         os.makedirs(image_dir)
-        #     uploaded_image = request.files["image"]
-        #     safe_image = secure_filename(uploaded_image.filename)
-        #     uploaded_image.save(os.path.join(image_dir, safe_image))
-        #     item.image = os.path.join(image_dir, safe_image)
+        try:
+            pending_image = acceptImageField()
+        except images.InvalidImage:
+            db_session.rollback()
+            flash(IMAGE_INVALID_MESSAGE)
+            return redirect(url_for("updateItem", item_id=item_id,
+                                    category_id=category_id))
 
         db_session.add(item)
         db_session.commit()
         flash("Successfully updated item '{}'.".format(item.name))
+        if pending_image and \
+                not queueImage(pending_image, Item, item.id):
+            flash(IMAGE_BUSY_MESSAGE)
         return redirect(url_for("displayCategory", category_id=category_id))
 
     elif request.method == "GET":
@@ -506,28 +1646,22 @@ def addCategories():
     if requireLogin():
         return redirect(url_for("login"))
     subheading = "Add categories"
-    last_category = db_session.query(Category).order_by(
-                        Category.id.desc()
-                    ).first()
-    image_dir = app.config["IMG_DIR"] + "/categories/" \
-        + str(last_category.id + 1) + "/"
 
     if request.method == "POST":
         new_category = Category()
         new_category.name = request.form["name"]
-        if request.files["image"]:
-            # create the image folder for the category
-            if not os.path.exists(image_dir):
-                os.makedirs(image_dir)
-                os.makedirs(os.path.join(image_dir, 'items'))
-            uploaded_image = request.files["image"]
-            safe_image = secure_filename(uploaded_image.filename)
-            uploaded_image.save(os.path.join(image_dir, safe_image))
-            new_category.image = os.path.join(image_dir, safe_image)
+        try:
+            pending_image = acceptImageField()
+        except images.InvalidImage:
+            flash(IMAGE_INVALID_MESSAGE)
+            return redirect(url_for("addCategories"))
 
         db_session.add(new_category)
         db_session.commit()
         flash("Successfully added category '{}'.".format(new_category.name))
+        if pending_image and not queueImage(pending_image, Category,
+                                            new_category.id):
+            flash(IMAGE_BUSY_MESSAGE)
         return redirect(url_for("home"))
 
     elif request.method == "GET":
@@ -549,30 +1683,26 @@ def updateCategory(category_id):
                  .format(name=category.name, id=category_id)
 
     if request.method == "POST":
-        image_dir = app.config["IMG_DIR"] + "/categories/" + str(category_id) \
-            + "/"
-
         # default the updated data to existing
         updated_name = category.name
-        updated_image = category.image
 
         if request.form["name"]:
             updated_name = request.form["name"]
             category.name = updated_name
-        if request.files["image"]:
-            # creates a directory for the category images if this was not
-            # done during creation of category
-            if not os.path.exists(image_dir):
-                os.makedirs(image_dir)
-                os.makedirs(os.path.join(image_dir, 'items'))
-            uploaded_image = request.files["image"]
-            safe_image = secure_filename(uploaded_image.filename)
-            uploaded_image.save(os.path.join(image_dir, safe_image))
-            category.image = os.path.join(image_dir, safe_image)
+        try:
+            pending_image = acceptImageField()
+        except images.InvalidImage:
+            db_session.rollback()
+            flash(IMAGE_INVALID_MESSAGE)
+            return redirect(url_for("updateCategory",
+                                    category_id=category_id))
 
         db_session.add(category)
         db_session.commit()
         flash("Successfully updated category '{}'.".format(category.name))
+        if pending_image and \
+                not queueImage(pending_image, Category, category_id):
+            flash(IMAGE_BUSY_MESSAGE)
         return redirect(url_for("home"))
 
     elif request.method == "GET":
@@ -590,19 +1720,13 @@ def deleteCategory(category_id):
     if requireLogin():
         return redirect(url_for("login"))
     category = db_session.query(Category).filter_by(id=category_id).one()
-    category_items = db_session.query(Item).filter_by(
-                         category_id=category_id
-                     ).all()
     subheading = "Deleting category '{name}' (id: {id})" \
                  .format(name=category.name, id=category_id)
 
     if request.method == "POST":
 
-        # delete the category...
-        db_session.delete(category)
-        # ...followed by all items in the category
-        for item in category_items:
-            db_session.delete(item)
+        # delete the category and all items in it
+        deleteCategoryWithItems(category)
 
         db_session.commit()
         flash("Successfully deleted category '{}'.".format(category.name))
@@ -653,6 +1777,30 @@ def unauthenticatedError():
     return response
 
 
+@app.errorhandler(workers.PoolSaturated)
+def serviceUnavailableError(error):
+    # Form submissions go back to their page with the message flashed
+    if not request.path.startswith("/api/"):
+        flash("The server is busy. Please try again shortly.")
+        return redirect(request.url)
+    resp_data = {
+        "status": 503,
+        "message": "Server is busy. Please retry shortly."
+    }
+    response = jsonify(resp_data)
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+@app.errorhandler(images.ImageTooLarge)
+def imageTooLargeError(error):
+    # Raised while the form is parsed; send the user back to the form
+    flash("Images may be at most {} MB."
+          .format(config.MAX_IMAGE_BYTES // (1024 * 1024)))
+    return redirect(request.url)
+
+
 # AUTH ROUTES #
 
 @app.route("/api/registration", methods=["POST"])
@@ -676,10 +1824,10 @@ def APIRegisterUser():
                    "Registrant's password must contain at least 8 " +
                    "symbols but no spaces."
                )
+    pw_hash = hashPassword(request.args["password"])
     # Only register a new user if the email address (username) does
     # not exist already in DB
     try:
-        pw_hash = bcrypt.generate_password_hash(request.args["password"])
         new_user = User(
                        username=request.args["username"].lower(),
                        password_hash=pw_hash
@@ -732,181 +1880,138 @@ def APIRegisterToken():
 # GET ROUTES #
 
 @app.route("/api/categories/json")
+@conditionalRoute(categoriesJSONScope)
+@cachedRoute(readTags)
 def getCategoriesJSON():
-    if "mode" in request.args:
-        if request.args["mode"] == "list":
-            # Return a list of categories
-            categories = db_session.query(Category).all()
-            response = jsonify(Categories=[category.serialize
-                                           for category in categories])
-            response.status_code = 200
-            return response
-        elif request.args["mode"] == "search":
-            # Return a 422 if mode is 'search' but no query provided
-            if "query" not in request.args:
-                return jsonRespObj(
-                           422,
-                           "Must supply a value for 'query' parameter" +
-                           " if using 'mode=search'"
-                       )
-            # Attempt to return a list of categories corresponding with
-            # the search term
-            try:
-                categories = db_session.query(Category).filter(
-                                 Category.name.like("%{}%".format(
-                                     request.args["query"]
-                                 ))
-                             )
-                response = jsonify(QueryCategories=[
-                               category.serialize for category in categories
-                           ])
-                response.status_code = 200
-                return response
-            except NoResultFound:
-                # Return a 404 if search query returned no categories
-                return jsonRespObj(
-                           404,
-                           "No categories found under this search term."
-                       )
-        else:
-            # Return a 422 if request did not provide acceptable option
-            # for the mode
-            return jsonRespObj(
-                       422,
-                       "Incorrect option for 'mode' parameter."
-                   )
-    elif "id" in request.args:
-        # Return a 422 if mutually exclusive parameters supplied
-        if "name" in request.args:
-            return jsonRespObj(
-                       422,
-                       "Parameter 'name' cannot be used with 'id'."
-                   )
-        # Attempt successful return of a category by ID
-        try:
-            category = db_session.query(Category).filter_by(
-                           id=request.args["id"]
-                       ).one()
-            response = jsonify(Category=[category.serialize])
-            response.status_code = 200
-            return response
-        except NoResultFound:
-            # Return a 404 if no category found under this ID
-            return jsonRespObj(404, "No category corresponding to this ID.")
-    elif "name" in request.args:
-        # Return a 422 if mutually exclusive parameters supplied
-        if "id" in request.args:
-            return jsonRespObj(
-                       422,
-                       "Parameter 'name' cannot be used with 'id'."
-                   )
-        # Attempt to return a category by supplied name
-        try:
-            category = db_session.query(Category).filter(
-                           name=request.args["category_name"]
-                       ).one()
-            response = jsonify(Categories=[category.serialize
-                                           for category in categories])
-            response.status_code = 200
-            return response
-        except NoResultFound:
-            # Return a 404 if no categories go by the provided name
-            return jsonRespObj(404, "No category found under this name.")
-    else:
-        return badRequestError()
+    return readResponse(categoriesRead(request.args))
 
 
 @app.route("/api/items/json")
+@conditionalRoute(itemsJSONScope)
+@cachedRoute(readTags)
 def getItemsJSON():
-    if "mode" in request.args:
-        if request.args["mode"] == "list":
-            # Return a list of item names
-            items = db_session.query(Item).all()
-            response = jsonify(Items=[{
-                           "name": item.serialize["name"],
-                           "id": item.serialize["id"]
-                       } for item in items])
-            response.status_code = 200
-            return response
-        elif request.args["mode"] == "search":
-            # Return a 422 if mode is 'search' but no query provided
-            if "query" not in request.args:
-                return jsonRespObj(
-                           422,
-                           "Must supply a value for 'query' parameter" +
-                           " if using 'mode=search'."
-                       )
-            # Attempt to return a list of items corresponding with the
-            # search term
-            try:
-                items = db_session.query(Item).filter(
-                            Item.name.like("%{}%".format(
-                                request.args["query"]
-                            ))
-                        )
-                response = jsonify(QueryItems=[item.serialize
-                                               for item in items])
-                response.status_code = 200
-                return response
-            except NoResultFound:
-                # Return a 404 if search query returned no items
-                return jsonRespObj(
-                           404,
-                           "No items found under this search term."
-                       )
-        else:
-            # Return a 422 if request did not provide acceptable option for
-            # the mode
+    return readResponse(itemsRead(request.args))
+
+
+@app.route("/api/categories/summary")
+@conditionalRoute(summaryScope)
+@cachedRoute(summaryTags)
+def getCategorySummaryJSON():
+    # Totals are read from the summary table kept up to date by triggers,
+    # one row per category however many items there are
+    category_id = None
+    if "category_id" in request.args:
+        try:
+            category_id = int(request.args["category_id"])
+        except ValueError:
             return jsonRespObj(
                        422,
-                       "Incorrect option for 'mode' parameter."
+                       "Parameter 'category_id' must be an integer."
                    )
-    elif "category_id" in request.args:
-        # Attempt to return all items based on a category ID
-        items = db_session.query(Item).filter_by(
-                    category_id=request.args["category_id"]
-                ).all()
-        response = jsonify(Items=[item.serialize for item in items])
+    summaries = inventory.categorySummaries(db_session, category_id)
+    if category_id is not None and not summaries:
+        return jsonRespObj(404, "No category corresponding to this ID.")
+    response = jsonify(Summaries=[{
+                   "category_id": summary_id,
+                   "name": name,
+                   "item_count": item_count,
+                   "total_stock": total_stock,
+                   "stock_value": formatPrice(stock_value_cents),
+                   "stock_value_cents": stock_value_cents
+               } for summary_id, name, item_count, total_stock,
+                   stock_value_cents in summaries])
+    response.status_code = 200
+    return response
+
+
+@app.route("/api/changes")
+@conditionalRoute(changesScope)
+def getChangesJSON():
+    # Without 'since', return where a mirror synced in full now starts
+    if "since" not in request.args:
+        response = jsonify(Changes=[],
+                           last_seq=changes.latestSeq(db_session),
+                           has_more=False)
         response.status_code = 200
         return response
-    elif "id" in request.args:
-        # Return a 422 if mutually exclusive parameters supplied
-        if "name" in request.args:
-            return jsonRespObj(
-                       422,
-                       "Parameter 'name' cannot be used with 'id'."
-                   )
-        # Attempt to return item information based on ID
-        try:
-            item = db_session.query(Item).filter_by(
-                       name=request.args["id"]
-                   ).one()
-            response = jsonify(Item=[item.serialze])
-            response.status_code = 200
-            return response
-        except NoResultFound:
-            # Return a 404 if no items correspond with the provided ID
-            return jsonRespObj(404, "No item found under this ID.")
-    elif "name" in request.args:
-        # Return a 422 if mutually exclusive parameters supplied
-        if "id" in request.args:
-            return jsonRespObj(
-                       422,
-                       "Parameter 'id' cannot be used with 'name'."
-                   )
-        # Attempt to return item information based on name
+    try:
+        since = int(request.args["since"])
+        limit = pageLimit(request.args)
+    except ValueError:
+        return jsonRespObj(
+                   422,
+                   "Parameters 'since' and 'limit' must be integers, "
+                   "'limit' positive."
+               )
+    # Return a 410 if entries the mirror has not seen were compacted away
+    if since < changes.changeHorizon(db_session):
+        return jsonRespObj(
+                   410,
+                   "Changes since this sequence number are no longer "
+                   "available; sync the full catalog again."
+               )
+    entries, last_seq, has_more = changes.changesSince(db_session, since,
+                                                       limit)
+    response = jsonify(Changes=entries, last_seq=last_seq,
+                       has_more=has_more)
+    response.status_code = 200
+    return response
+
+
+# Route streaming a category's stock levels to its page as Server-Sent
+# Events. The ASGI server (asgi.py) serves it on its event loop; here
+# every open stream holds a thread.
+@app.route("/api/stock/stream")
+def streamStock():
+    try:
+        category_id, since = stockstream.streamParams(
+                                 request.args,
+                                 request.headers.get("Last-Event-ID")
+                             )
+    except ValueError:
+        return jsonRespObj(422, stockstream.STREAM_PARAMS_MESSAGE)
+    # Subscribe before reading the stock, so no change falls in between
+    subscription = stockstream.Subscription(config.STOCK_STREAM_QUEUE_DEPTH)
+    stock_broadcaster.subscribe(category_id, subscription)
+    opening = None
+    try:
+        opening = stockstream.catchUp(db_session, category_id, since)
+    finally:
+        if opening is None:
+            stock_broadcaster.unsubscribe(category_id, subscription)
+    if opening is None:
+        return jsonRespObj(404, "No category corresponding to this ID.")
+    seq, first = opening
+
+    def stream():
         try:
-            item = db_session.query(Item).filter_by(
-                       name=request.args["name"]
-                   ).one()
-            response = jsonify(Item=[item.serialze])
-            response.status_code = 200
-            return response
-        except NoResultFound:
-            # Return a 404 if no items go by the provided name
-            return jsonRespObj(404, "No item found under this name.")
-    else:
-        return badRequestError()
+            yield first
+            for event in subscription.events(seq,
+                                             config.STOCK_STREAM_HEARTBEAT):
+                yield event
+        finally:
+            stock_broadcaster.unsubscribe(category_id, subscription)
+
+    return app.response_class(stream(), mimetype="text/event-stream",
+                              headers={"Cache-Control": "no-cache",
+                                       "X-Accel-Buffering": "no"})
+
+
+@app.route("/api/cache/stats")
+def getCacheStats():
+    # Reject with a 422 if token parameter not provided
+    if "token" not in request.args:
+        return jsonRespObj(
+                   422,
+                   "An access token is required to perform this request."
+               )
+    # Check whether API user has supplied a valid access token
+    if not checkToken(request.args["token"]):
+        return unauthenticatedError()
+    response = jsonify(Cache=catalog_cache.stats(),
+                       TokenCache=token_cache.stats())
+    response.status_code = 200
+    return response
 
 
 # POST ROUTES #
@@ -934,6 +2039,7 @@ def APIAddCategory():
         db_session.add(new_category)
         db_session.commit()
     except:
+        db_session.rollback()
         # If category could not be created, return a 500
         return jsonRespObj(
                    500,
@@ -982,6 +2088,15 @@ def APIAddItem():
     # Create a new item object
     new_item = Item()
 
+    # Reject with a 422 if the price is not a valid amount
+    try:
+        new_item.price = request.args["price"]
+    except ValueError:
+        return jsonRespObj(
+                   422,
+                   "Price must be a non-negative amount in whole cents."
+               )
+
     # Default stock level to 0 parameter/value not provided
     if "stock" not in request.args:
         new_item.stock = 0
@@ -994,15 +2109,11 @@ def APIAddItem():
     # Attempt to add the new item to DB
     try:
         new_item.name = request.args["name"]
-        # Make sure that the price is registered in currency
-        if request.args["price"][0] != "$":
-            new_item.price = "$" + request.args["price"]
-        else:
-            new_item.price = request.args["price"]
         new_item.category_id = request.args["category_id"]
         db_session.add(new_item)
         db_session.commit()
     except:
+        db_session.rollback()
         # If item could not be created, return a 500
         return jsonRespObj(
                    500,
@@ -1016,6 +2127,212 @@ def APIAddItem():
             )
 
 
+@app.route("/api/add/categories", methods=["POST"])
+def APIAddCategories():
+    # Reject with a 422 if token parameter not provided
+    if "token" not in request.args:
+        return jsonRespObj(
+                   422,
+                   "An access token is required to perform this request."
+               )
+    # Check whether API user has supplied a valid access token
+    if not checkToken(request.args["token"]):
+        return unauthenticatedError()
+    # The body must be a JSON object holding a list of categories
+    try:
+        rows = batchRows("Categories")
+    except ValueError:
+        return jsonRespObj(
+                   422,
+                   "Body must be a JSON object holding at most {} "
+                   "categories under 'Categories'.".format(BATCH_MAX_ROWS)
+               )
+
+    # Validate every category, keeping the valid ones for insertion
+    results = []
+    new_categories = []
+    for index, row in enumerate(rows):
+        values = validateCategoryRow(row)
+        if isinstance(values, str):
+            results.append({"index": index, "status": "error",
+                            "message": values})
+        else:
+            results.append({"index": index, "status": "ok"})
+            new_categories.append(values)
+
+    # Insert all valid categories in a single transaction
+    if new_categories:
+        try:
+            db_session.execute(Category.__table__.insert(), new_categories)
+            db_session.commit()
+        except:
+            db_session.rollback()
+            # If categories could not be created, return a 500
+            return jsonRespObj(
+                       500,
+                       "Server-side error occurred during category creation."
+                   )
+    return batchRespObj(results, len(new_categories))
+
+
+@app.route("/api/add/items", methods=["POST"])
+def APIAddItems():
+    # Reject with a 422 if token parameter not provided
+    if "token" not in request.args:
+        return jsonRespObj(
+                   422,
+                   "An access token is required to perform this request."
+               )
+    # Check whether API user has supplied a valid access token
+    if not checkToken(request.args["token"]):
+        return unauthenticatedError()
+    # The body must be a JSON object holding a list of items
+    try:
+        rows = batchRows("Items")
+    except ValueError:
+        return jsonRespObj(
+                   422,
+                   "Body must be a JSON object holding at most {} "
+                   "items under 'Items'.".format(BATCH_MAX_ROWS)
+               )
+
+    # Validate every item, keeping the valid ones for insertion
+    category_ids = set(category_id for (category_id,)
+                       in db_session.query(Category.id))
+    results = []
+    new_items = []
+    for index, row in enumerate(rows):
+        values = validateItemRow(row, category_ids)
+        if isinstance(values, str):
+            results.append({"index": index, "status": "error",
+                            "message": values})
+        else:
+            results.append({"index": index, "status": "ok"})
+            new_items.append(values)
+
+    # Insert all valid items with one executemany in a single transaction
+    if new_items:
+        try:
+            db_session.execute(Item.__table__.insert(), new_items)
+            db_session.commit()
+        except:
+            db_session.rollback()
+            # If items could not be created, return a 500
+            return jsonRespObj(
+                       500,
+                       "Server-side error occurred during item creation."
+                   )
+    return batchRespObj(results, len(new_items))
+
+
+@app.route("/api/adjust/stock", methods=["POST"])
+def APIAdjustStock():
+    # Reject with a 422 if token parameter not provided
+    if "token" not in request.args:
+        return jsonRespObj(
+                   422,
+                   "An access token is required to perform this request."
+               )
+    # Check whether API user has supplied a valid access token
+    if not checkToken(request.args["token"]):
+        return unauthenticatedError()
+    if "id" not in request.args or "delta" not in request.args:
+        return jsonRespObj(
+                   422,
+                   "Item ID and stock delta must be provided to execute "
+                   "request."
+               )
+    try:
+        item_id = parseInteger(request.args["id"])
+        delta = parseInteger(request.args["delta"])
+    except ValueError:
+        return jsonRespObj(422, STOCK_PARAMS_MESSAGE)
+
+    # Adjust the stock in a single conditional UPDATE, so concurrent
+    # adjustments are never lost
+    try:
+        result = adjustStock(item_id, delta)
+        db_session.commit()
+    except:
+        db_session.rollback()
+        # If stock could not be adjusted, return a 500
+        return jsonRespObj(
+                   500,
+                   "Server-side error occurred during stock adjustment."
+               )
+    if isinstance(result, str):
+        # Return a 404 for unknown items, a 409 if stock is too low
+        return jsonRespObj(
+                   404 if result == STOCK_UNKNOWN_ITEM_MESSAGE else 409,
+                   result
+               )
+    response = jsonify(status=200, id=item_id, stock=result)
+    response.status_code = 200
+    return response
+
+
+@app.route("/api/adjust/stocks", methods=["POST"])
+def APIAdjustStocks():
+    # Reject with a 422 if token parameter not provided
+    if "token" not in request.args:
+        return jsonRespObj(
+                   422,
+                   "An access token is required to perform this request."
+               )
+    # Check whether API user has supplied a valid access token
+    if not checkToken(request.args["token"]):
+        return unauthenticatedError()
+    # The body must be a JSON object holding a list of adjustments
+    try:
+        rows = batchRows("Adjustments")
+    except ValueError:
+        return jsonRespObj(
+                   422,
+                   "Body must be a JSON object holding at most {} "
+                   "adjustments under 'Adjustments'.".format(BATCH_MAX_ROWS)
+               )
+    # With atomic=true, one failed adjustment rejects the whole batch
+    atomic = request.args.get("atomic", "false").lower() == "true"
+
+    # Apply every adjustment in a single transaction, each as its own
+    # conditional UPDATE; failed ones leave their item unchanged
+    results = []
+    try:
+        for index, row in enumerate(rows):
+            try:
+                item_id = parseInteger(row["id"])
+                result = adjustStock(item_id, parseInteger(row["delta"]))
+            except (ValueError, KeyError, TypeError):
+                result = STOCK_PARAMS_MESSAGE
+            if isinstance(result, str):
+                results.append({"index": index, "status": "error",
+                                "message": result})
+            else:
+                results.append({"index": index, "status": "ok",
+                                "id": item_id, "stock": result})
+        applied = sum(result["status"] == "ok" for result in results)
+        if atomic and applied < len(results):
+            db_session.rollback()
+            applied = 0
+            for result in results:
+                if result["status"] == "ok":
+                    result.update(status="error", message="Batch rejected.")
+                    del result["stock"]
+        else:
+            db_session.commit()
+    except:
+        db_session.rollback()
+        # If stock could not be adjusted, return a 500
+        return jsonRespObj(
+                   500,
+                   "Server-side error occurred during stock adjustment."
+               )
+    response = jsonify(status=200, applied=applied,
+                       rejected=len(results) - applied, Results=results)
+    response.status_code = 200
+    return response
+
+
 # PUT ROUTES #
 
 @app.route("/api/update/category", methods=["PUT"])
@@ -1053,6 +2370,7 @@ def APIUpdateCategory():
         category.name = request.args["name"]
         db_session.commit()
     except:
+        db_session.rollback()
         # If category could not be updated, return a 500
         return jsonRespObj(
                    500,
@@ -1089,7 +2407,8 @@ def APIUpdateItem():
                    ).one()
     except NoResultFound:
         return jsonRespObj(404, "No item to update found under this ID.")
-    if ("name" or "price" or "stock" or "description") not in request.args:
+    if not any(field in request.args
+               for field in ("name", "price", "stock", "description")):
         return jsonRespObj(
                    422,
                    "Nothing to update if no new data is provided."
@@ -1100,10 +2419,13 @@ def APIUpdateItem():
     if "name" in request.args:
         item.name = request.args["name"]
     if "price" in request.args:
-        if request.args["price"][0] != "$":
-            item.price = "$" + request.args["price"]
-        else:
+        try:
             item.price = request.args["price"]
+        except ValueError:
+            return jsonRespObj(
+                       422,
+                       "Price must be a non-negative amount in whole cents."
+                   )
     if "stock" in request.args:
         item.stock = request.args["stock"]
     if "description" in request.args:
@@ -1113,6 +2435,7 @@ def APIUpdateItem():
     try:
         db_session.commit()
     except:
+        db_session.rollback()
         # If item could not be updated, return a 500
         return jsonRespObj(
                    500,
@@ -1157,14 +2480,10 @@ def APIDeleteCategory():
 
     # Attempt to delete the category and all associated items
     try:
-        items = db_session.query(Item).filter_by(
-                    category_id=request.args["id"]
-                )
-        for item in items:
-            db_session.delete(item)
-        db_session.delete(category)
+        deleteCategoryWithItems(category)
         db_session.commit()
     except:
+        db_session.rollback()
         # Return a 500 if category could not be deleted
         return jsonRespObj(
                    500,
@@ -1206,9 +2525,10 @@ def APIDeleteItem():
     old_name = item.name
     # Attempt to delete the item
     try:
-        item.delete()
+        db_session.delete(item)
         db_session.commit()
     except:
+        db_session.rollback()
         # Return a 500 if item could not be deleted
         return jsonRespObj(
                    500,
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+##########################################################################
+# Bounded worker pools for moving slow CPU or I/O work off request       #
+# threads without letting a burst of requests queue unbounded work.     #
+##########################################################################
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PoolSaturated(Exception):
+    """ Raised when a bounded pool already holds its maximum of tasks. """
+
+
+class BoundedExecutor(object):
+    """
+    Thread pool accepting at most max_pending queued or running tasks.
+
+    Submitting beyond that limit raises PoolSaturated immediately instead
+    of queueing, so callers can shed load (e.g. answer 503) rather than
+    pile up waiting threads.
+    """
+
+    def __init__(self, max_workers, max_pending, name):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, function, *args, **kwargs):
+        """ Schedule function(*args, **kwargs) and return its Future. """
+        if not self._slots.acquire(blocking=False):
+            raise PoolSaturated("Pool '{}' is saturated.".format(self.name))
+        try:
+            future = self._executor.submit(function, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda done: self._slots.release())
+        return future
+
+    def run(self, function, *args, **kwargs):
+        """ Run function on the pool, wait for it and return its result. """
+        return self.submit(function, *args, **kwargs).result()
+
+    def shutdown(self, wait=True):
+        """ Stop accepting tasks and optionally wait for running ones. """
+        self._executor.shutdown(wait=wait)